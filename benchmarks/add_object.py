@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+# Measure the latency of Storage.add_object() and the number of engine calls
+# it makes per added object. By default the engine is simulated, with each
+# call taking a database round trip, use --mongodb to run against a local
+# MongoDB server (the object collection is cleared).
+#
+import argparse
+import asyncio
+import collections
+import pathlib
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server.storage import Storage
+
+# Simulated database round trip, in seconds
+ROUND_TRIP = 0.0005
+
+class SimulatedEngine:
+    POOL_SIZE = 8
+
+    def __init__(self):
+        self._sessions = {'default'}
+        self._objects = {}
+
+    def get_session(self, name):
+        time.sleep(ROUND_TRIP)
+        return {'Name': name} if name in self._sessions else None
+
+    def add_object(self, data, temp_file=None):
+        time.sleep(ROUND_TRIP)
+        if data['Uid'] in self._objects:
+            return False
+        self._objects[data['Uid']] = dict(data)
+        return True
+
+    def get_object(self, uid):
+        time.sleep(ROUND_TRIP)
+        return self._objects.get(uid)
+
+    def move_objects(self, moves):
+        time.sleep(ROUND_TRIP)
+        return True
+
+# Count the calls made to the wrapped engine
+class CountingEngine:
+    def __init__(self, engine):
+        self._engine = engine
+        self.calls = collections.Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._engine, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            return attr(*args, **kwargs)
+        return call
+
+def make_object(uid):
+    return {
+        'Uid': uid,
+        'Session': 'default',
+        'ObjectType': 'Text',
+        'Position': [0.0, 0.0, 0.0],
+        'Scale': [1.0, 1.0, 1.0],
+        'Rotation': [0.0, 0.0, 0.0, 1.0],
+        'Text': 'Benchmark'}
+
+async def run(engine, count):
+    storage = Storage(engine, engine.POOL_SIZE)
+    latencies = []
+    uids = [str(uuid.uuid4()) for i in range(count)]
+    for uid in uids:
+        start = time.perf_counter()
+        await storage.add_object(make_object(uid))
+        latencies.append(time.perf_counter() - start)
+    add_calls = dict(engine.calls)
+    engine.calls.clear()
+    # Adding the same objects again must fail
+    duplicates = 0
+    for uid in uids[:100]:
+        if await storage.add_object(make_object(uid)) is None:
+            duplicates += 1
+    duplicate_calls = sum(engine.calls.values())
+    await storage.close()
+    return latencies, add_calls, duplicates, duplicate_calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--mongodb', action='store_true')
+    args = parser.parse_args()
+
+    if args.mongodb:
+        from session_server.storage_mongodb import StorageMongoDB
+        base = StorageMongoDB('/tmp/session-server-benchmark')
+        base.clear_all()
+    else:
+        base = SimulatedEngine()
+    engine = CountingEngine(base)
+    loop = asyncio.get_event_loop()
+    latencies, add_calls, duplicates, duplicate_calls = loop.run_until_complete(run(engine, args.count))
+    calls = sum(add_calls.values())
+    print(f'objects added:      {args.count}')
+    print(f'mean latency:       {statistics.mean(latencies) * 1000:.3f} ms')
+    print(f'p99 latency:        {sorted(latencies)[int(len(latencies) * 0.99)] * 1000:.3f} ms')
+    print(f'engine calls/add:   {calls / args.count:.2f} {add_calls}')
+    print(f'duplicates refused: {duplicates}/100 with {duplicate_calls} engine calls')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+#
+# Compare the CPU time needed to prepare a broadcast of ITEM_MOVED for
+# a growing number of clients, serializing the message for every client
+# versus serializing it once and adding the sequence number.
+#
+import json
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server import protocol
+
+MESSAGE = {
+    'Event': 'ITEM_MOVED',
+    'Uid': '7e10441e-c88e-4d8c-9e6b-60cf96bbadc6',
+    'Position': [0.125, 1.5, -3.25],
+    'Scale': [1.0, 1.0, 1.0],
+    'Rotation': [0.0, 0.7071068, 0.0, 0.7071068]}
+
+def per_client(clients):
+    for seq in range(clients):
+        json.dumps({'Seq': seq, **MESSAGE})
+
+def once(clients):
+    body = protocol.encode(MESSAGE)
+    for seq in range(clients):
+        protocol.add_seq(body, seq)
+
+def main():
+    print(f'{"clients":>8} {"per client (us)":>16} {"once (us)":>10} {"speedup":>8}')
+    for clients in (1, 5, 10, 25, 50, 100, 250):
+        number = max(10000 // clients, 100)
+        a = min(timeit.repeat(lambda: per_client(clients), number=number, repeat=5)) / number
+        b = min(timeit.repeat(lambda: once(clients), number=number, repeat=5)) / number
+        print(f'{clients:>8} {a * 1e6:>16.1f} {b * 1e6:>10.1f} {a / b:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
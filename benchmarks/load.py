@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+#
+# Load test of the whole server on one machine: the server runs in a child
+# process with the SQLite engine in a temporary directory, so no database
+# server or network access is needed.
+#
+# Simulated WebSockets clients spread over the sessions repeatedly select an
+# object, drag it with a move every move delay advertised by the server,
+# deselect it, and sometimes add and remove objects. At the same time HTTP
+# clients upload files and read all objects of the sessions.
+#
+# Reports the end-to-end latency of the broadcast moves (from sending the
+# move to receiving it by the other clients of the session), the throughput
+# of the requests, the event loop lag and the memory used by the server. The
+# memory is read from /proc, so it is only reported on Linux.
+#
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+import websockets
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# Seconds to wait for the server to start
+STARTUP_TIMEOUT = 10.0
+# Objects added and not yet removed by each client
+ADDED_OBJECTS = 5
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Run in the child process, the highest event loop lag of every second is
+# sent to the parent
+def run_server(files_dir, web_port, ws_port, conn):
+    from session_server.server import Server
+
+    logging.basicConfig(level=logging.CRITICAL)
+    Server.WEB_PORT = web_port
+    Server.WS_PORT = ws_port
+    server = Server(files_dir, engine='sqlite')
+    async def report_lag():
+        while True:
+            await asyncio.sleep(1.0)
+            conn.send(server.lag_monitor.pop_max_lag())
+    asyncio.get_event_loop().create_task(report_lag())
+    server.start()
+
+# Return the current and the highest resident set size of the process in
+# bytes, or None if not available
+def memory_usage(pid):
+    try:
+        with open(f'/proc/{pid}/status') as fp:
+            values = dict(line.split(':', 1) for line in fp)
+    except OSError:
+        return None
+    return tuple(int(values[key].split()[0]) * 1024 for key in ('VmRSS', 'VmHWM'))
+
+def make_object(uid, session, object_type='Text'):
+    return {
+        'Uid': uid,
+        'Session': session,
+        'ObjectType': object_type,
+        'Position': [0.0, 0.0, 0.0],
+        'Scale': [1.0, 1.0, 1.0],
+        'Rotation': [0.0, 0.0, 0.0, 1.0],
+        'Text': 'Load test'}
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+class Stats:
+    def __init__(self):
+        self.sent = collections.Counter()
+        self.received = collections.Counter()
+        # Latencies of the broadcast moves in seconds
+        self.move_latencies = []
+        # Request name -> latencies in seconds
+        self.requests = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.uploaded_bytes = 0
+        self.lags = []
+        self.memory = None
+
+class Client:
+    def __init__(self, index, url, session, uids, stats, args):
+        self._url = f'{url}/session/{session}'
+        self._session = session
+        self._uids = uids
+        self._stats = stats
+        self._args = args
+        self._random = random.Random(index)
+        self._move_delay = 0.1
+        self._added = collections.deque()
+        self._websocket = None
+        self._receiver = None
+
+    async def connect(self):
+        self._websocket = await websockets.connect(self._url)
+        self._receiver = asyncio.get_event_loop().create_task(self._receive())
+
+    async def close(self):
+        self._receiver.cancel()
+        await self._websocket.close()
+
+    async def _send(self, message):
+        self._stats.sent[message['Event']] += 1
+        await self._websocket.send(json.dumps(message))
+
+    async def _receive(self):
+        try:
+            async for message in self._websocket:
+                if isinstance(message, bytes):
+                    continue
+                data = json.loads(message)
+                event = data.get('Event')
+                self._stats.received[event] += 1
+                if event == 'ITEM_MOVED' and 'Position' in data:
+                    # The sending time is carried in the position
+                    self._stats.move_latencies.append(time.perf_counter() - data['Position'][0])
+                elif event == 'MOVE_DELAY_SET':
+                    self._move_delay = data['IntValue'] / 1000
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def run(self, stop):
+        while not stop.is_set():
+            uid = self._random.choice(self._uids)
+            await self._send({'Event': 'ITEM_SELECTION_CHANGED', 'Uid': uid, 'IsSelected': True})
+            for i in range(self._args.drag_moves):
+                if stop.is_set():
+                    break
+                await self._send({'Event': 'ITEM_MOVED',
+                                  'Uid': uid,
+                                  'Position': [time.perf_counter(), self._random.random(), 0.0]})
+                await asyncio.sleep(self._move_delay)
+            await self._send({'Event': 'ITEM_SELECTION_CHANGED', 'Uid': uid, 'IsSelected': False})
+            if self._random.random() < self._args.add_probability:
+                await self._add_and_remove()
+
+    async def _add_and_remove(self):
+        uid = str(uuid.uuid4())
+        await self._send({'Event': 'ITEM_ADDED', **make_object(uid, self._session)})
+        self._added.append(uid)
+        if len(self._added) > ADDED_OBJECTS:
+            await self._send({'Event': 'ITEM_REMOVED', 'Uid': self._added.popleft()})
+
+async def timed_request(stats, name, request):
+    start = time.perf_counter()
+    try:
+        async with request as resp:
+            await resp.read()
+            if resp.status >= 400:
+                stats.errors[name] += 1
+                return
+    except aiohttp.ClientError:
+        stats.errors[name] += 1
+        return
+    stats.requests[name].append(time.perf_counter() - start)
+
+async def upload_loop(http, url, session, size, stats, stop):
+    content = os.urandom(size)
+    while not stop.is_set():
+        uid = str(uuid.uuid4())
+        form = aiohttp.FormData()
+        data = make_object(uid, session, 'File')
+        for key in ('Uid', 'Session', 'ObjectType'):
+            form.add_field(key, data[key])
+        form.add_field('FileName', f'{uid}.bin')
+        for key in ('Position', 'Scale', 'Rotation'):
+            form.add_field(key, json.dumps(data[key]))
+        # Distinct content, as equal files are only stored once
+        form.add_field('FileContent', uid.encode() + content, filename=f'{uid}.bin')
+        await timed_request(stats, 'upload', http.post(f'{url}/item/add', data=form))
+        stats.uploaded_bytes += size
+
+async def read_loop(http, url, session, stats, stop):
+    while not stop.is_set():
+        await timed_request(stats, 'read', http.get(f'{url}/item/all/{session}'))
+
+async def setup(http, url, sessions, objects):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            async with http.get(f'{url}/session/all') as resp:
+                if resp.status == 200:
+                    break
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError('Server did not start')
+        await asyncio.sleep(0.1)
+    uids = {}
+    for session in sessions:
+        form = aiohttp.FormData()
+        form.add_field('Name', session)
+        async with http.post(f'{url}/session/add', data=form) as resp:
+            await resp.read()
+        uids[session] = [str(uuid.uuid4()) for i in range(objects)]
+        items = [make_object(uid, session) for uid in uids[session]]
+        async with http.post(f'{url}/item/add/batch', json={'Items': items}) as resp:
+            await resp.read()
+    return uids
+
+async def monitor_server(process, conn, stats, stop):
+    while not stop.is_set():
+        await asyncio.sleep(0.5)
+        while conn.poll():
+            stats.lags.append(conn.recv())
+        stats.memory = memory_usage(process.pid) or stats.memory
+
+async def run(args, process, conn, web_port, ws_port):
+    stats = Stats()
+    http_url = f'http://127.0.0.1:{web_port}'
+    ws_url = f'ws://127.0.0.1:{ws_port}'
+    sessions = [f'load-{i}' for i in range(args.sessions)]
+    stop = asyncio.Event()
+    async with aiohttp.ClientSession() as http:
+        uids = await setup(http, http_url, sessions, args.objects)
+        clients = [Client(i, ws_url, sessions[i % len(sessions)],
+                          uids[sessions[i % len(sessions)]], stats, args)
+                   for i in range(args.clients)]
+        for client in clients:
+            await client.connect()
+        # Drop the events received while connecting
+        await asyncio.sleep(0.5)
+        stats.received.clear()
+        tasks = [client.run(stop) for client in clients]
+        tasks += [upload_loop(http, http_url, sessions[i % len(sessions)],
+                              args.upload_size * 1024, stats, stop)
+                  for i in range(args.uploaders)]
+        tasks += [read_loop(http, http_url, sessions[i % len(sessions)], stats, stop)
+                  for i in range(args.readers)]
+        tasks.append(monitor_server(process, conn, stats, stop))
+        loop = asyncio.get_event_loop()
+        loop.call_later(args.duration, stop.set)
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        stats.memory = memory_usage(process.pid) or stats.memory
+        # The server is stopped first, so that it does not log the
+        # disconnecting clients
+        process.terminate()
+        for client in clients:
+            await client.close()
+    return stats, elapsed
+
+def report(args, stats, elapsed):
+    print(f'{args.clients} WebSockets clients in {args.sessions} sessions, '
+          f'{args.uploaders} uploaders, {args.readers} readers, {elapsed:.1f} s')
+    print()
+    print(f'{"":>22} {"count":>10} {"per s":>10}')
+    for event in ('ITEM_MOVED', 'ITEM_SELECTION_CHANGED', 'ITEM_ADDED', 'ITEM_REMOVED'):
+        print(f'{"sent " + event:>22} {stats.sent[event]:>10} {stats.sent[event] / elapsed:>10.1f}')
+    received = sum(stats.received.values())
+    print(f'{"received messages":>22} {received:>10} {received / elapsed:>10.1f}')
+    print()
+    latencies = stats.move_latencies
+    print(f'{"":>22} {"p50 (ms)":>10} {"p99 (ms)":>10} {"max (ms)":>10}')
+    print(f'{"move broadcast":>22} {percentile(latencies, 0.5) * 1000:>10.1f} '
+          f'{percentile(latencies, 0.99) * 1000:>10.1f} {max(latencies or [0]) * 1000:>10.1f}')
+    for name, times in sorted(stats.requests.items()):
+        print(f'{name + " request":>22} {percentile(times, 0.5) * 1000:>10.1f} '
+              f'{percentile(times, 0.99) * 1000:>10.1f} {max(times) * 1000:>10.1f}')
+    print()
+    for name, times in sorted(stats.requests.items()):
+        print(f'{name + " requests":>22} {len(times):>10} {len(times) / elapsed:>10.1f} '
+              f'errors {stats.errors[name]}')
+    print(f'{"upload throughput":>22} {stats.uploaded_bytes / elapsed / 1024 / 1024:>10.1f} MiB/s')
+    if stats.lags:
+        print(f'{"server loop lag":>22} mean {sum(stats.lags) / len(stats.lags) * 1000:.1f} ms, '
+              f'max {max(stats.lags) * 1000:.1f} ms (highest of each second)')
+    if stats.memory is not None:
+        print(f'{"server memory":>22} RSS {stats.memory[0] / 1024 / 1024:.1f} MiB, '
+              f'peak {stats.memory[1] / 1024 / 1024:.1f} MiB')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50, help='WebSockets clients')
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--objects', type=int, default=200, help='objects per session')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--drag-moves', type=int, default=20,
+                        help='moves sent while an object is selected')
+    parser.add_argument('--add-probability', type=float, default=0.2,
+                        help='probability of adding and removing an object after a drag')
+    parser.add_argument('--uploaders', type=int, default=2, help='concurrent uploads')
+    parser.add_argument('--upload-size', type=int, default=256, help='upload size in KiB')
+    parser.add_argument('--readers', type=int, default=2,
+                        help='concurrent reads of all session objects')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='load-benchmark-')
+    web_port, ws_port = free_port(), free_port()
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=run_server,
+                              args=(os.path.join(directory, 'files'), web_port, ws_port,
+                                    child_conn))
+    process.start()
+    try:
+        loop = asyncio.get_event_loop()
+        stats, elapsed = loop.run_until_complete(run(args, process, parent_conn,
+                                                     web_port, ws_port))
+        report(args, stats, elapsed)
+    finally:
+        process.terminate()
+        process.join()
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
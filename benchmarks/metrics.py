@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# Measure the cost of recording a sample of the metrics on the hot paths, and
+# the time to render the metrics of a busy server. The WS message row is all
+# the samples recorded for a received move: its size, its processing time,
+# the time of its broadcast and the fan-out.
+#
+import pathlib
+import sys
+import time
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server import metrics
+
+EVENTS = ('ITEM_ADDED', 'ITEM_MOVED', 'ITEM_REMOVED', 'ITEM_SELECTION_CHANGED')
+SESSIONS = 1000
+
+def measure(stmt, namespace, number=200000):
+    return min(timeit.repeat(stmt, globals=namespace, number=number, repeat=5)) / number * 1e9
+
+def main():
+    registry = metrics.Metrics()
+    counter = registry.counter('bench_total', 'Counter').labels()
+    latencies = registry.histogram('bench_seconds', 'Latency', ('event',))
+    fanout = registry.histogram('bench_recipients', 'Fan-out',
+                                buckets=metrics.FANOUT_BUCKETS).labels()
+    for event in EVENTS:
+        latencies[event].observe(0.001)
+    registry.gauge('bench_clients', 'Clients', lambda: {(str(i),): i for i in range(SESSIONS)},
+                   ('session',))
+    namespace = {'counter': counter, 'latencies': latencies, 'fanout': fanout, 'time': time}
+    rows = (
+        ('counter', 'counter.inc()'),
+        ('histogram', "fanout.observe(37)"),
+        ('labelled histogram', "latencies['ITEM_MOVED'].observe(0.0004)"),
+        ('timed sample', "start = time.perf_counter()\n"
+                         "latencies['ITEM_MOVED'].observe(time.perf_counter() - start)"),
+        ('WS message', "counter.inc(120)\n"
+                       "start = time.perf_counter()\n"
+                       "latencies['ITEM_MOVED'].observe(time.perf_counter() - start)\n"
+                       "start = time.perf_counter()\n"
+                       "fanout.observe(37)\n"
+                       "latencies['ITEM_MOVED'].observe(time.perf_counter() - start)"))
+    print(f'Python {sys.version.split()[0]}')
+    print(f'{"sample":>20} {"ns":>8}')
+    for name, stmt in rows:
+        print(f'{name:>20} {measure(stmt, namespace):>8.0f}')
+    render = min(timeit.repeat(registry.render, number=10, repeat=5)) / 10 * 1e3
+    print(f'render with {SESSIONS} sessions: {render:.2f} ms')
+
+if __name__ == '__main__':
+    main()
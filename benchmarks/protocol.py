@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+#
+# Compare the size and the encode/decode time of ITEM_MOVED messages in the
+# JSON and the binary protocol.
+#
+import json
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server import protocol
+
+MESSAGES = {
+    'position': {
+        'Event': 'ITEM_MOVED',
+        'Uid': '7e10441e-c88e-4d8c-9e6b-60cf96bbadc6',
+        'Position': [0.12345678, 1.5, -3.25]},
+    'full': {
+        'Event': 'ITEM_MOVED',
+        'Uid': '7e10441e-c88e-4d8c-9e6b-60cf96bbadc6',
+        'Position': [0.12345678, 1.5, -3.25],
+        'Scale': [1.0, 1.0, 1.0],
+        'Rotation': [0.0, 0.70710678, 0.0, 0.70710678]}}
+
+def measure(func, number=20000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def main():
+    print(f'{"message":>10} {"format":>7} {"bytes":>6} {"encode (us)":>12} {"decode (us)":>12}')
+    for name, message in MESSAGES.items():
+        json_data = protocol.add_seq(protocol.encode(message), 1)
+        binary_data = protocol.add_seq(protocol.encode_move(message), 1)
+        rows = (
+            ('json', len(json_data.encode()),
+             measure(lambda: protocol.add_seq(json.dumps(message), 1)),
+             measure(lambda: protocol.decode(json_data))),
+            ('binary', len(binary_data),
+             measure(lambda: protocol.add_seq(protocol.encode_move(message), 1)),
+             measure(lambda: protocol.decode(binary_data))))
+        for fmt, size, encode, decode in rows:
+            print(f'{name:>10} {fmt:>7} {size:>6} {encode:>12.2f} {decode:>12.2f}')
+
+if __name__ == '__main__':
+    main()
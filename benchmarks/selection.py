@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Measure the time to release the selections of a disconnecting client
+# which selected a few objects, while the other clients hold many
+# selections. The former selection dictionary was scanned completely on
+# every disconnect, the selection manager only visits the selections of
+# the client.
+#
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server.selection import SelectionManager
+
+CLIENTS = 100
+OWN_SELECTIONS = 10
+ROUNDS = 1000
+
+# The former implementation, uid -> set of idents
+def scan_deselect_all(selection, ident):
+    for uid in list(selection.keys()):
+        idents = selection[uid]
+        if ident in idents:
+            idents.remove(ident)
+            if not idents:
+                del selection[uid]
+
+def measure(total):
+    per_client = total // CLIENTS
+    manager = SelectionManager(max_per_ident=per_client + OWN_SELECTIONS,
+                               max_selections=total + OWN_SELECTIONS)
+    selection = {}
+    for client in range(CLIENTS):
+        for i in range(per_client):
+            uid = f'{client}-{i}'
+            manager.select(uid, client)
+            selection.setdefault(uid, set()).add(client)
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for i in range(OWN_SELECTIONS):
+            selection.setdefault(f'own-{i}', set()).add('leaving')
+        scan_deselect_all(selection, 'leaving')
+    scan = (time.perf_counter() - start) / ROUNDS
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for i in range(OWN_SELECTIONS):
+            manager.select(f'own-{i}', 'leaving')
+        manager.deselect_all('leaving')
+    indexed = (time.perf_counter() - start) / ROUNDS
+    print(f'{total:>12} {scan * 1e6:>12.1f} {indexed * 1e6:>12.1f}')
+
+def main():
+    print(f'{"selections":>12} {"scan (us)":>12} {"index (us)":>12}')
+    for total in (1000, 10000, 100000):
+        measure(total)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# Compare the memory used by the objects of a session held as the
+# dictionaries returned by the storage engine and as resident ObjectState
+# records, and the time to produce the object dictionaries from them.
+#
+import pathlib
+import sys
+import timeit
+import tracemalloc
+import uuid
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server.session_state import ObjectState, SessionState
+from session_server.storage import Storage
+
+OBJECTS = 10000
+
+def make_object(i):
+    return {
+        'Uid': str(uuid.uuid4()),
+        'Session': 'default',
+        'ObjectType': 'Text',
+        'Position': [i * 0.5, 1.25, -3.0],
+        'Scale': [1.0, 1.0, 1.0],
+        'Rotation': [0.0, 0.70710678, 0.0, 0.70710678],
+        'Text': f'Object {i}'}
+
+def measure_memory(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return result, size
+
+def main():
+    fields = Storage.EXTRA_FIELDS['Text']
+    data = [make_object(i) for i in range(OBJECTS)]
+    dicts, dict_size = measure_memory(lambda: [dict(item, Position=list(item['Position']),
+                                                    Scale=list(item['Scale']),
+                                                    Rotation=list(item['Rotation']))
+                                               for item in data])
+
+    def build_state():
+        state = SessionState('default')
+        for item in data:
+            state.objects[item['Uid']] = ObjectState(item, fields)
+        return state
+    state, state_size = measure_memory(build_state)
+
+    print(f'{OBJECTS} objects')
+    print(f'{"dict":>12}: {dict_size / OBJECTS:7.1f} bytes per object')
+    print(f'{"ObjectState":>12}: {state_size / OBJECTS:7.1f} bytes per object '
+          f'(reported {state.size() / OBJECTS:.1f})')
+    number = 10
+    elapsed = min(timeit.repeat(lambda: [obj.to_dict('default', fields) for obj in
+                                             state.objects.values()],
+                                number=number, repeat=3)) / number
+    print(f'to_dict() of all objects: {elapsed * 1000:.2f} ms')
+
+if __name__ == '__main__':
+    main()
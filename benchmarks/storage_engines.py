@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# Compare the storage engines head to head: the startup time and the time of
+# the engine calls used by the server, called directly without the Storage
+# layer. The SQLite engine uses a database in a temporary directory, the
+# MongoDB engine requires a local MongoDB server and is skipped when it is
+# not available (its collections are cleared).
+#
+import argparse
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+def make_object(uid, session):
+    return {
+        'Uid': uid,
+        'Session': session,
+        'ObjectType': 'Text',
+        'Position': [0.0, 0.0, 0.0],
+        'Scale': [1.0, 1.0, 1.0],
+        'Rotation': [0.0, 0.0, 0.0, 1.0],
+        'Text': 'Benchmark'}
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def run(create, count):
+    elapsed, engine = timed(create)
+    results = {'startup': elapsed}
+    engine.clear_all()
+    engine.add_session({'Name': 'benchmark'})
+    uids = [str(uuid.uuid4()) for i in range(count)]
+
+    start = time.perf_counter()
+    for uid in uids[:count // 10]:
+        engine.add_object(make_object(uid, 'benchmark'))
+    results['add_object'] = (time.perf_counter() - start) / (count // 10)
+    elapsed, added = timed(engine.add_objects,
+                           [make_object(uid, 'benchmark') for uid in uids[count // 10:]])
+    results['add_objects'] = elapsed / len(added)
+    moves = {uid: ([1.0, 2.0, 3.0], None, [0.0, 1.0, 0.0, 0.0]) for uid in uids}
+    elapsed, _ = timed(engine.move_objects, moves)
+    results['move_objects'] = elapsed / count
+    start = time.perf_counter()
+    for uid in uids[:count // 10]:
+        engine.get_object(uid)
+    results['get_object'] = (time.perf_counter() - start) / (count // 10)
+    elapsed, objects = timed(engine.load_objects, 'benchmark')
+    results['load_objects'] = elapsed / len(objects)
+    elapsed, objects = timed(lambda: list(engine.iter_objects('benchmark', None, None, count)))
+    results['iter_objects'] = elapsed / len(objects)
+    elapsed, removed = timed(engine.remove_objects, uids)
+    results['remove_objects'] = elapsed / len(removed)
+    engine.clear_all()
+    return results
+
+def create_sqlite(files_dir):
+    from session_server.storage_sqlite import StorageSQLite
+    return lambda: StorageSQLite(str(files_dir))
+
+def create_mongodb(files_dir):
+    try:
+        import pymongo
+        from session_server.storage_mongodb import StorageMongoDB
+    except ImportError:
+        return None
+    client = pymongo.MongoClient(serverSelectionTimeoutMS=1000)
+    try:
+        client.server_info()
+    except pymongo.errors.PyMongoError:
+        return None
+    return lambda: StorageMongoDB(str(files_dir))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    args = parser.parse_args()
+
+    directory = pathlib.Path(tempfile.mkdtemp(prefix='engine-benchmark-'))
+    try:
+        engines = [('sqlite', create_sqlite(directory / 'files')),
+                   ('mongodb', create_mongodb(directory / 'files'))]
+        columns = []
+        for name, create in engines:
+            if create is None:
+                print(f'{name}: not available, skipped')
+                continue
+            columns.append((name, run(create, args.count)))
+        print(f'{"":>16}' + ''.join(f'{name:>14}' for (name, results) in columns))
+        for key in columns[0][1]:
+            unit = 'ms' if key == 'startup' else 'us/object'
+            scale = 1e3 if key == 'startup' else 1e6
+            print(f'{key:>16}' + ''.join(f'{results[key] * scale:>14.1f}'
+                                         for (name, results) in columns) + f'  {unit}')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Measure the throughput of writing an uploaded file and the event loop lag
+# it causes: the former blocking writes of 8 KiB chunks into the system
+# temporary directory followed by a move into the files directory, against
+# staged writes in the executor followed by a rename. The final move is done
+# in the executor in both cases, as the storage engine does.
+#
+# The upload is simulated by a reader which returns the chunks without
+# network I/O, so the difference is in the disk writes only.
+#
+import argparse
+import asyncio
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from session_server import uploads
+from session_server.load_monitor import LoopLagMonitor
+
+class Reader:
+    def __init__(self, size):
+        self._remaining = size
+        self._data = os.urandom(4 * 1024 * 1024)
+
+    async def read_chunk(self, size=8192):
+        # Yield to the loop like a socket read would
+        await asyncio.sleep(0)
+        size = min(size, self._remaining, len(self._data))
+        self._remaining -= size
+        return self._data[:size]
+
+async def blocking_upload(size, target):
+    reader = Reader(size)
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, mode='wb') as fp:
+        while True:
+            chunk = await reader.read_chunk()
+            if not chunk:
+                break
+            fp.write(chunk)
+    await asyncio.get_event_loop().run_in_executor(None, shutil.move, path, target)
+
+async def staged_upload(size, target, chunk_size):
+    reader = Reader(size)
+    staging_dir = uploads.staging_dir(os.path.dirname(target))
+    path, digest = await uploads.stage_upload(reader.read_chunk, staging_dir, chunk_size)
+    await asyncio.get_event_loop().run_in_executor(None, os.replace, path, target)
+
+async def measure(name, size, upload):
+    monitor = LoopLagMonitor()
+    monitor.INTERVAL = 0.01
+    monitor.start()
+    await asyncio.sleep(0.05)
+    monitor.pop_max_lag()
+    start = time.perf_counter()
+    await upload
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.02)
+    max_lag = monitor.pop_max_lag()
+    monitor.stop()
+    print(f'{name:>24} {size / elapsed / 1024 / 1024:>10.1f} {max_lag * 1000:>13.1f}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1024, help='upload size in MiB')
+    parser.add_argument('--dir', default=None,
+                        help='files directory, by default a temporary directory')
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    files_dir = args.dir or tempfile.mkdtemp(prefix='upload-benchmark-')
+    os.makedirs(files_dir, exist_ok=True)
+    loop = asyncio.get_event_loop()
+    print(f'{"method":>24} {"MiB/s":>10} {"max lag (ms)":>13}')
+    target = os.path.join(files_dir, 'upload')
+    try:
+        loop.run_until_complete(measure('blocking 8 KiB', size,
+                                        blocking_upload(size, target)))
+        os.unlink(target)
+        for chunk_size in (64 * 1024, 1024 * 1024, 4 * 1024 * 1024):
+            loop.run_until_complete(measure(f'staged {chunk_size // 1024} KiB', size,
+                                            staged_upload(size, target, chunk_size)))
+            os.unlink(target)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(files_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import errno
+import logging
+import os
+import re
+import shutil
+from contextlib import suppress
+
+# Content-addressed store of the uploaded files, each distinct content is
+# kept once under its SHA-256 digest no matter how many objects use it. The
+# storage engine counts the references and removes unused blobs.
+class BlobStore:
+    # Directory of the blobs inside the files directory
+    DIR = '.blobs'
+
+    _DIGEST = re.compile('[0-9a-f]{64}')
+
+    def __init__(self, files_dir):
+        self._dir = os.path.join(files_dir, self.DIR)
+
+    @classmethod
+    def is_digest(cls, digest):
+        return isinstance(digest, str) and cls._DIGEST.fullmatch(digest) is not None
+
+    # Return the path of the blob, blobs are spread over subdirectories by
+    # the first byte of the digest
+    def path(self, digest):
+        if not self.is_digest(digest):
+            return None
+        return os.path.join(self._dir, digest[:2], digest)
+
+    def exists(self, digest):
+        path = self.path(digest)
+        return path is not None and os.path.exists(path)
+
+    # Move the staged file into the store, unless the blob exists already
+    def put(self, temp_file, digest):
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.unlink(temp_file)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(temp_file, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(temp_file, path)
+
+    def remove(self, digest):
+        path = self.path(digest)
+        if path is None:
+            return
+        logging.debug(f'Deleting blob {digest}')
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+        with suppress(OSError):
+            os.rmdir(os.path.dirname(path))
@@ -0,0 +1,109 @@
+import collections
+import os
+import time
+
+from . import protocol
+
+# Bounded log of the recent events of a session, used to resend the missed
+# events to reconnecting clients
+#
+# Every event gets a position, increasing by one with each event. Only the
+# latest move of each object is kept, the transform fields of the earlier
+# moves which it does not contain are merged into it.
+class SessionEventLog:
+    # Maximum total size of the encoded events in bytes
+    MAX_BYTES = 1024 * 1024
+    # Events older than this are evicted, in seconds
+    MAX_AGE = 300.0
+
+    def __init__(self):
+        # Identifies this log, positions from other logs (for example from
+        # before the server restarted) are not valid here
+        self.epoch = os.urandom(8).hex()
+        self._pos = 0
+        # Position of the last evicted event
+        self._evicted_pos = 0
+        # pos -> (time, uid of a moved object, encoded event)
+        self._entries = collections.OrderedDict()
+        # uid -> [pos, message] of the latest move of the object, the message
+        # includes the merged fields of the earlier moves
+        self._moves = {}
+        self._size = 0
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Add the event to the log, the event is updated with its position and
+    # returned encoded
+    def append(self, message):
+        self._pos += 1
+        message['Pos'] = self._pos
+        body = protocol.encode(message)
+        event = message.get('Event')
+        uid = None
+        logged = body
+        if event == 'ITEM_MOVED':
+            uid = message.get('Uid')
+            move = self._moves.get(uid)
+            if move is None:
+                self._moves[uid] = [self._pos, message]
+            else:
+                self._remove(move)
+                if all(key in message for key in move[1]):
+                    move[1] = message
+                else:
+                    # The new move does not contain all transform fields of
+                    # the logged one
+                    move[1] = {**move[1], **message}
+                    logged = protocol.encode(move[1])
+                move[0] = self._pos
+        elif event == 'ITEM_REMOVED':
+            self._remove(self._moves.pop(message.get('Uid'), None))
+        elif event == 'ITEM_REMOVED_BATCH':
+            for removed in message.get('Uids', ()):
+                self._remove(self._moves.pop(removed, None))
+        self._entries[self._pos] = (time.monotonic(), uid, logged)
+        self._size += len(logged)
+        self._evict()
+        return body
+
+    # Return the encoded events following the given position, or None if
+    # some of them are no longer available
+    def since(self, pos):
+        self._evict()
+        if pos < self._evicted_pos or pos > self._pos:
+            return None
+        return [body for (entry_pos, (created, uid, body)) in
+                    self._entries.items() if entry_pos > pos]
+
+    # Return True if all events have expired
+    def expired(self):
+        self._evict()
+        return not self._entries
+
+    def _remove(self, move):
+        if move is None:
+            return
+        created, uid, body = self._entries.pop(move[0])
+        self._size -= len(body)
+
+    def _evict(self):
+        limit = time.monotonic() - self.MAX_AGE
+        while self._entries:
+            pos, (created, uid, body) = next(iter(self._entries.items()))
+            if self._size <= self.MAX_BYTES and created >= limit:
+                break
+            self._entries.popitem(last=False)
+            self._size -= len(body)
+            self._evicted_pos = pos
+            move = self._moves.get(uid) if uid is not None else None
+            if move is not None and move[0] == pos:
+                del self._moves[uid]
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+from contextlib import suppress
+
+# Event buses connect the worker processes of the server. Every message
+# published by a worker is delivered to all the other workers, but not back
+# to the publishing one.
+#
+# Messages are dictionaries which can be encoded in JSON, the bus adds the
+# Origin field with the ID of the publishing worker.
+
+class EventBus:
+    def __init__(self, worker_id, loop=None):
+        self._worker_id = worker_id
+        self._loop = loop or asyncio.get_event_loop()
+        self._handler = None
+
+    @property
+    def worker_id(self):
+        return self._worker_id
+
+    # Set the coroutine function called with each message received from the
+    # other workers, messages are handled one at a time in the order received
+    def subscribe(self, handler):
+        self._handler = handler
+
+    def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Whether there may be other workers to publish the messages to
+    @property
+    def has_peers(self):
+        return True
+
+    def publish(self, message):
+        pass
+
+    async def _dispatch(self, message):
+        if self._handler is None or message.get('Origin') == self._worker_id:
+            return
+        try:
+            await self._handler(message)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logging.exception('Event bus message handler failed')
+
+# Bus of workers running in the same process, workers created with the same
+# group see each other's messages. Without a group the bus connects nothing,
+# which is what a single worker server uses.
+class LocalEventBus(EventBus):
+    def __init__(self, worker_id=0, group=None, loop=None):
+        super().__init__(worker_id, loop)
+        self._group = group if group is not None else []
+        self._group.append(self)
+
+    async def close(self):
+        if self in self._group:
+            self._group.remove(self)
+
+    @property
+    def has_peers(self):
+        return len(self._group) > 1
+
+    def publish(self, message):
+        peers = [bus for bus in self._group if bus is not self]
+        if not peers:
+            return
+        # Copy the message once as if it was sent to another process
+        message = json.loads(json.dumps({**message, 'Origin': self._worker_id}))
+        for bus in peers:
+            self._loop.create_task(bus._dispatch(message))
+
+_FRAME_HEADER = struct.Struct('>I')
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    length, = _FRAME_HEADER.unpack(header)
+    return await reader.readexactly(length)
+
+def _frame(data):
+    return _FRAME_HEADER.pack(len(data)) + data
+
+# Hub of the local socket event bus, it runs in the master process and relays
+# every frame received from a worker to all the other workers
+class EventBusHub:
+    def __init__(self, path, loop=None):
+        self._path = path
+        self._loop = loop or asyncio.get_event_loop()
+        self._server = None
+        self._writers = set()
+
+    @property
+    def path(self):
+        return self._path
+
+    async def start(self):
+        with suppress(FileNotFoundError):
+            os.unlink(self._path)
+        self._server = await asyncio.start_unix_server(self._handle_worker, self._path)
+        logging.info(f'Event bus hub listening on {self._path}')
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._writers):
+            writer.close()
+        with suppress(FileNotFoundError):
+            os.unlink(self._path)
+
+    async def _handle_worker(self, reader, writer):
+        self._writers.add(writer)
+        worker_id = None
+        try:
+            while True:
+                data = await _read_frame(reader)
+                if worker_id is None:
+                    # The first frame identifies the worker
+                    worker_id = json.loads(data.decode())['Origin']
+                    logging.info(f'Worker {worker_id} connected to the event bus')
+                    continue
+                self._relay(writer, data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except:
+            logging.exception('Event bus hub error')
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+        if worker_id is not None:
+            logging.info(f'Worker {worker_id} disconnected from the event bus')
+            # Let the other workers clean up the state of the worker
+            self._relay(None, json.dumps({'Type': 'WORKER_LEFT',
+                                          'Origin': None,
+                                          'Worker': worker_id}).encode())
+
+    def _relay(self, source, data):
+        frame = _frame(data)
+        for writer in self._writers:
+            if writer is not source:
+                writer.write(frame)
+
+# Bus of workers connected through a Unix domain socket to an EventBusHub
+class SocketEventBus(EventBus):
+    # Delay between reconnection attempts, in seconds
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, path, worker_id, loop=None):
+        super().__init__(worker_id, loop)
+        self._path = path
+        self._writer = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def publish(self, message):
+        if self._writer is None:
+            logging.debug('Event bus not connected, dropping message')
+            return
+        data = json.dumps({**message, 'Origin': self._worker_id}).encode()
+        self._writer.write(_frame(data))
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self._path)
+            except OSError:
+                logging.info(f'Failed to connect to the event bus at {self._path}')
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+            writer.write(_frame(json.dumps({'Origin': self._worker_id}).encode()))
+            self._writer = writer
+            try:
+                while True:
+                    data = await _read_frame(reader)
+                    await self._dispatch(json.loads(data.decode()))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logging.info('Event bus connection lost')
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+# Bus using Redis pub/sub, which requires the optional redis package and
+# allows the workers to run on multiple machines
+class RedisEventBus(EventBus):
+    CHANNEL = 'session-server'
+
+    def __init__(self, url, worker_id, loop=None):
+        super().__init__(worker_id, loop)
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError('The redis package is required for the Redis event bus')
+        self._redis = redis.asyncio.Redis.from_url(url)
+        self._outgoing = asyncio.Queue()
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [self._loop.create_task(self._receive()),
+                           self._loop.create_task(self._send())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        await self._redis.close()
+
+    def publish(self, message):
+        self._outgoing.put_nowait(json.dumps({**message, 'Origin': self._worker_id}))
+
+    async def _send(self):
+        while True:
+            data = await self._outgoing.get()
+            try:
+                await self._redis.publish(self.CHANNEL, data)
+            except asyncio.CancelledError:
+                raise
+            except:
+                logging.exception('Redis publish failed')
+
+    async def _receive(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.CHANNEL)
+        while True:
+            message = await pubsub.get_message(timeout=1.0)
+            if message is not None:
+                await self._dispatch(json.loads(message['data']))
@@ -0,0 +1,107 @@
+import asyncio
+import collections
+import logging
+import time
+
+class LoopLagMonitor:
+    # How often the event loop lag is sampled, in seconds
+    INTERVAL = 0.25
+    # Weight of the newest sample in the smoothed lag
+    SMOOTHING = 0.3
+
+    def __init__(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._task = None
+        self._lag = 0.0
+        self._max_lag = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # Smoothed event loop lag in seconds
+    @property
+    def lag(self):
+        return self._lag
+
+    # Highest lag seen since the last call
+    def pop_max_lag(self):
+        max_lag, self._max_lag = self._max_lag, 0.0
+        return max_lag
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.INTERVAL)
+            # Time the sleep took longer than requested is the time other
+            # callbacks kept the loop busy
+            lag = max(time.monotonic() - start - self.INTERVAL, 0.0)
+            self._lag += self.SMOOTHING * (lag - self._lag)
+            self._max_lag = max(self._max_lag, lag)
+
+class MoveDelayController:
+    # Limits of the move delay advertised to clients, in milliseconds
+    MIN_DELAY = 50
+    MAX_DELAY = 1000
+    # Event loop lag in seconds above which delays are raised and below
+    # which they may be lowered
+    LAG_HIGH = 0.05
+    LAG_LOW = 0.01
+    # Average number of messages queued per client
+    QUEUE_HIGH = 32
+    QUEUE_LOW = 2
+    # Number of moves sent to clients per second
+    FANOUT_HIGH = 5000
+    FANOUT_LOW = 1000
+    # Factors applied to the delay when raising and lowering it
+    INCREASE = 1.5
+    DECREASE = 0.8
+
+    def __init__(self, default_delay):
+        self._default_delay = default_delay
+        # Session name -> delay, None is used for clients which are not
+        # subscribed to any session
+        self._delays = {}
+        self._moves = collections.Counter()
+        self._last_update = time.monotonic()
+
+    def delay(self, session=None):
+        return self._delays.get(session, self._default_delay)
+
+    def record_move(self, session):
+        self._moves[session] += 1
+
+    # Recompute the delays, sessions is a dictionary of session name ->
+    # (number of clients, average number of queued messages)
+    #
+    # Return True when any of the delays changed
+    def update(self, lag, sessions):
+        now = time.monotonic()
+        elapsed = max(now - self._last_update, 0.001)
+        self._last_update = now
+        changed = False
+        for session, (clients, queued) in sessions.items():
+            fanout = self._moves.get(session, 0) * clients / elapsed
+            if lag > self.LAG_HIGH or queued > self.QUEUE_HIGH or fanout > self.FANOUT_HIGH:
+                factor = self.INCREASE
+            elif lag < self.LAG_LOW and queued < self.QUEUE_LOW and fanout < self.FANOUT_LOW:
+                factor = self.DECREASE
+            else:
+                continue
+            current = self.delay(session)
+            delay = int(min(max(current * factor, self.MIN_DELAY), self.MAX_DELAY))
+            if delay != current:
+                logging.debug(f'Move delay of session {session}: {current} -> {delay} ms')
+                self._delays[session] = delay
+                changed = True
+        # Forget sessions which no longer have clients
+        for session in list(self._delays.keys()):
+            if session not in sessions:
+                del self._delays[session]
+        self._moves.clear()
+        return changed
@@ -1,3 +1,4 @@
+import argparse
 import logging
 import pathlib
 
@@ -5,11 +6,31 @@ import pathlib
 FILES_DIR = pathlib.PurePath(__file__).parent.parent / 'files'
 
 from .server import Server
+from .workers import LOG_FORMAT, WorkerPool
 
 def run():
-    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s: %(message)s')
-    server = Server(str(FILES_DIR))
-    server.start()
+    parser = argparse.ArgumentParser(description='Shared session server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--event-bus', choices=('socket', 'redis'), default='socket',
+                        help='event bus connecting the worker processes')
+    parser.add_argument('--redis-url', default='redis://localhost',
+                        help='URL of the Redis server used by the redis event bus')
+    parser.add_argument('--sharded', action='store_true',
+                        help='serve each session by a single worker process')
+    parser.add_argument('--storage', choices=Server.ENGINES, default='mongodb',
+                        help='storage engine, sqlite keeps the data in a local file')
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+        pool = WorkerPool(str(FILES_DIR), args.workers, args.event_bus, args.redis_url,
+                          args.sharded, args.storage)
+        pool.start()
+    else:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s: %(message)s')
+        server = Server(str(FILES_DIR), engine=args.storage)
+        server.start()
 
 if __name__ == '__main__':
     run()
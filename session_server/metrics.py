@@ -0,0 +1,171 @@
+import itertools
+from bisect import bisect_left
+import numbers
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the buckets of the number of recipients of a message
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Samples are recorded on the event loop thread, so the metrics have no
+# locks and recording a sample is only a few additions
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+# Histogram with fixed buckets, the bucket of a sample is found by bisection
+# and the counts are only made cumulative when rendered
+class Histogram:
+    __slots__ = ('_bounds', '_counts', 'sum')
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        # The last count is of the +Inf bucket
+        self._counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value, _bisect=bisect_left):
+        self._counts[_bisect(self._bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    # Return (upper bound, cumulative count) of each bucket
+    def buckets(self):
+        return zip(self._bounds + (float('inf'),), itertools.accumulate(self._counts))
+
+class _Metric:
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.text}')
+        lines.append(f'# TYPE {self.name} {self.kind}')
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format(value)}')
+
+# Metric with a child of each combination of the label values, the children
+# are looked up by indexing with the label value, or a tuple of the values
+# when there are several labels
+class _Family(_Metric, dict):
+    def __init__(self, name, kind, text, labelnames, create):
+        super().__init__()
+        self.name = name
+        self.kind = kind
+        self.text = text
+        self.labelnames = labelnames
+        self._create = create
+
+    def __missing__(self, key):
+        child = self[key] = self._create()
+        return child
+
+    def labels(self, *values):
+        return self[values[0] if len(self.labelnames) == 1 else values]
+
+    def samples(self):
+        for key, child in self.items():
+            values = (key,) if len(self.labelnames) == 1 else key
+            labels = _labels(self.labelnames, values)
+            if self.kind == 'histogram':
+                for bound, count in child.buckets():
+                    yield '_bucket', _labels(self.labelnames + ('le',),
+                                             values + (_format(bound),)), count
+                yield '_sum', labels, child.sum
+                yield '_count', labels, child.count
+            else:
+                yield '', labels, child.value
+
+# Metric whose value is read when rendered, the callback returns the value or
+# a dictionary of label values -> value
+class _Collected(_Metric):
+    def __init__(self, name, kind, text, labelnames, callback):
+        self.name = name
+        self.kind = kind
+        self.text = text
+        self.labelnames = labelnames
+        self._callback = callback
+
+    def samples(self):
+        values = self._callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield '', _labels(self.labelnames, labels), value
+
+class Metrics:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, text, labelnames=()):
+        return self._add(_Family(name, 'counter', text, labelnames, Counter))
+
+    def histogram(self, name, text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(_Family(name, 'histogram', text, labelnames,
+                                 lambda: Histogram(buckets)))
+
+    # Values which are already counted elsewhere are read when rendered
+    def gauge(self, name, text, callback, labelnames=()):
+        return self._add(_Collected(name, 'gauge', text, labelnames, callback))
+
+    def counter_callback(self, name, text, callback, labelnames=()):
+        return self._add(_Collected(name, 'counter', text, labelnames, callback))
+
+    # Export the numeric values of a stats() dictionary, each as a metric
+    # named by the prefix and the key
+    def stats(self, prefix, text, callback):
+        self._add(_Stats(prefix, text, callback))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    # Render all metrics in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        lines.append('')
+        return '\n'.join(lines)
+
+class _Stats:
+    def __init__(self, prefix, text, callback):
+        self._prefix = prefix
+        self._text = text
+        self._callback = callback
+
+    def render(self, lines):
+        for key, value in self._callback().items():
+            # Non-numeric values such as names cannot be exported
+            if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                continue
+            name = f'{self._prefix}_{key}'
+            lines.append(f'# HELP {name} {self._text}: {key}')
+            lines.append(f'# TYPE {name} untyped')
+            lines.append(f'{name} {_format(value)}')
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        if value == float('-inf'):
+            return '-Inf'
+        return repr(value)
+    return str(value)
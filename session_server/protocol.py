@@ -0,0 +1,134 @@
+import functools
+import json
+import struct
+import uuid
+
+# Messages are sent to each client with its own sequence number. To avoid
+# serializing the same message for every client, the message is encoded once
+# without the sequence number, which is then spliced in front of the other
+# fields.
+
+def encode(message):
+    return json.dumps(message)
+
+def add_seq(body, seq):
+    if isinstance(body, bytes):
+        return body[:1] + _SEQ.pack(seq & 0xffffffff) + body[1:]
+    if len(body) == 2:
+        # Empty message
+        return f'{{"Seq": {seq}}}'
+    return f'{{"Seq": {seq}, {body[1:]}'
+
+def decode(data):
+    if isinstance(data, bytes):
+        return decode_binary(data)
+    return json.loads(data)
+
+# Clients requesting this WebSockets subprotocol exchange object moves in
+# binary messages, all the other messages remain JSON
+#
+# A binary message starts with the message type (uint8) and the sequence
+# number (uint32, ignored in messages sent by clients), followed by:
+#
+#   ITEM_MOVED:       move
+#   ITEM_MOVED_BATCH: number of moves (uint32), moves
+#
+# A move is the Uid as 16 bytes, a uint8 bit mask of the included fields
+# (1 = Position, 2 = Scale, 4 = Rotation) and the float32 values of the
+# included fields. All values are little-endian.
+#
+# Only objects whose Uid is a UUID in the canonical lowercase form may be
+# moved in binary messages.
+BINARY_SUBPROTOCOL = 'session-binary-v1'
+
+BINARY_MOVE = 1
+BINARY_MOVE_BATCH = 2
+
+_SEQ = struct.Struct('<I')
+_COUNT = struct.Struct('<I')
+# Offset of the data following the message type and sequence number
+_DATA_OFFSET = 1 + _SEQ.size
+
+_MOVE_FIELDS = (('Position', 3, 1), ('Scale', 3, 2), ('Rotation', 4, 4))
+# Move structure for each combination of included fields
+_MOVE_STRUCTS = [
+    struct.Struct('<16sB' + ''.join(f'{length}f' for (field, length, flag) in
+                                        _MOVE_FIELDS if flags & flag))
+    for flags in range(8)]
+
+# Pack the move without the message header, return None if the move cannot
+# be represented in the binary form
+def pack_move(message):
+    uid = message.get('Uid')
+    if not isinstance(uid, str):
+        return None
+    uid_bytes = _uid_to_bytes(uid)
+    if uid_bytes is None:
+        return None
+    flags, values = 0, []
+    for field, length, flag in _MOVE_FIELDS:
+        value = message.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, list) or len(value) != length:
+            return None
+        flags |= flag
+        values.extend(value)
+    try:
+        return _MOVE_STRUCTS[flags].pack(uid_bytes, flags, *values)
+    except struct.error:
+        return None
+
+# The same objects are moved many times, so the conversions are cached
+@functools.lru_cache(maxsize=65536)
+def _uid_to_bytes(uid):
+    try:
+        value = uuid.UUID(uid)
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if str(value) != uid:
+        return None
+    return value.bytes
+
+@functools.lru_cache(maxsize=65536)
+def _bytes_to_uid(data):
+    return str(uuid.UUID(bytes=data))
+
+def encode_move(message):
+    packed = pack_move(message)
+    if packed is None:
+        return None
+    return bytes((BINARY_MOVE,)) + packed
+
+def encode_move_batch(moves):
+    return bytes((BINARY_MOVE_BATCH,)) + _COUNT.pack(len(moves)) + b''.join(moves)
+
+def decode_binary(data):
+    try:
+        if data[0] == BINARY_MOVE:
+            message, offset = _unpack_move(data, _DATA_OFFSET)
+            return message
+        if data[0] == BINARY_MOVE_BATCH:
+            count, = _COUNT.unpack_from(data, _DATA_OFFSET)
+            offset = _DATA_OFFSET + _COUNT.size
+            items = []
+            for i in range(count):
+                message, offset = _unpack_move(data, offset)
+                del message['Event']
+                items.append(message)
+            return {'Event': 'ITEM_MOVED_BATCH', 'Items': items}
+    except (IndexError, struct.error):
+        pass
+    return None
+
+def _unpack_move(data, offset):
+    flags = data[offset + 16] & 7
+    move_struct = _MOVE_STRUCTS[flags]
+    values = move_struct.unpack_from(data, offset)
+    message = {'Event': 'ITEM_MOVED', 'Uid': _bytes_to_uid(values[0])}
+    i = 2
+    for field, length, flag in _MOVE_FIELDS:
+        if flags & flag:
+            message[field] = list(values[i:i + length])
+            i += length
+    return message, offset + move_struct.size
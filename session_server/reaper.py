@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+# Complete the deletions of sessions in the background: the deleted objects
+# and the files in the trash are removed in batches, with
+# a pause after each batch to limit the load of the database and the disk.
+#
+# The deletions are recorded by the engine, so they are resumed after a
+# restart.
+class Reaper:
+    # Number of objects or files removed by one engine call
+    BATCH_SIZE = 500
+    # Pause after each batch, in seconds
+    INTERVAL = 0.05
+    # How often the deletions are checked when idle or after an error, in
+    # seconds
+    IDLE_INTERVAL = 60.0
+
+    def __init__(self, engine, run, loop=None):
+        self._engine = engine
+        self._run = run
+        self._loop = loop or asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._pending = 0
+        self._current = None
+        self.removed = 0
+        self.completed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = self._loop.create_task(self._reap_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # Start removing a new deletion
+    def wake(self):
+        self._wakeup.set()
+
+    async def _reap_loop(self):
+        while True:
+            self._wakeup.clear()
+            tombstones = await self._run(self._engine.get_tombstones)
+            if tombstones is not None:
+                self._pending = len(tombstones)
+            if tombstones:
+                for tombstone in tombstones:
+                    if not await self._reap(tombstone):
+                        break
+                    self._pending -= 1
+                else:
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.IDLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    # Remove the deletion completely, return False if failed
+    async def _reap(self, tombstone):
+        token = tombstone['Token']
+        self._current = tombstone
+        logging.debug(f'Removing deleted session {tombstone["Name"]} ({token})')
+        start = time.monotonic()
+        removed = 0
+        try:
+            while True:
+                result = await self._run(self._engine.reap, token, self.BATCH_SIZE)
+                if result is None:
+                    return False
+                count, done = result
+                removed += count
+                self.removed += count
+                if done:
+                    break
+                await asyncio.sleep(self.INTERVAL)
+        finally:
+            self._current = None
+        self.completed += 1
+        logging.debug(f'Removed deleted session {tombstone["Name"]} ({token}), '
+                      f'{removed} items in {time.monotonic() - start:.1f} s')
+        return True
+
+    def stats(self):
+        return {
+            'deletions_pending': self._pending,
+            'deletion_current': self._current['Token'] if self._current is not None else None,
+            'deletions_completed_total': self.completed,
+            'deleted_items_total': self.removed
+        }
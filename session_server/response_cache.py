@@ -0,0 +1,49 @@
+import collections
+
+# Cache of encoded responses of the read endpoints. The keys include the
+# version of the data, so entries of outdated versions are never hit and
+# are eventually evicted as the least recently used.
+class ResponseCache:
+    # Maximum number of cached responses
+    MAX_ENTRIES = 64
+    # Maximum total size of the cached responses in bytes
+    MAX_BYTES = 32 * 1024 * 1024
+    # Larger responses are not cached
+    MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self._max_entries = max_entries or self.MAX_ENTRIES
+        self._max_bytes = max_bytes or self.MAX_BYTES
+        # key -> encoded response, least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key):
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        if len(body) > self.MAX_ENTRY_BYTES:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = body
+        self._size += len(body)
+        while len(self._entries) > self._max_entries or self._size > self._max_bytes:
+            key, body = self._entries.popitem(last=False)
+            self._size -= len(body)
@@ -0,0 +1,177 @@
+import collections
+import time
+
+# Objects selected by the clients, a selection is a shared lock of the
+# object: moves of a selected object are postponed until it is deselected
+#
+# Selections are indexed both by the object and by the client, so releasing
+# all selections of a disconnected client only touches its own selections.
+# Selections which are not renewed by selecting or moving the object again
+# expire after a lease, so abandoned selections do not lock objects forever.
+class SelectionManager:
+    # Selections not renewed for this long expire, in seconds
+    LEASE = 600.0
+    # Maximum number of objects selected by a single client
+    MAX_PER_IDENT = 1000
+    # Maximum number of selections of all clients
+    MAX_SELECTIONS = 100000
+
+    def __init__(self, lease=None, max_per_ident=None, max_selections=None):
+        self._lease = lease or self.LEASE
+        self._max_per_ident = max_per_ident or self.MAX_PER_IDENT
+        self._max_selections = max_selections or self.MAX_SELECTIONS
+        # uid -> idents which selected the object
+        self._holders = {}
+        # ident -> uids selected by the client
+        self._held = {}
+        # (uid, ident) -> expiration time, the lease is the same for all
+        # selections, so the first to expire come first
+        self._leases = collections.OrderedDict()
+        # uid -> ident -> [position, scale, rotation] postponed moves
+        self._moves = {}
+        # ident -> uids with postponed moves of the client
+        self._moving = {}
+        self.selected = 0
+        self.deselected = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._leases)
+
+    # Return whether the object is selected by any client, or by the given
+    # client only
+    def is_selected(self, uid, ident=None):
+        idents = self._holders.get(uid)
+        if idents is None:
+            return False
+        return ident in idents if ident is not None else True
+
+    # Select the object or renew the selection, return False if the client
+    # has too many selections
+    def select(self, uid, ident):
+        key = (uid, ident)
+        if key in self._leases:
+            self._renew(key)
+            return True
+        if (len(self._held.get(ident, ())) >= self._max_per_ident or
+                len(self._leases) >= self._max_selections):
+            self.rejected += 1
+            return False
+        self._holders.setdefault(uid, set()).add(ident)
+        self._held.setdefault(ident, set()).add(uid)
+        self._leases[key] = time.monotonic() + self._lease
+        self.selected += 1
+        return True
+
+    def _renew(self, key):
+        self._leases[key] = time.monotonic() + self._lease
+        self._leases.move_to_end(key)
+
+    # Postpone the move of a selected object, return False if the object is
+    # not selected
+    def add_move(self, uid, ident, position=None, scale=None, rotation=None):
+        if uid not in self._holders:
+            return False
+        if (uid, ident) in self._leases:
+            self._renew((uid, ident))
+        move = self._moves.setdefault(uid, {}).setdefault(ident, [None, None, None])
+        self._moving.setdefault(ident, set()).add(uid)
+        for i, value in enumerate((position, scale, rotation)):
+            if value is not None:
+                move[i] = value
+        return True
+
+    # Deselect the object, return whether it was selected by the client and
+    # the move to complete if this was the last client which moved it
+    def deselect(self, uid, ident):
+        if self._leases.pop((uid, ident), None) is None:
+            return False, None
+        self._release(uid, ident)
+        self._discard(self._held, ident, uid)
+        self.deselected += 1
+        return True, self._pop_move(uid, ident)
+
+    # Deselect all objects of the client, return uid -> move of the moves to
+    # complete
+    def deselect_all(self, ident):
+        moves = {}
+        for uid in self._held.pop(ident, ()):
+            del self._leases[(uid, ident)]
+            self._release(uid, ident)
+            self.deselected += 1
+        # Moves of objects selected by other clients are completed too, they
+        # would never be otherwise
+        for uid in list(self._moving.get(ident, ())):
+            move = self._pop_move(uid, ident)
+            if move is not None:
+                moves[uid] = move
+        return moves
+
+    # Deselect the selections whose lease has expired, return uid -> move of
+    # the moves to complete
+    def expire(self):
+        moves = {}
+        now = time.monotonic()
+        while self._leases:
+            (uid, ident), expires = next(iter(self._leases.items()))
+            if expires > now:
+                break
+            del self._leases[(uid, ident)]
+            self._release(uid, ident)
+            self._discard(self._held, ident, uid)
+            self.expired += 1
+            move = self._pop_move(uid, ident)
+            if move is not None:
+                moves[uid] = move
+        return moves
+
+    # Drop the selections and postponed moves of a removed object
+    def forget(self, uid):
+        for ident in self._holders.pop(uid, ()):
+            del self._leases[(uid, ident)]
+            self._discard(self._held, ident, uid)
+        for ident in self._moves.pop(uid, ()):
+            self._discard(self._moving, ident, uid)
+
+    def clear(self):
+        self._holders.clear()
+        self._held.clear()
+        self._leases.clear()
+        self._moves.clear()
+        self._moving.clear()
+
+    def _release(self, uid, ident):
+        self._discard(self._holders, uid, ident)
+
+    @staticmethod
+    def _discard(index, key, value):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+    def _pop_move(self, uid, ident):
+        moves = self._moves.get(uid)
+        if moves is None or ident not in moves:
+            return None
+        move = moves.pop(ident)
+        self._discard(self._moving, ident, uid)
+        if moves:
+            # Another client moved the object too and completes the move
+            return None
+        del self._moves[uid]
+        return move
+
+    def stats(self):
+        return {
+            'selections': len(self._leases),
+            'selected_objects': len(self._holders),
+            'selecting_clients': len(self._held),
+            'postponed_moves': sum(len(moves) for moves in self._moves.values()),
+            'selected_total': self.selected,
+            'deselected_total': self.deselected,
+            'expired_total': self.expired,
+            'rejected_total': self.rejected
+        }
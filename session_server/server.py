@@ -3,8 +3,12 @@ import logging
 import signal
 from contextlib import suppress
 
+from .eventbus import LocalEventBus
+from .load_monitor import LoopLagMonitor
+from .metrics import Metrics
 from .storage import Storage
-from .storage_mongodb import StorageMongoDB
+from .upload_manager import UploadManager
+from .uploads import staging_dir
 from .webserver import WebServer
 from .wsserver import WSServer
 
@@ -12,13 +16,29 @@ class Server:
     WEB_PORT = 8080
     WS_PORT = 8089
 
-    def __init__(self, files_dir):
+    # Names of the storage engines
+    ENGINES = ('mongodb', 'sqlite')
+
+    # The worker ID and event bus are used when running multiple worker
+    # processes, which share the ports if reuse_port is enabled. With a shard
+    # map each session is served by the worker owning it.
+    def __init__(self, files_dir, worker_id=0, event_bus=None, reuse_port=False,
+                 shards=None, engine='mongodb'):
         self._running = False
-        self._storage = Storage(StorageMongoDB(files_dir))
-        self._ws_server = WSServer(self, self.WS_PORT)
-        self._web_server = WebServer(self, self.WEB_PORT)
+        self._files_dir = files_dir
+        self._worker_id = worker_id
+        self._event_bus = event_bus or LocalEventBus(worker_id)
+        self._shards = shards
+        self._lag_monitor = LoopLagMonitor()
+        self._metrics = Metrics()
+        engine = self._create_engine(engine)
+        self._storage = Storage(engine, engine.POOL_SIZE, metrics=self._metrics)
+        self._uploads = UploadManager(staging_dir(files_dir))
+        self._ws_server = WSServer(self, self.WS_PORT, reuse_port)
+        self._web_server = WebServer(self, self.WEB_PORT, reuse_port)
+        self._setup_metrics()
         # Enable to add testing data to storage
-        # self._storage.add_testing()
+        # asyncio.get_event_loop().run_until_complete(self._storage.add_testing())
 
     def start(self):
         self._running = True
@@ -28,6 +48,8 @@ class Server:
         try:
             self._start_server()
             loop.run_forever()
+            loop.run_until_complete(self._event_bus.close())
+            loop.run_until_complete(self._storage.close())
             pending = asyncio.Task.all_tasks()
             for task in pending:
                 task.cancel()
@@ -40,13 +62,43 @@ class Server:
     def stop(self):
         self._web_server.stop()
         self._ws_server.stop()
+        self._uploads.stop()
+        self._lag_monitor.stop()
         self._running = False
         asyncio.get_event_loop().stop()
 
+    @property
+    def files_dir(self):
+        return self._files_dir
+
+    @property
+    def worker_id(self):
+        return self._worker_id
+
+    @property
+    def shards(self):
+        return self._shards
+
+    @property
+    def event_bus(self):
+        return self._event_bus
+
+    @property
+    def lag_monitor(self):
+        return self._lag_monitor
+
+    @property
+    def metrics(self):
+        return self._metrics
+
     @property
     def storage(self):
         return self._storage
 
+    @property
+    def uploads(self):
+        return self._uploads
+
     @property
     def web_server(self):
         return self._web_server
@@ -55,6 +107,30 @@ class Server:
     def ws_server(self):
         return self._ws_server
 
+    # The engines are imported when used, so that the database modules of
+    # the other engines do not have to be installed
+    def _create_engine(self, engine):
+        if engine == 'sqlite':
+            from .storage_sqlite import StorageSQLite
+            return StorageSQLite(self._files_dir)
+        from .storage_mongodb import StorageMongoDB
+        return StorageMongoDB(self._files_dir)
+
+    # Metrics of the components which are read when the metrics are requested
+    def _setup_metrics(self):
+        self._metrics.gauge('session_worker_info',
+                            'Worker process serving the metrics',
+                            lambda: {(str(self._worker_id),): 1}, ('worker',))
+        self._metrics.gauge('session_loop_lag_seconds',
+                            'Smoothed event loop lag',
+                            lambda: self._lag_monitor.lag)
+        self._metrics.stats('session_storage', 'Storage statistics', self._storage.stats)
+        self._metrics.stats('session_ws', 'WebSockets statistics', self._ws_server.stats)
+
     def _start_server(self):
+        self._lag_monitor.start()
+        self._event_bus.start()
+        self._storage.start()
+        self._uploads.start()
         self._web_server.start()
         self._ws_server.start()
@@ -0,0 +1,144 @@
+import array
+import collections
+import sys
+import time
+
+# Resident state of the active sessions, which serves the object reads from
+# memory while the storage engine remains the durable copy
+
+# Offsets of the transform fields in the transform array
+_TRANSFORM_FIELDS = (('Position', 0, 3), ('Scale', 3, 3), ('Rotation', 6, 4))
+_TRANSFORM_SIZE = 10
+
+# Return the transform value as an array of doubles, None if it is not a
+# list of numbers of the given length
+def transform_array(value, length):
+    if not isinstance(value, list) or len(value) != length:
+        return None
+    try:
+        return array.array('d', value)
+    except (TypeError, OverflowError):
+        return None
+
+class ObjectState:
+    __slots__ = ('uid', 'object_type', 'transform', 'extra')
+
+    # The type specific fields are stored as a tuple of values in the order
+    # given by extra_fields
+    #
+    # Invalid transform values of stored objects are replaced by zeros, so
+    # that such objects never prevent loading the session
+    def __init__(self, data, extra_fields):
+        self.uid = data['Uid']
+        self.object_type = data.get('ObjectType')
+        # Position, scale and rotation, doubles to keep the stored values
+        # exactly as they are
+        self.transform = array.array('d', bytes(8 * _TRANSFORM_SIZE))
+        self.move(data.get('Position'), data.get('Scale'), data.get('Rotation'))
+        self.extra = tuple(data.get(field) for field in extra_fields)
+
+    def move(self, position=None, scale=None, rotation=None):
+        for value, (field, offset, length) in zip((position, scale, rotation),
+                                                  _TRANSFORM_FIELDS):
+            if value is not None:
+                value = transform_array(value, length)
+                if value is not None:
+                    self.transform[offset:offset + length] = value
+
+    def to_dict(self, session, extra_fields):
+        data = {'Uid': self.uid,
+                'Session': session,
+                'ObjectType': self.object_type}
+        transform = self.transform.tolist()
+        for field, offset, length in _TRANSFORM_FIELDS:
+            data[field] = transform[offset:offset + length]
+        for field, value in zip(extra_fields, self.extra):
+            if value is not None:
+                data[field] = value
+        return data
+
+    def size(self):
+        return (sys.getsizeof(self) +
+                sys.getsizeof(self.uid) +
+                sys.getsizeof(self.transform) +
+                sys.getsizeof(self.extra) +
+                sum(sys.getsizeof(value) for value in self.extra if value is not None))
+
+class SessionState:
+    __slots__ = ('name', 'objects', 'accessed')
+
+    def __init__(self, name):
+        self.name = name
+        # uid -> ObjectState, in the order the objects were added
+        self.objects = {}
+        self.accessed = time.monotonic()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def size(self):
+        return (sys.getsizeof(self) +
+                sys.getsizeof(self.objects) +
+                sum(obj.size() for obj in self.objects.values()))
+
+# Least recently used sessions are evicted when there are too many of them,
+# idle sessions are evicted after a timeout
+class SessionStateCache:
+    # Maximum number of resident sessions
+    MAX_SESSIONS = 64
+    # Sessions not accessed for this long are evicted, in seconds
+    IDLE_TIMEOUT = 600.0
+
+    def __init__(self, max_sessions=None, idle_timeout=None):
+        self._max_sessions = max_sessions or self.MAX_SESSIONS
+        self._idle_timeout = idle_timeout or self.IDLE_TIMEOUT
+        # name -> SessionState, least recently used first
+        self._sessions = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, name):
+        return name in self._sessions
+
+    # Return the resident session and mark it as used, or None
+    def get(self, name):
+        state = self._sessions.get(name)
+        if state is not None:
+            state.accessed = time.monotonic()
+            self._sessions.move_to_end(name)
+        return state
+
+    def add(self, state):
+        self._sessions[state.name] = state
+        self._sessions.move_to_end(state.name)
+        return self.evict()
+
+    def pop(self, name):
+        return self._sessions.pop(name, None)
+
+    def clear(self):
+        self._sessions.clear()
+
+    # Evict the idle sessions and the least recently used sessions over the
+    # limit, return the evicted sessions
+    def evict(self):
+        evicted = []
+        limit = time.monotonic() - self._idle_timeout
+        while self._sessions:
+            name, state = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self._max_sessions and state.accessed >= limit:
+                break
+            del self._sessions[name]
+            evicted.append(state)
+        return evicted
+
+    def stats(self):
+        objects = sum(len(state) for state in self._sessions.values())
+        size = sum(state.size() for state in self._sessions.values())
+        return {
+            'resident_sessions': len(self._sessions),
+            'resident_objects': objects,
+            'resident_bytes': size,
+            'bytes_per_object': size / objects if objects else 0
+        }
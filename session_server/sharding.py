@@ -0,0 +1,71 @@
+import bisect
+import hashlib
+import urllib.parse
+
+# Consistent hashing of keys to nodes, adding a node only moves the keys
+# which the new node takes over
+class HashRing:
+    # Number of points of each node on the ring
+    REPLICAS = 160
+
+    def __init__(self, nodes, replicas=None):
+        replicas = replicas or self.REPLICAS
+        self._ring = sorted((self._hash(f'{node}:{i}'), node)
+                            for node in nodes for i in range(replicas))
+        self._hashes = [point[0] for point in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def node(self, key):
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._ring[i][1]
+
+# Assignment of sessions to the worker processes, each session is owned by
+# exactly one worker (shard) which serves all its WebSockets clients and
+# session requests, the other workers forward them to the owner
+class ShardMap:
+    # The workers listen on these ports plus the shard index for the
+    # forwarded connections
+    HOST = '127.0.0.1'
+    WEB_PORT_BASE = 18000
+    WS_PORT_BASE = 19000
+    # Header marking forwarded HTTP requests
+    FORWARDED_HEADER = 'X-Session-Shard'
+
+    def __init__(self, count, index):
+        self._count = count
+        self._index = index
+        self._ring = HashRing(range(count))
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def index(self):
+        return self._index
+
+    def owner(self, session):
+        return self._ring.node(session)
+
+    def is_local(self, session):
+        return self.owner(session) == self._index
+
+    def web_port(self, shard=None):
+        return self.WEB_PORT_BASE + (self._index if shard is None else shard)
+
+    def ws_port(self, shard=None):
+        return self.WS_PORT_BASE + (self._index if shard is None else shard)
+
+# WebSockets clients may connect to /session/<name> to join a session
+def session_from_path(path):
+    path = urllib.parse.urlsplit(path or '').path
+    prefix = '/session/'
+    if not path.startswith(prefix) or len(path) == len(prefix):
+        return None
+    return urllib.parse.unquote(path[len(prefix):])
+
+def session_path(session):
+    return '/session/' + urllib.parse.quote(session, safe='')
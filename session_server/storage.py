@@ -1,52 +1,173 @@
+import asyncio
+import bisect
+import itertools
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from .blob_store import BlobStore
+from .metrics import Metrics
+from .reaper import Reaper
+from .selection import SelectionManager
+from .session_state import ObjectState, SessionState, SessionStateCache, transform_array
+from .transform_cache import TransformCache
 
 class Storage:
-    def __init__(self, engine):
+    # Number of engine calls that may run at the same time, this should not
+    # exceed the size of the engine connection pool
+    WORKERS = 8
+    # How often the idle sessions are evicted from memory, in seconds
+    EVICT_INTERVAL = 60.0
+
+    def __init__(self, engine, workers=None, flush_interval=None, max_staleness=None, loop=None,
+                 metrics=None):
         self._engine = engine
+        self._loop = loop or asyncio.get_event_loop()
+        self._metrics = metrics or Metrics()
+        self._call_times = self._metrics.histogram(
+            'session_storage_call_seconds',
+            'Time of storage engine calls, including the wait for a free thread',
+            ('call',))
+        # The engine API is blocking, so all engine calls are done in a
+        # bounded thread pool to keep the event loop responsive
+        self._executor = ThreadPoolExecutor(max_workers=workers or self.WORKERS)
         # Object selection is handled here as it doesn't need to be stored
         # in the real storage
-        self._selection = {}
-        self._pending_move = {}
+        self._selections = SelectionManager()
+        # Cache of uid -> session name of the known objects
+        self._object_sessions = {}
+        # Names of the sessions known to exist, sessions are only checked in
+        # the engine when they are not here
+        self._sessions = {'default'}
+        # session -> version increased with every change of the session, the
+        # global version is increased when the session of a changed object is
+        # not known and the sessions version with changes of the session list
+        self._versions = {}
+        self._global_version = 0
+        self._sessions_version = 0
+        # Versions start over when the server restarts, so they are prefixed
+        # with a random epoch
+        self._version_epoch = os.urandom(4).hex()
+        # Object moves are kept in memory and written in bulk periodically
+        self._transforms = TransformCache(self._flush_transforms,
+                                          flush_interval,
+                                          max_staleness,
+                                          self._loop)
+        # Objects of the active sessions are held in memory, the engine is
+        # only read when a session is loaded
+        self._states = SessionStateCache()
+        # session -> [future, moves done meanwhile, valid] of the sessions
+        # being loaded
+        self._loading = {}
+        self._evict_task = None
+        # Deleted sessions are removed from the engine in the background
+        self._reaper = Reaper(engine, self._run, self._loop)
+
+    def start(self):
+        self._transforms.start()
+        self._reaper.start()
+        if self._evict_task is None:
+            self._evict_task = self._loop.create_task(self._evict_loop())
+
+    async def close(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._evict_task
+            self._evict_task = None
+        self._reaper.stop()
+        await self._transforms.close()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {**self._states.stats(),
+                **self._selections.stats(),
+                **self._reaper.stats(),
+                'unwritten_moves': len(self._transforms)}
+
+    async def _run(self, func, *args):
+        start = time.perf_counter()
+        try:
+            return await self._loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._call_times[func.__name__].observe(time.perf_counter() - start)
+
+    ### Versions
+
+    # Return the current version of the session objects, a different
+    # version means that the objects may have changed
+    def session_version(self, session):
+        return f'{self._version_epoch}-{self._global_version}-{self._versions.get(session, 0)}'
+
+    # Return the current version of the session list
+    def sessions_version(self):
+        return f'{self._version_epoch}-{self._sessions_version}'
+
+    def _bump_version(self, session):
+        if session is None:
+            self._global_version += 1
+        else:
+            self._versions[session] = self._versions.get(session, 0) + 1
 
     ### Session API
 
-    def add_session(self, name):
+    async def add_session(self, name):
+        if not isinstance(name, str) or not name:
+            return None
+        data = {'Name': name}
         if name == 'default':
             # Implicit
             logging.debug(f'Session {name} already exists')
-            return True
+            return data
         logging.debug(f'Adding session: {name}')
-        data = {'Name': name}
-        if self._engine.add_session(data):
+        if await self._run(self._engine.add_session, data):
+            self._sessions.add(name)
+            self._sessions_version += 1
             return data
         return None
 
-    def get_session(self, name):
-        return self._engine.get_session(name)
+    async def get_session(self, name):
+        data = await self._run(self._engine.get_session, name)
+        if data is not None:
+            self._sessions.add(name)
+        return data
+
+    async def session_exists(self, name):
+        if name in self._sessions:
+            return True
+        return await self.get_session(name) is not None
 
-    def get_all_sessions(self):
-        return self._engine.get_all_sessions()
+    async def get_all_sessions(self):
+        return await self._run(self._engine.get_all_sessions)
 
-    def get_all_sessions_name_list(self):
-        return self._engine.get_all_sessions_name_list()
+    async def get_all_sessions_name_list(self):
+        return await self._run(self._engine.get_all_sessions_name_list)
 
     def can_remove_session(self, name):
         return name != 'default'
 
-    def remove_session(self, name):
+    async def remove_session(self, name):
         if name == 'default':
             return False
         logging.debug(f'Removing session: {name}')
-        return self._engine.remove_session(name)
+        self._sessions.discard(name)
+        result = await self._run(self._engine.remove_session, name)
+        if result:
+            self._sessions_version += 1
+            self._forget_session_objects(name)
+            self._reaper.wake()
+        return result
 
     ### Object API
 
     TYPES = ('File', 'Link', 'Text')
-    FILE_TYPES = ('File')
+    FILE_TYPES = ('File',)
     BASIC_FIELDS = ('Uid', 'Session', 'ObjectType', 'Position', 'Scale', 'Rotation')
+    STRING_FIELDS = ('Uid', 'Session', 'ObjectType')
     EXTRA_FIELDS = {
-        'File': ('FileName',),
+        'File': ('FileName', 'Digest'),
         'Link': ('Url',),
         'Text': ('Text',),
     }
@@ -55,62 +176,123 @@ class Storage:
         'Scale': 3,
         'Rotation': 4
     }
+    # Fields of the objects of all types
+    OBJECT_FIELDS = frozenset(BASIC_FIELDS + tuple(itertools.chain(*EXTRA_FIELDS.values())))
 
     # Add object to the storage
     # Return the potentially modified data dictionary or None when failed
-    def add_object(self, data, temp_file=None):
+    #
+    # The object is inserted with a single engine call, which fails if the
+    # object already exists.
+    async def add_object(self, data, temp_file=None):
         logging.debug(f'Adding object: {data}')
+        error = self._check_object(data, temp_file)
+        if error is None and not await self.session_exists(data['Session']):
+            error = f'invalid session {data["Session"]}'
+        if error is not None:
+            logging.info(f'Skipping object: {error}')
+            return None
+        data = self._prepare_object(data)
+
+        if temp_file is not None and logging.getLogger().isEnabledFor(logging.DEBUG):
+            name = data['FileName']
+            size = os.stat(temp_file).st_size
+            logging.debug(f'File name: {name}, size: {size}')
+
+        result = await self._run(self._engine.add_object, data, temp_file)
+        logging.debug(f'Result: {result}')
+        if result:
+            self._object_added(data)
+            return data
+        return None
+
+    # Add multiple objects using a single engine call, file objects must
+    # refer to existing blobs by their Digest
+    # Return a list of (data, error) for each of the objects, where data is
+    # None when the object was not added
+    async def add_objects(self, items):
+        logging.debug(f'Adding {len(items)} objects')
+        results = [None] * len(items)
+        valid = []
+        sessions = {}
+        for i, data in enumerate(items):
+            if not isinstance(data, dict):
+                results[i] = (None, 'invalid object')
+                continue
+            error = self._check_object(data)
+            if error is None:
+                session = data['Session']
+                if session not in sessions:
+                    sessions[session] = await self.session_exists(session)
+                if not sessions[session]:
+                    error = f'invalid session {session}'
+            if error is not None:
+                results[i] = (None, error)
+                continue
+            valid.append((i, self._prepare_object(data)))
+        if not valid:
+            return results
+        added = await self._run(self._engine.add_objects, [data for (i, data) in valid])
+        for (i, data), result in zip(valid, added):
+            if result:
+                self._object_added(data)
+                results[i] = (data, None)
+            else:
+                results[i] = (None, 'already exists or failed to store')
+        return results
+
+    # Return the reason why the object cannot be added or None
+    def _check_object(self, data, temp_file=None):
         # Verify mandatory fields
         for field in self.BASIC_FIELDS:
             if field not in data:
-                logging.info(f'Skipping object without basic field {field}')
-                return None
-
+                return f'missing basic field {field}'
+        for field in self.STRING_FIELDS:
+            if not isinstance(data[field], str):
+                return f'invalid basic field {field}'
         uid = data['Uid']
-        if self.get_object(uid) is not None:
-            logging.info(f'Skipping object {uid} which already exists')
-            return None
-        session = data['Session']
-        if self.get_session(session) is None:
-            logging.info(f'Skipping object {uid} with invalid session {session}')
-            return None
         object_type = data['ObjectType']
         if object_type not in self.TYPES:
-            logging.info(f'Skipping object of unknown type {object_type}')
-            return None
-        if object_type in self.FILE_TYPES and temp_file is None:
-            logging.info(f'Skipping object without file content')
-            return None
+            return f'object {uid} of unknown type {object_type}'
+        if 'Digest' in data and not BlobStore.is_digest(data['Digest']):
+            return f'object {uid} with invalid digest'
+        if object_type in self.FILE_TYPES and temp_file is None and 'Digest' not in data:
+            return f'object {uid} without file content'
+        if object_type not in self.FILE_TYPES and temp_file is not None:
+            return f'object {uid} with extraneous file'
         for field, length in self.ARRAY_FIELDS.items():
             if field not in data:
                 continue
-            if not isinstance(data[field], list) or len(data[field]) != length:
-                logging.info(f'Skipping object with invalid field {field}')
-                return None
+            if transform_array(data[field], length) is None:
+                return f'object {uid} with invalid field {field}'
+        return None
 
+    def _prepare_object(self, data):
         # Cleanup object data
+        object_type = data['ObjectType']
         data = {key:val for (key,val) in data.items() if
                     key in self.BASIC_FIELDS or
                     key in self.EXTRA_FIELDS[object_type]}
+        move = self._transforms.get(data['Uid'])
+        if move is not None:
+            # The object has been moved before it was added, the move stays
+            # cached in case the object already exists
+            for field, value in zip(('Position', 'Scale', 'Rotation'), move):
+                if value is not None:
+                    data[field] = value
+        return data
 
-        if temp_file is not None:
-            if object_type in self.FILE_TYPES:
-                if logging.getLogger().isEnabledFor(logging.DEBUG):
-                    name = data['FileName']
-                    size = os.stat(temp_file).st_size
-                    logging.debug(f'File name: {name}, size: {size}')
-            else:
-                logging.info(f'Skipping object {uid} with extraneous file')
-                return None
-
-        result = self._engine.add_object(data, temp_file)
-        logging.debug(f'Result: {result}')
-        if result:
-            return data
-        return None
+    def _object_added(self, data):
+        uid, session = data['Uid'], data['Session']
+        self._object_sessions[uid] = session
+        self._bump_version(session)
+        state = self._states.get(session)
+        if state is not None:
+            state.objects[uid] = ObjectState(data, self.EXTRA_FIELDS[data['ObjectType']])
+        self._invalidate_load(session)
 
     # Add testing data to the storage
-    def add_testing(self):
+    async def add_testing(self):
         obj = {
             'Uid': '7e10441e-c88e-4d8c-9e6b-60cf96bbadc6',
             'Session': 'default',
@@ -119,7 +301,7 @@ class Storage:
             'Scale': [1.0, 1.0, 1.0],
             'Rotation': [0.0, 0.0, 0.0, 0.0],
             'Url': 'http://localhost'}
-        self.add_object(obj)
+        await self.add_object(obj)
         obj = {
             'Uid': 'e87ecfcc-5bd2-4ff3-a4e9-179f52063471',
             'Session': 'default',
@@ -128,106 +310,363 @@ class Storage:
             'Scale': [1.0, 1.0, 1.0],
             'Rotation': [0.0, 0.0, 0.0, 0.0],
             'Text': 'I hate C#'}
-        self.add_object(obj)
+        await self.add_object(obj)
+
+    async def get_object(self, uid):
+        obj, session = self._resident_object(uid)
+        if obj is not None:
+            return self._object_dict(obj, session)
+        data = await self._run(self._engine.get_object, uid)
+        if data is not None:
+            self._object_sessions[uid] = data['Session']
+            self._transforms.apply(data)
+        return data
+
+    # Return the path of the object file and the file name, or None
+    async def get_object_file(self, uid):
+        return await self._run(self._engine.get_object_file, uid)
+
+    # Return the digest and size of the blob, or None if it does not exist
+    async def get_blob(self, digest):
+        if not BlobStore.is_digest(digest):
+            return None
+        return await self._run(self._engine.get_blob, digest)
+
+    async def get_all_objects(self, session):
+        state = await self._session_state(session)
+        if state is not None:
+            return [self._object_dict(obj, session) for obj in state.objects.values()]
+        data = await self._run(self._engine.get_all_objects, session)
+        for item in data:
+            self._object_sessions[item['Uid']] = session
+            self._transforms.apply(item)
+        return data
+
+    # Asynchronously iterate over the objects of the session in chunks, so
+    # that large sessions do not have to be held in memory at once
+    #
+    # When paginated with after or limit, the objects are ordered by Uid and
+    # start after the given Uid. Only the given fields are returned, Uid is
+    # always included and fields which objects do not have are ignored.
+    async def iter_objects(self, session, chunk_size, fields=None, after=None, limit=None):
+        if limit is not None and limit <= 0:
+            return
+        if fields is not None:
+            fields = ('Uid',) + tuple(field for field in fields if
+                                          field != 'Uid' and field in self.OBJECT_FIELDS)
+        state = await self._session_state(session)
+        if state is not None:
+            if after is not None or limit is not None:
+                uids = sorted(state.objects)
+                start = bisect.bisect_right(uids, after) if after is not None else 0
+                end = start + limit if limit is not None else len(uids)
+                objects = [state.objects[uid] for uid in uids[start:end]]
+            else:
+                objects = list(state.objects.values())
+            for i in range(0, len(objects), chunk_size):
+                yield [self._object_dict(obj, session, fields) for obj in
+                           objects[i:i + chunk_size]]
+            return
+        objects = await self._run(self._engine.iter_objects, session, fields, after, limit)
+        while True:
+            chunk = await self._run(self._next_chunk, objects, chunk_size)
+            if not chunk:
+                break
+            for item in chunk:
+                self._object_sessions[item['Uid']] = session
+                self._transforms.apply(item)
+            if fields is not None:
+                chunk = [self._project(item, fields) for item in chunk]
+            yield chunk
+
+    @staticmethod
+    def _next_chunk(objects, chunk_size):
+        try:
+            return list(itertools.islice(objects, chunk_size))
+        except:
+            logging.exception('Failed to read objects')
+            return []
+
+    # Return the resident state of the session, the session is loaded from
+    # the engine on first access. Return None if loading failed.
+    async def _session_state(self, session):
+        state = self._states.get(session)
+        if state is not None:
+            return state
+        if session in self._loading:
+            return await asyncio.shield(self._loading[session][0])
+        load = [self._loop.create_future(), {}, True]
+        self._loading[session] = load
+        state = None
+        try:
+            data = await self._run(self._engine.load_objects, session)
+            if data is None:
+                return None
+            state = SessionState(session)
+            moves = load[1]
+            for item in data:
+                uid = item['Uid']
+                # Moves which have not been written yet
+                self._transforms.apply(item)
+                obj = ObjectState(item, self.EXTRA_FIELDS.get(item['ObjectType'], ()))
+                if uid in moves:
+                    obj.move(*moves[uid])
+                state.objects[uid] = obj
+                self._object_sessions[uid] = session
+            if load[2]:
+                # Otherwise the session changed while it was being loaded,
+                # the state is only used for this request
+                for evicted in self._states.add(state):
+                    logging.debug(f'Evicted session {evicted.name} from memory')
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    size = state.size()
+                    per_object = size // len(state) if len(state) else 0
+                    logging.debug(f'Loaded session {session}: {len(state)} objects, '
+                                  f'{size} bytes ({per_object} per object)')
+            return state
+        finally:
+            load[0].set_result(state)
+            del self._loading[session]
+
+    # Sessions being loaded have to be loaded again when their objects are
+    # added or removed meanwhile
+    def _invalidate_load(self, session=None):
+        for name, load in self._loading.items():
+            if session is None or name == session:
+                load[2] = False
+
+    def _resident_object(self, uid):
+        session = self._object_sessions.get(uid)
+        if session is None:
+            return None, None
+        state = self._states.get(session)
+        if state is None:
+            return None, session
+        return state.objects.get(uid), session
+
+    def _object_dict(self, obj, session, fields=None):
+        data = obj.to_dict(session, self.EXTRA_FIELDS.get(obj.object_type, ()))
+        if fields is not None:
+            data = self._project(data, fields)
+        return data
+
+    @staticmethod
+    def _project(data, fields):
+        return {field: data[field] for field in fields if field in data}
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.EVICT_INTERVAL)
+            for state in self._states.evict():
+                logging.debug(f'Evicted idle session {state.name} from memory')
+
+    # Update the resident state with a change done by another worker
+    # process, which also writes it to the engine
+    def apply_remote_event(self, message, session=None):
+        event = message.get('Event')
+        uid = message.get('Uid')
+        if event == 'ITEM_MOVED':
+            obj, session = self._resident_object(uid)
+            self._bump_version(session)
+            if obj is not None:
+                obj.move(message.get('Position'), message.get('Scale'), message.get('Rotation'))
+            self._record_load_move(uid, message.get('Position'),
+                                   message.get('Scale'), message.get('Rotation'))
+        elif event == 'ITEM_ADDED':
+            session = message.get('Session', session)
+            self._object_sessions[uid] = session
+            state = self._states.get(session)
+            if state is not None and message.get('ObjectType') in self.TYPES:
+                state.objects[uid] = ObjectState(message, self.EXTRA_FIELDS[message['ObjectType']])
+            self._bump_version(session)
+            self._invalidate_load(session)
+        elif event == 'ITEM_REMOVED':
+            self._forget_object(uid)
+        elif event == 'ITEM_ADDED_BATCH':
+            for item in message.get('Items', ()):
+                self.apply_remote_event({'Event': 'ITEM_ADDED', **item}, session)
+        elif event == 'ITEM_MOVED_BATCH':
+            for item in message.get('Items', ()):
+                self.apply_remote_event({'Event': 'ITEM_MOVED', **item}, session)
+        elif event == 'ITEM_REMOVED_BATCH':
+            for uid in message.get('Uids', ()):
+                self._forget_object(uid)
+        elif event == 'SESSION_ADDED':
+            self._sessions.add(message.get('Name'))
+            self._sessions_version += 1
+        elif event == 'SESSION_REMOVED':
+            self._sessions.discard(message.get('Name'))
+            self._sessions_version += 1
+            self._forget_session_objects(message.get('Name'))
+
+    # Return the session of the object if it is known without accessing
+    # the engine
+    def get_cached_object_session(self, uid):
+        return self._object_sessions.get(uid)
 
-    def get_object(self, uid):
-        return self._engine.get_object(uid)
+    async def get_object_session(self, uid):
+        session = self._object_sessions.get(uid)
+        if session is None:
+            data = await self.get_object(uid)
+            if data is not None:
+                session = data['Session']
+        return session
 
-    def get_object_file(self, uid):
-        return self._engine.get_object_file(uid)
+    # Return a dictionary of uid -> session name of the existing objects, the
+    # sessions which are not known are read with a single engine call
+    async def get_object_sessions(self, uids):
+        sessions, missing = {}, []
+        for uid in uids:
+            session = self._object_sessions.get(uid)
+            if session is None:
+                missing.append(uid)
+            else:
+                sessions[uid] = session
+        if missing:
+            found = await self._run(self._engine.get_object_sessions, missing)
+            self._object_sessions.update(found)
+            sessions.update(found)
+        return sessions
+
+    def _forget_session_objects(self, session):
+        for uid, name in self._object_sessions.items():
+            if name == session:
+                self._selections.forget(uid)
+        self._object_sessions = {uid: name for (uid, name) in
+                                     self._object_sessions.items() if name != session}
+        self._states.pop(session)
+        self._bump_version(session)
+        self._invalidate_load(session)
 
-    def get_all_objects(self, session):
-        return self._engine.get_all_objects(session)
+    def _forget_object(self, uid):
+        self._selections.forget(uid)
+        session = self._object_sessions.pop(uid, None)
+        state = self._states.get(session) if session is not None else None
+        if state is not None:
+            state.objects.pop(uid, None)
+        self._bump_version(session)
+        self._invalidate_load(session)
 
-    def get_all_objects_uid_list(self, session):
-        return self._engine.get_all_objects_uid_list(session)
+    async def get_all_objects_uid_list(self, session):
+        state = self._states.get(session)
+        if state is not None:
+            return list(state.objects)
+        return await self._run(self._engine.get_all_objects_uid_list, session)
 
-    def clear(self, session):
+    async def clear(self, session):
         logging.debug(f'Removing all objects in session {session}')
-        return self._engine.clear(session)
+        result = await self._run(self._engine.clear, session)
+        if result:
+            self._forget_session_objects(session)
+            self._reaper.wake()
+        return result
 
-    def clear_all(self):
+    async def clear_all(self):
         logging.debug(f'Removing all objects')
-        return self._engine.clear_all()
+        result = await self._run(self._engine.clear_all)
+        if result:
+            self._sessions = {'default'}
+            self._sessions_version += 1
+            self._global_version += 1
+            self._object_sessions.clear()
+            self._selections.clear()
+            self._states.clear()
+            self._invalidate_load()
+            self._reaper.wake()
+        return result
 
     def is_object_selected(self, uid, ident=None):
-        if uid not in self._selection:
-            return False
-        if ident is not None:
-            # Here only check if selected by the given ident
-            return ident in self._selection[uid]
-        else:
-            return len(self._selection[uid]) > 0
+        return self._selections.is_selected(uid, ident)
 
-    def move_object(self, uid, ident, position=None, scale=None, rotation=None):
+    async def move_object(self, uid, ident, position=None, scale=None, rotation=None):
         # logging.debug(f'Moving object: {uid}, position={position}, scale={scale}, rotation={rotation}')
         if position is not None:
-            if not isinstance(position, list) or len(position) != 3:
+            if transform_array(position, 3) is None:
                 logging.info('Not moving object with invalid position')
                 return False
         if scale is not None:
-            if not isinstance(scale, list) or len(scale) != 3:
+            if transform_array(scale, 3) is None:
                 logging.info('Not moving object with invalid scale')
                 return False
         if rotation is not None:
-            if not isinstance(rotation, list) or len(rotation) != 4:
+            if transform_array(rotation, 4) is None:
                 logging.info('Not moving object with invalid rotation')
                 return False
-        if self.is_object_selected(uid):
-            # Do not store the move in the engine if the object is selected,
-            # wait until the last user deselects it
-            if uid not in self._pending_move:
-                self._pending_move[uid] = {}
-            if ident not in self._pending_move[uid]:
-                self._pending_move[uid][ident] = [None, None, None]
-            # logging.debug('Postponing move')
-            if position is not None:
-                self._pending_move[uid][ident][0] = position
-            if scale is not None:
-                self._pending_move[uid][ident][1] = scale
-            if rotation is not None:
-                self._pending_move[uid][ident][2] = rotation
-            return True
-        else:
-            return self._engine.move_object(uid, position, scale, rotation)
+        if await self.get_object_session(uid) is None:
+            return False
+        # Do not store the move in the engine if the object is selected,
+        # wait until the last user deselects it
+        if not self._selections.add_move(uid, ident, position, scale, rotation):
+            self._move(uid, position, scale, rotation)
+        return True
 
-    def remove_object(self, uid):
+    def _move(self, uid, position=None, scale=None, rotation=None):
+        self._transforms.move(uid, position, scale, rotation)
+        obj, session = self._resident_object(uid)
+        self._bump_version(session)
+        if obj is not None:
+            obj.move(position, scale, rotation)
+        self._record_load_move(uid, position, scale, rotation)
+
+    # Remember the move for the sessions being loaded, it may be missing in
+    # the data read from the engine
+    def _record_load_move(self, uid, position=None, scale=None, rotation=None):
+        for load in self._loading.values():
+            move = load[1].setdefault(uid, [None, None, None])
+            for i, value in enumerate((position, scale, rotation)):
+                if value is not None:
+                    move[i] = value
+
+    async def _flush_transforms(self, moves):
+        return await self._run(self._engine.move_objects, moves)
+
+    async def remove_object(self, uid):
         logging.debug(f'Removing object: {uid}')
-        result = self._engine.remove_object(uid)
+        self._transforms.pop(uid)
+        result = await self._run(self._engine.remove_object, uid)
         logging.debug(f'Result: {result}')
+        if result:
+            self._forget_object(uid)
         return result
 
+    # Remove multiple objects using a single engine call, return a dictionary
+    # of uid -> session name of the removed objects
+    async def remove_objects(self, uids):
+        logging.debug(f'Removing {len(uids)} objects')
+        for uid in uids:
+            self._transforms.pop(uid)
+        removed = await self._run(self._engine.remove_objects, uids)
+        for uid in removed:
+            self._forget_object(uid)
+        return removed
+
+    # Return False if the client has selected too many objects
     def select_object(self, uid, ident):
-        if uid not in self._selection:
-            self._selection[uid] = set()
-        self._selection[uid].add(ident)
-        return True
+        return self._selections.select(uid, ident)
 
-    def deselect_object(self, uid, ident):
-        try:
-            if uid in self._selection:
-                self._selection[uid].remove(ident)
-                if not self._selection[uid]:
-                    del self._selection[uid]
-                if uid in self._pending_move and ident in self._pending_move[uid]:
-                    # Move the object if this is the last deselecting client who
-                    # moved the object
-                    move = self._pending_move[uid].pop(ident)
-                    if not self._pending_move[uid]:
-                        del self._pending_move[uid]
-                        logging.debug(f'Completing move: {uid} -> {move}')
-                        result = self._engine.move_object(uid, *move)
-                        if result:
-                            return True, move
-                return True, None
-        except KeyError:
-            return False, None
-
-    def deselect_all_ident_objects(self, ident):
-        moves = {}
-        for uid in list(self._selection.keys()):
-            result, move = self.deselect_object(uid, ident)
-            if result and move is not None:
-                moves[uid] = move
+    async def deselect_object(self, uid, ident):
+        result, move = self._selections.deselect(uid, ident)
+        if move is not None:
+            # Move the object if this is the last deselecting client who
+            # moved the object
+            logging.debug(f'Completing move: {uid} -> {move}')
+            self._move(uid, *move)
+        return result, move
+
+    async def deselect_all_ident_objects(self, ident):
+        moves = self._selections.deselect_all(ident)
+        self._complete_moves(moves)
         # Return the moves done as a result of deselection
         return moves
+
+    # Release the selections which have not been renewed, return the moves
+    # done as a result
+    async def expire_selections(self):
+        moves = self._selections.expire()
+        self._complete_moves(moves)
+        return moves
+
+    def _complete_moves(self, moves):
+        for uid, move in moves.items():
+            logging.debug(f'Completing move: {uid} -> {move}')
+            self._move(uid, *move)
@@ -1,25 +1,51 @@
+import errno
 import logging
 import os
 import pathlib
 import shutil
+import time
 
 import pymongo
 
+from .blob_store import BlobStore
+from .trash import Trash
+
 class StorageMongoDB:
+    # Maximum number of concurrent connections, the engine may be called
+    # from this many threads at the same time
+    POOL_SIZE = 8
+
     def __init__(self, files_dir):
         self._files_dir = files_dir
-        self._client = pymongo.MongoClient()
+        self._client = pymongo.MongoClient(maxPoolSize=self.POOL_SIZE)
         self._session = self._client.database.session
         self._object = self._client.database.object
+        # Reference counts of the blobs
+        self._blob = self._client.database.blob
+        self._blobs = BlobStore(files_dir)
+        # Deleted sessions which have not been removed completely
+        self._tombstone = self._client.database.tombstone
+        # Generation counter, see _visible()
+        self._counter = self._client.database.counter
+        self._trash = Trash(files_dir)
+        # Identifies this process when reaping deletions
+        self._reaper_id = Trash.new_token()
         self._pending_move = {}
         try:
             self._session.create_index('Name', unique=True, background=True)
+            self._blob.create_index('Digest', unique=True, background=True)
+            self._tombstone.create_index('Token', unique=True, background=True)
+            self._counter.create_index('Name', unique=True, background=True)
             self._object.create_index('Uid', unique=True, background=True)
             self._object.create_index('Session', background=True)
+            self._object.create_index('Gen', background=True)
+            # Paginated listing of the session objects
+            self._object.create_index([('Session', pymongo.ASCENDING),
+                                       ('Uid', pymongo.ASCENDING)], background=True)
         except:
             logging.exception('MongoDB setup failed')
         try:
-            self._session.insert_one({'Name': 'default'})
+            self._session.insert_one({'Name': 'default', 'Gen': 0})
         except pymongo.errors.DuplicateKeyError:
             pass
         except:
@@ -29,10 +55,8 @@ class StorageMongoDB:
 
     def add_session(self, data):
         try:
-            self._session.insert_one(data)
-            # The _id field is added automatically by MongoDB, but we don't
-            # want it in the local data
-            del data['_id']
+            counter = self._counter.find_one({'Name': 'Gen'})
+            self._session.insert_one({**data, 'Gen': counter['Value'] if counter else 0})
             return True
         except:
             logging.exception('MongoDB error')
@@ -40,14 +64,14 @@ class StorageMongoDB:
 
     def get_session(self, name):
         try:
-            return self._session.find_one({'Name': name}, {'_id': 0})
+            return self._session.find_one({'Name': name}, {'_id': 0, 'Gen': 0})
         except:
             logging.exception('MongoDB error')
             return None
 
     def get_all_sessions(self):
         try:
-            return list(self._session.find({}, {'_id': 0}))
+            return list(self._session.find({}, {'_id': 0, 'Gen': 0}))
         except:
             logging.exception('MongoDB error')
             return []
@@ -61,29 +85,30 @@ class StorageMongoDB:
             logging.exception('MongoDB error')
         return names
 
+    # The session and its objects are removed in the background, see reap()
+    #
+    # The deletion is recorded before the session is removed, so that the
+    # objects are removed after a restart.
     def remove_session(self, name):
         name = os.path.basename(name)
+        token = Trash.new_token()
         try:
-            result = self._session.delete_one({'Name': name})
-            if result.deleted_count == 0:
+            self._record_deletion(token, name)
+            if self._session.delete_one({'Name': name}).deleted_count == 0:
+                self._tombstone.delete_one({'Token': token})
                 return False
-            self._object.delete_many({'Session': name})
         except:
             logging.exception('MongoDB error')
             return False
-        try:
-            # Delete files of the session
-            path = pathlib.PurePath(self._files_dir) / name
-            if os.path.exists(path):
-                logging.debug(f'Deleting {path}')
-                shutil.rmtree(path)
-            return True
-        except:
-            logging.exception(f'Delete error')
-            return False
+        return self._trash_files(token, name)
 
     ### Object API
 
+    # The object is inserted without checking that it exists first, the
+    # unique index on Uid rejects duplicates
+    #
+    # Objects with a Digest use the blob with this digest, which is created
+    # from the temp file if given, otherwise it must exist already.
     def add_object(self, data, temp_file=None):
         uid = data['Uid']
         if uid in self._pending_move:
@@ -94,101 +119,490 @@ class StorageMongoDB:
                 data['Scale'] = scale
             if rotation is not None:
                 data['Rotation'] = rotation
-            del self._pending_move[uid]
         try:
-            self._object.insert_one(data)
-            # The _id field is added automatically by MongoDB, but we don't
-            # want it in the local data
-            del data['_id']
+            gen = self._session_gens([data['Session']]).get(data['Session'])
+        except:
+            logging.exception('MongoDB error')
+            return False
+        if gen is None:
+            logging.info(f'Skipping object {uid} of a deleted session')
+            return False
+        digest = data.get('Digest')
+        if digest is not None and not self._acquire_blob(digest, temp_file):
+            return False
+        try:
+            inserted = self._insert_object({**data, 'Gen': gen})
+            if not inserted:
+                logging.info(f'Skipping object {uid} which already exists')
         except:
             logging.exception('MongoDB error')
+            inserted = False
+        if not inserted:
+            if digest is not None:
+                self._release_blob(digest)
             return False
-        if temp_file is not None:
-            # Move the temp file
+        self._pending_move.pop(uid, None)
+        if temp_file is not None and digest is None:
+            # Move the temp file, uploads are staged on the same filesystem so
+            # this is an atomic rename
             path = pathlib.PurePath(self._files_dir, data['Session'], data['Uid'])
             try:
                 os.makedirs(path, exist_ok=True)
-                shutil.move(temp_file, path / os.path.basename(data['FileName']))
+                target = path / os.path.basename(data['FileName'])
+                try:
+                    os.replace(temp_file, target)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(temp_file, target)
             except:
                 logging.exception(f'Failed to move {temp_file} to {path}')
                 return False
         return True
 
+    # Insert multiple objects using a single insert_many(), return a list of
+    # booleans telling which of the objects were added
+    #
+    # File objects must have the Digest of an existing blob.
+    def add_objects(self, items):
+        added = [True] * len(items)
+        try:
+            gens = self._session_gens({data['Session'] for data in items})
+        except:
+            logging.exception('MongoDB error')
+            return [False] * len(items)
+        docs = []
+        for i, data in enumerate(items):
+            move = self._pending_move.get(data['Uid'])
+            if move is not None:
+                data.update(self._move_update(*move))
+            # The documents are copies, so that _id and Gen are not added to
+            # the items
+            docs.append({**data, 'Gen': gens.get(data['Session'])})
+            digest = data.get('Digest')
+            if docs[i]['Gen'] is None:
+                added[i] = False
+            elif digest is not None and not self._acquire_blob(digest):
+                added[i] = False
+        indexes = [i for (i, result) in enumerate(added) if result]
+        if indexes:
+            duplicates = self._insert_objects(docs, indexes, added)
+            if duplicates:
+                try:
+                    freed = self._free_uids([docs[i]['Uid'] for i in duplicates])
+                except:
+                    logging.exception('MongoDB error')
+                    freed = set()
+                retry = [i for i in duplicates if docs[i]['Uid'] in freed]
+                if retry:
+                    for i in retry:
+                        added[i] = True
+                    self._insert_objects(docs, retry, added)
+        acquired = set(indexes)
+        for i, (data, result) in enumerate(zip(items, added)):
+            if result:
+                self._pending_move.pop(data['Uid'], None)
+            elif i in acquired and data.get('Digest') is not None:
+                self._release_blob(data['Digest'])
+        return added
+
+    # Insert the documents with the given indexes using a single
+    # insert_many(), mark the ones which failed in added and return the
+    # indexes of the ones whose Uid exists already
+    def _insert_objects(self, docs, indexes, added):
+        duplicates = []
+        try:
+            self._object.insert_many([docs[i] for i in indexes], ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            for error in e.details.get('writeErrors', ()):
+                index = indexes[error['index']]
+                added[index] = False
+                if error.get('code') == 11000:
+                    duplicates.append(index)
+                else:
+                    logging.error(f'MongoDB error: {error.get("errmsg")}')
+        except:
+            logging.exception('MongoDB error')
+            for i in indexes:
+                added[i] = False
+        return duplicates
+
+    # Insert the object document, return False if the Uid exists already
+    def _insert_object(self, doc):
+        try:
+            self._object.insert_one(doc)
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            if not self._free_uids([doc['Uid']]):
+                return False
+        try:
+            self._object.insert_one(doc)
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            return False
+
+    # Take over the uids of deleted objects which have not been removed yet,
+    # return the uids which are free now
+    #
+    # The deleted objects keep their session and generation, so they are
+    # still removed by reap().
+    def _free_uids(self, uids):
+        items = list(self._object.find({'Uid': {'$in': uids}},
+                                       {'_id': 1, 'Uid': 1, 'Session': 1, 'Gen': 1}))
+        visible = {item['Uid'] for item in self._visible(items)}
+        deleted = [item for item in items if item['Uid'] not in visible]
+        if deleted:
+            self._object.bulk_write([
+                pymongo.UpdateOne({'_id': item['_id'], 'Uid': item['Uid']},
+                                  {'$set': {'Uid': Trash.uid_prefix(Trash.new_token()) + item['Uid']}})
+                for item in deleted], ordered=False)
+        return {item['Uid'] for item in deleted}
+
+    ### Generations
+    #
+    # Objects have the generation of their session when they were added.
+    # Deleting the objects of a session starts a new generation of the
+    # session, the objects of the older generations are no longer visible
+    # and are removed in the background, see reap(). Objects and sessions
+    # without a generation have generation 0.
+
+    # Return a dictionary of session name -> generation of the existing
+    # sessions
+    def _session_gens(self, sessions):
+        return {item['Name']: item.get('Gen', 0) for item in
+                    self._session.find({'Name': {'$in': list(sessions)}},
+                                       {'_id': 0, 'Name': 1, 'Gen': 1})}
+
+    # Return the visible objects of the given ones, which must include Session
+    # and Gen, the Gen field is removed from the returned objects
+    def _visible(self, items):
+        if not items:
+            return []
+        gens = self._session_gens({item['Session'] for item in items})
+        visible = []
+        for item in items:
+            gen = gens.get(item['Session'])
+            if gen is not None and item.pop('Gen', 0) >= gen:
+                visible.append(item)
+        return visible
+
+    # Query of the objects of the given generation and newer ones
+    @staticmethod
+    def _since(gen):
+        return {'Gen': {'$gte': gen}} if gen > 0 else {}
+
+    # Start a new generation and record the deletion of the objects of the
+    # session, or of all sessions, from the older generations, return the new
+    # generation
+    def _record_deletion(self, token, name):
+        gen = self._counter.find_one_and_update({'Name': 'Gen'}, {'$inc': {'Value': 1}},
+                                                upsert=True,
+                                                return_document=pymongo.ReturnDocument.AFTER)['Value']
+        self._tombstone.insert_one({'Token': token, 'Name': name, 'Gen': gen,
+                                    'Created': time.time()})
+        return gen
+
+    ### Blob API
+
+    # Return the digest and size of the blob if it exists
+    def get_blob(self, digest):
+        path = self._blobs.path(digest)
+        try:
+            size = os.path.getsize(path) if path is not None else None
+        except OSError:
+            size = None
+        if size is None:
+            return None
+        return {'Digest': digest, 'Size': size}
+
+    # Add a reference to the blob, which is created from the temp file if
+    # given, return False if the blob does not exist
+    #
+    # The reference is taken first, so that the blob is not removed while
+    # it is being checked. A blob being removed by another thread or process
+    # at the same time may still be lost, as the count and the file are not
+    # changed atomically.
+    def _acquire_blob(self, digest, temp_file=None):
+        try:
+            self._blob.update_one({'Digest': digest}, {'$inc': {'Refs': 1}}, upsert=True)
+        except:
+            logging.exception('MongoDB error')
+            return False
+        try:
+            if temp_file is not None:
+                self._blobs.put(temp_file, digest)
+            elif not self._blobs.exists(digest):
+                logging.info(f'Skipping object with unknown blob {digest}')
+                self._release_blob(digest)
+                return False
+        except:
+            logging.exception(f'Failed to store blob {digest}')
+            self._release_blob(digest)
+            return False
+        return True
+
+    # Remove references to the blob, the blob is removed with the last one
+    def _release_blob(self, digest, count=1):
+        try:
+            blob = self._blob.find_one_and_update({'Digest': digest},
+                                                  {'$inc': {'Refs': -count}},
+                                                  return_document=pymongo.ReturnDocument.AFTER)
+            if blob is None or blob['Refs'] > 0:
+                return
+            result = self._blob.delete_one({'Digest': digest, 'Refs': {'$lte': 0}})
+        except:
+            logging.exception('MongoDB error')
+            return
+        if result.deleted_count:
+            self._blobs.remove(digest)
+
+    def _release_blobs(self, blobs):
+        for digest, count in blobs.items():
+            self._release_blob(digest, count)
+
     def get_object(self, uid):
         try:
-            return self._object.find_one({'Uid': uid}, {'_id': 0})
+            data = self._object.find_one({'Uid': uid}, {'_id': 0})
+            return data if data is not None and self._visible([data]) else None
         except:
             logging.exception('MongoDB error')
             return None
 
+    # Return a dictionary of uid -> session name of the existing objects
+    def get_object_sessions(self, uids):
+        try:
+            items = list(self._object.find({'Uid': {'$in': uids}},
+                                           {'_id': 0, 'Uid': 1, 'Session': 1, 'Gen': 1}))
+            return {item['Uid']: item['Session'] for item in self._visible(items)}
+        except:
+            logging.exception('MongoDB error')
+            return {}
+
+    # Return the path of the object file and the file name
     def get_object_file(self, uid):
         data = self.get_object(uid)
         if not data or 'FileName' not in data:
             return None
-        file_path = pathlib.PurePath(self._files_dir,
-            data['Session'],
-            data['Uid'],
-            data['FileName'])
-        if not os.path.exists(file_path):
+        if 'Digest' in data:
+            file_path = self._blobs.path(data['Digest'])
+        else:
+            file_path = pathlib.PurePath(self._files_dir,
+                data['Session'],
+                data['Uid'],
+                data['FileName'])
+        if file_path is None or not os.path.exists(file_path):
             return None
-        return file_path
+        return file_path, os.path.basename(data['FileName'])
 
     def get_all_objects(self, session):
+        objects = self.load_objects(session)
+        return objects if objects is not None else []
+
+    # Same as get_all_objects(), but return None when failed
+    def load_objects(self, session):
         try:
-            return list(self._object.find({'Session': session}, {'_id': 0}))
+            query = self._session_query(session)
+            if query is None:
+                return []
+            return list(self._object.find(query, {'_id': 0, 'Gen': 0}))
         except:
             logging.exception('MongoDB error')
-            return []
+            return None
+
+    # Return the query of the visible objects of the session, or None if the
+    # session does not exist
+    def _session_query(self, session):
+        gen = self._session_gens([session]).get(session)
+        if gen is None:
+            return None
+        return {'Session': session, **self._since(gen)}
+
+    # Return an iterator over the objects of the session, the objects are
+    # fetched from the database as the iterator advances
+    #
+    # Paginated objects are ordered by Uid, starting after the given one.
+    def iter_objects(self, session, fields=None, after=None, limit=None):
+        if fields is not None:
+            projection = {'_id': 0, **{field: 1 for field in fields}}
+        else:
+            projection = {'_id': 0, 'Gen': 0}
+        try:
+            query = self._session_query(session)
+            if query is None:
+                return iter(())
+            if after is not None:
+                query['Uid'] = {'$gt': after}
+            cursor = self._object.find(query, projection)
+            if after is not None or limit is not None:
+                cursor = cursor.sort('Uid', pymongo.ASCENDING)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            return cursor
+        except:
+            logging.exception('MongoDB error')
+            return iter(())
 
     def get_all_objects_uid_list(self, session):
         uids = []
         try:
-            for item in self._object.find({'Session': session}, {'_id': 0, 'Uid': 1}):
+            query = self._session_query(session)
+            if query is None:
+                return uids
+            for item in self._object.find(query, {'_id': 0, 'Uid': 1}):
                 uids.append(item['Uid'])
         except:
             logging.exception('MongoDB error')
         return uids
 
+    # The objects are removed in the background, see reap()
     def clear(self, session):
+        token = Trash.new_token()
         try:
-            self._object.delete_many({'Session': session})
+            gen = self._record_deletion(token, session)
+            self._session.update_one({'Name': session}, {'$set': {'Gen': gen}})
         except:
             logging.exception('MongoDB error')
             return False
-        try:
-            # Delete files of the session
-            path = pathlib.PurePath(self._files_dir) / session
-            if os.path.exists(path):
-                logging.debug(f'Deleting {path}')
-                shutil.rmtree(path)
-            return True
-        except:
-            logging.exception(f'Delete error')
-            return False
+        return self._trash_files(token, session)
 
     def clear_all(self):
+        token = Trash.new_token()
         try:
+            gen = self._record_deletion(token, None)
             self._session.delete_many({'Name': {'$not': {'$eq': 'default'}}})
-            self._object.delete_many({})
+            self._session.update_one({'Name': 'default'}, {'$set': {'Gen': gen}})
         except:
             logging.exception('MongoDB error')
             return False
+        return self._trash_files(token)
+
+    # Move the files of the session, or of all sessions, to the trash
+    def _trash_files(self, token, session=None):
         try:
-            # Delete all files
-            path = pathlib.PurePath(self._files_dir)
-            if os.path.exists(path):
-                logging.debug(f'Deleting {path}')
-                shutil.rmtree(path)
+            if session is not None:
+                self._trash.move_session(session, token)
+            else:
+                self._trash.move_all(token)
             return True
         except:
             logging.exception(f'Delete error')
             return False
 
+    ### Tombstone API
+
+    # Return the deletions which have not been completed, oldest first
+    def get_tombstones(self):
+        try:
+            return list(self._tombstone.find({}, {'_id': 0, 'Token': 1, 'Name': 1, 'Created': 1})
+                                       .sort('Created', pymongo.ASCENDING))
+        except:
+            logging.exception('MongoDB error')
+            return None
+
+    # A deletion is reaped by one process at a time, which holds a lease
+    # renewed with every batch
+    REAP_LEASE = 60.0
+
+    # Remove at most limit objects or files of the deletion, the files are
+    # removed after the objects. Return the number of removed items and
+    # whether the deletion is complete, or None when failed or reaped by
+    # another process.
+    def reap(self, token, limit):
+        now = time.time()
+        try:
+            claimed = self._tombstone.find_one_and_update(
+                {'Token': token, '$or': [{'Reaper': self._reaper_id},
+                                         {'Lease': {'$not': {'$gt': now}}}]},
+                {'$set': {'Reaper': self._reaper_id, 'Lease': now + self.REAP_LEASE}})
+            if claimed is None:
+                return None
+            items = list(self._object.find(self._deleted_query(claimed['Name'], claimed['Gen']),
+                                           {'_id': 1, 'Digest': 1}).limit(limit))
+            if items:
+                result = self._object.delete_many({'_id': {'$in': [item['_id'] for item in items]}})
+        except:
+            logging.exception('MongoDB error')
+            return None
+        if items:
+            if result.deleted_count == len(items):
+                blobs = {}
+                for item in items:
+                    if 'Digest' in item:
+                        blobs[item['Digest']] = blobs.get(item['Digest'], 0) + 1
+                self._release_blobs(blobs)
+            else:
+                # Deletions of all sessions overlap with the other deletions
+                logging.warning(f'{len(items) - result.deleted_count} of {len(items)} deleted '
+                                f'objects were removed concurrently, keeping their blobs')
+            return len(items), False
+        try:
+            removed, done = self._trash.remove_files(token, limit)
+        except:
+            logging.exception(f'Delete error')
+            return None
+        if done:
+            try:
+                self._tombstone.delete_one({'Token': token})
+            except:
+                logging.exception('MongoDB error')
+                return None
+        return removed, done
+
+    # Query of the objects of the deletion which are not visible, objects of
+    # sessions which started an older generation concurrently with the
+    # deletion remain
+    def _deleted_query(self, name, gen):
+        query = {'Gen': {'$not': {'$gte': gen}}}
+        sessions = {'Gen': {'$not': {'$gte': gen}}}
+        if name is not None:
+            query['Session'] = sessions['Name'] = name
+        kept = [{'Session': item['Name'], **self._since(item.get('Gen', 0))} for item in
+                    self._session.find(sessions, {'_id': 0, 'Name': 1, 'Gen': 1})]
+        if kept:
+            query['$nor'] = kept
+        return query
+
     def move_object(self, uid, position=None, scale=None, rotation=None):
         obj = self.get_object(uid)
         if obj is None:
             self._pending_move[uid] = (position, scale, rotation)
             return False
+        update = self._move_update(position, scale, rotation)
+        try:
+            self._object.update_one({'Uid': uid}, {'$set': update})
+            return True
+        except:
+            logging.exception('MongoDB error')
+            return False
+
+    # Move multiple objects using a single bulk write, moves is a dictionary
+    # of uid -> (position, scale, rotation)
+    def move_objects(self, moves):
+        requests = []
+        for uid, move in moves.items():
+            update = self._move_update(*move)
+            if update:
+                requests.append(pymongo.UpdateOne({'Uid': uid}, {'$set': update}))
+        if not requests:
+            return True
+        try:
+            result = self._object.bulk_write(requests, ordered=False)
+            if result.matched_count < len(requests):
+                # Some of the objects do not exist (yet), remember their moves
+                # in case they are added later
+                found = set()
+                for item in self._object.find({'Uid': {'$in': list(moves.keys())}},
+                                              {'_id': 0, 'Uid': 1}):
+                    found.add(item['Uid'])
+                for uid, move in moves.items():
+                    if uid not in found:
+                        self._pending_move[uid] = move
+            return True
+        except:
+            logging.exception('MongoDB error')
+            return False
+
+    def _move_update(self, position=None, scale=None, rotation=None):
         update = {}
         if position is not None:
             update['Position'] = position
@@ -196,30 +610,60 @@ class StorageMongoDB:
             update['Scale'] = scale
         if rotation is not None:
             update['Rotation'] = rotation
+        return update
+
+    def remove_object(self, uid):
+        return bool(self.remove_objects([uid]))
+
+    # Remove multiple objects, return a dictionary of uid -> session name of
+    # the removed objects
+    #
+    # The objects are found and deleted with one query each. When some of
+    # them are removed concurrently by another request, it is not known which
+    # of them were deleted here, and their blobs are not released rather than
+    # risking releasing them twice.
+    def remove_objects(self, uids):
         try:
-            self._object.update_one({'Uid': uid}, {'$set': update})
-            return True
+            # Deleted objects are left to reap()
+            items = self._visible(list(self._object.find({'Uid': {'$in': uids}},
+                                                         {'_id': 1, 'Uid': 1, 'Session': 1,
+                                                          'Gen': 1, 'FileName': 1,
+                                                          'Digest': 1})))
+            if not items:
+                return {}
+            result = self._object.delete_many({'_id': {'$in': [item['_id'] for item in items]}})
         except:
             logging.exception('MongoDB error')
-            return False
+            return {}
+        if result.deleted_count == len(items):
+            blobs = {}
+            for item in items:
+                if 'Digest' in item:
+                    blobs[item['Digest']] = blobs.get(item['Digest'], 0) + 1
+                else:
+                    self._remove_object_file(item)
+            self._release_blobs(blobs)
+        else:
+            logging.warning(f'{len(items) - result.deleted_count} of {len(items)} objects '
+                            f'were removed concurrently, keeping their blobs')
+            for item in items:
+                if 'Digest' not in item:
+                    self._remove_object_file(item)
+        return {item['Uid']: item['Session'] for item in items}
 
-    def remove_object(self, uid):
+    def _remove_object_file(self, data):
+        if 'Digest' in data:
+            self._release_blob(data['Digest'])
+            return
+        if 'FileName' not in data:
+            return
+        file_path = pathlib.PurePath(self._files_dir,
+            data['Session'],
+            data['Uid'],
+            data['FileName'])
         try:
-            data = self._object.find_one_and_delete({'Uid': uid}, {'_id': 0})
+            logging.debug(f'Deleting {file_path}')
+            os.unlink(file_path)
+            os.removedirs(file_path.parent)
         except:
-            logging.exception('MongoDB error')
-            return False
-        if data is None:
-            return False
-        if 'FileName' in data:
-            file_path = pathlib.PurePath(self._files_dir,
-                data['Session'],
-                data['Uid'],
-                data['FileName'])
-            try:
-                logging.debug(f'Deleting {file_path}')
-                os.unlink(file_path)
-                os.removedirs(file_path.parent)
-            except:
-                logging.exception('Remove error')
-        return True
+            logging.exception('Remove error')
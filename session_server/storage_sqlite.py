@@ -0,0 +1,627 @@
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .blob_store import BlobStore
+from .trash import Trash
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS session (
+    Name TEXT PRIMARY KEY,
+    Data TEXT NOT NULL,
+    Gen INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS object (
+    Uid TEXT PRIMARY KEY,
+    Session TEXT NOT NULL,
+    Digest TEXT,
+    Position TEXT,
+    Scale TEXT,
+    Rotation TEXT,
+    Data TEXT NOT NULL,
+    Gen INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS object_session ON object (Session, Uid);
+CREATE TABLE IF NOT EXISTS blob (
+    Digest TEXT PRIMARY KEY,
+    Refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tombstone (
+    Token TEXT PRIMARY KEY,
+    Name TEXT,
+    Gen INTEGER NOT NULL DEFAULT 0,
+    Created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counter (
+    Name TEXT PRIMARY KEY,
+    Value INTEGER NOT NULL
+);
+'''
+# Columns missing in databases created before the generations were added,
+# the indexes using them are created afterwards
+_ADDED_COLUMNS = (('session', 'Gen INTEGER NOT NULL DEFAULT 0'),
+                  ('object', 'Gen INTEGER NOT NULL DEFAULT 0'),
+                  ('tombstone', 'Gen INTEGER NOT NULL DEFAULT 0'))
+_INDEXES = '''
+CREATE INDEX IF NOT EXISTS object_gen ON object (Gen);
+'''
+
+# Raised to roll back the insert of an object with an unknown blob
+class _BlobMissing(Exception):
+    pass
+
+# Objects have the generation of their session when they were added.
+# Deleting the objects of a session starts a new generation of the session,
+# the objects of the older generations are no longer visible and are
+# removed in the background.
+_VISIBLE = ('EXISTS (SELECT 1 FROM session WHERE session.Name = object.Session '
+            'AND session.Gen <= object.Gen)')
+_SESSION_GEN = '(SELECT Gen FROM session WHERE Name = ?)'
+_CURRENT_GEN = "(SELECT Value FROM counter WHERE Name = 'Gen')"
+
+_OBJECT_COLUMNS = 'Data, Position, Scale, Rotation'
+_INSERT_OBJECT = ('INSERT OR IGNORE INTO object (Uid, Session, Digest, Position, Scale, Rotation, Data, Gen) '
+                  f'VALUES (?, ?, ?, ?, ?, ?, ?, {_SESSION_GEN})')
+_MOVE_OBJECT = ('UPDATE object SET Position = coalesce(?, Position), Scale = coalesce(?, Scale), '
+                f'Rotation = coalesce(?, Rotation) WHERE Uid = ? AND {_VISIBLE}')
+
+# Embedded storage engine keeping the sessions and objects in a SQLite
+# database, with the same API as StorageMongoDB
+#
+# Every thread uses its own connection. The database is in WAL mode, so
+# reads are not blocked by the writer, and the writes of batch calls are done
+# in a single transaction.
+class StorageSQLite:
+    # Maximum number of concurrent connections, the engine may be called
+    # from this many threads at the same time
+    POOL_SIZE = 8
+    # Name of the database file, which is created next to the files
+    # directory as the sessions are removed from there
+    DATABASE = 'session.sqlite3'
+    # How long to wait for a write lock held by another process, in seconds
+    BUSY_TIMEOUT = 10.0
+    # Number of objects read at once by iter_objects()
+    PAGE_SIZE = 500
+
+    TRANSFORM_FIELDS = ('Position', 'Scale', 'Rotation')
+
+    def __init__(self, files_dir, path=None):
+        self._files_dir = files_dir
+        self._path = path or os.path.join(os.path.dirname(os.path.abspath(files_dir)),
+                                          self.DATABASE)
+        self._blobs = BlobStore(files_dir)
+        self._trash = Trash(files_dir)
+        self._local = threading.local()
+        # SQLite allows a single writer, the threads of the process wait
+        # here instead of retrying on busy errors
+        self._write_lock = threading.Lock()
+        self._pending_move = {}
+        try:
+            # The schema statements commit on their own
+            db = self._db()
+            db.executescript(_SCHEMA)
+            for table, column in _ADDED_COLUMNS:
+                if column.split()[0] not in {row[1] for row in
+                                                 db.execute(f'PRAGMA table_info({table})')}:
+                    db.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+            db.executescript(_INDEXES)
+            with self._write() as db:
+                db.execute('INSERT OR IGNORE INTO session (Name, Data) VALUES (?, ?)',
+                           ('default', json.dumps({'Name': 'default'})))
+                db.execute("INSERT OR IGNORE INTO counter (Name, Value) VALUES ('Gen', 0)")
+        except:
+            logging.exception('SQLite setup failed')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Transactions are started explicitly
+            db = sqlite3.connect(self._path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+            db.execute('PRAGMA journal_mode = WAL')
+            # Committed transactions are durable once the WAL is checkpointed,
+            # a power loss may lose the last ones but never corrupts the
+            # database
+            db.execute('PRAGMA synchronous = NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db()
+        with self._write_lock:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+    ### Session API
+
+    def add_session(self, data):
+        try:
+            with self._write() as db:
+                db.execute(f'INSERT INTO session (Name, Data, Gen) VALUES (?, ?, {_CURRENT_GEN})',
+                           (data['Name'], json.dumps(data)))
+            return True
+        except:
+            logging.exception('SQLite error')
+            return False
+
+    def get_session(self, name):
+        try:
+            row = self._db().execute('SELECT Data FROM session WHERE Name = ?',
+                                     (name,)).fetchone()
+        except:
+            logging.exception('SQLite error')
+            return None
+        return json.loads(row[0]) if row is not None else None
+
+    def get_all_sessions(self):
+        try:
+            return [json.loads(row[0]) for row in
+                        self._db().execute('SELECT Data FROM session ORDER BY rowid')]
+        except:
+            logging.exception('SQLite error')
+            return []
+
+    def get_all_sessions_name_list(self):
+        try:
+            return [row[0] for row in
+                        self._db().execute('SELECT Name FROM session ORDER BY rowid')]
+        except:
+            logging.exception('SQLite error')
+            return []
+
+    # The session and its objects are removed in the background, see reap()
+    def remove_session(self, name):
+        name = os.path.basename(name)
+        token = Trash.new_token()
+        try:
+            with self._write() as db:
+                if db.execute('DELETE FROM session WHERE Name = ?', (name,)).rowcount == 0:
+                    return False
+                self._tombstone(db, token, name)
+        except:
+            logging.exception('SQLite error')
+            return False
+        return self._trash_files(token, name)
+
+    ### Object API
+
+    # The transforms are stored in their own columns, so that moves do not
+    # have to rewrite the other fields
+    def _object_row(self, data):
+        fields = {key: val for (key, val) in data.items() if key not in self.TRANSFORM_FIELDS}
+        transforms = [json.dumps(data[key]) if key in data else None
+                      for key in self.TRANSFORM_FIELDS]
+        return (data['Uid'], data['Session'], data.get('Digest'), *transforms,
+                json.dumps(fields), data['Session'])
+
+    def _object_dict(self, row, fields=None):
+        data = json.loads(row[0])
+        for key, value in zip(self.TRANSFORM_FIELDS, row[1:]):
+            if value is not None:
+                data[key] = json.loads(value)
+        if fields is not None:
+            data = {key: data[key] for key in fields if key in data}
+        return data
+
+    def _apply_pending_move(self, data):
+        move = self._pending_move.get(data['Uid'])
+        if move is not None:
+            data.update(self._move_update(*move))
+
+    # Objects with a Digest use the blob with this digest, which is created
+    # from the temp file if given, otherwise it must exist already
+    #
+    # The files are moved into place after the transaction, so that a failed
+    # transaction does not leave them behind. If moving fails the object is
+    # removed again.
+    def add_object(self, data, temp_file=None):
+        uid = data['Uid']
+        self._apply_pending_move(data)
+        digest = data.get('Digest')
+        try:
+            with self._write() as db:
+                if not self._insert_object(db, data):
+                    logging.info(f'Skipping object {uid} which already exists')
+                    return False
+                if digest is not None and not self._acquire_blob(db, digest, temp_file):
+                    # Roll back the insert
+                    raise _BlobMissing()
+        except _BlobMissing:
+            logging.info(f'Skipping object with unknown blob {digest}')
+            return False
+        except:
+            logging.exception('SQLite error')
+            return False
+        self._pending_move.pop(uid, None)
+        if temp_file is None:
+            return True
+        try:
+            if digest is not None:
+                self._blobs.put(temp_file, digest)
+            else:
+                # Uploads are staged on the same filesystem, so this is an
+                # atomic rename
+                path = pathlib.PurePath(self._files_dir, data['Session'], data['Uid'])
+                os.makedirs(path, exist_ok=True)
+                os.replace(temp_file, path / os.path.basename(data['FileName']))
+        except:
+            logging.exception(f'Failed to move {temp_file} into place')
+            self.remove_objects([uid])
+            return False
+        return True
+
+    # Insert the object in the transaction, return False if it exists
+    #
+    # The uid of a deleted object which has not been removed yet is taken
+    # over, the deleted object keeps its session and generation and is still
+    # removed by reap().
+    def _insert_object(self, db, data):
+        row = self._object_row(data)
+        if db.execute(_INSERT_OBJECT, row).rowcount:
+            return True
+        if not db.execute(f'UPDATE object SET Uid = ? || Uid WHERE Uid = ? AND NOT {_VISIBLE}',
+                          (Trash.uid_prefix(Trash.new_token()), data['Uid'])).rowcount:
+            return False
+        return db.execute(_INSERT_OBJECT, row).rowcount > 0
+
+    # Insert multiple objects in a single transaction, return a list of
+    # booleans telling which of the objects were added
+    #
+    # File objects must have the Digest of an existing blob.
+    def add_objects(self, items):
+        added = [False] * len(items)
+        try:
+            with self._write() as db:
+                for i, data in enumerate(items):
+                    self._apply_pending_move(data)
+                    digest = data.get('Digest')
+                    if digest is not None and not self._blobs.exists(digest):
+                        continue
+                    if not self._insert_object(db, data):
+                        continue
+                    if digest is not None:
+                        self._acquire_blob(db, digest)
+                    added[i] = True
+        except:
+            logging.exception('SQLite error')
+            return [False] * len(items)
+        for data, result in zip(items, added):
+            if result:
+                self._pending_move.pop(data['Uid'], None)
+        return added
+
+    ### Blob API
+
+    # Return the digest and size of the blob if it exists
+    def get_blob(self, digest):
+        path = self._blobs.path(digest)
+        try:
+            size = os.path.getsize(path) if path is not None else None
+        except OSError:
+            size = None
+        if size is None:
+            return None
+        return {'Digest': digest, 'Size': size}
+
+    # Add a reference to the blob in the transaction, return False if the
+    # blob does not exist, unless it is created from a temp file afterwards
+    #
+    # A blob being removed by another process at the same time may still be
+    # lost, as the files are removed after the transaction.
+    def _acquire_blob(self, db, digest, temp_file=None):
+        if temp_file is None and not self._blobs.exists(digest):
+            return False
+        db.execute('INSERT OR IGNORE INTO blob (Digest, Refs) VALUES (?, 0)', (digest,))
+        db.execute('UPDATE blob SET Refs = Refs + 1 WHERE Digest = ?', (digest,))
+        return True
+
+    # Remove references to the blobs in the transaction, blobs is a
+    # dictionary of digest -> number of references, return the digests of the
+    # blobs which are no longer used
+    def _release_blobs(self, db, blobs):
+        if not blobs:
+            return []
+        db.executemany('UPDATE blob SET Refs = Refs - ? WHERE Digest = ?',
+                       [(count, digest) for (digest, count) in blobs.items()])
+        unused = [row[0] for row in db.execute('SELECT Digest FROM blob WHERE Refs <= 0')]
+        db.execute('DELETE FROM blob WHERE Refs <= 0')
+        return unused
+
+    def _remove_blobs(self, digests):
+        for digest in digests:
+            self._blobs.remove(digest)
+
+    def get_object(self, uid):
+        try:
+            row = self._db().execute(f'SELECT {_OBJECT_COLUMNS} FROM object '
+                                     f'WHERE Uid = ? AND {_VISIBLE}', (uid,)).fetchone()
+        except:
+            logging.exception('SQLite error')
+            return None
+        return self._object_dict(row) if row is not None else None
+
+    # Return a dictionary of uid -> session name of the existing objects
+    def get_object_sessions(self, uids):
+        try:
+            return dict(self._select_objects(self._db(), 'Uid, Session', uids))
+        except:
+            logging.exception('SQLite error')
+            return {}
+
+    # Return the path of the object file and the file name
+    def get_object_file(self, uid):
+        data = self.get_object(uid)
+        if not data or 'FileName' not in data:
+            return None
+        if 'Digest' in data:
+            file_path = self._blobs.path(data['Digest'])
+        else:
+            file_path = pathlib.PurePath(self._files_dir,
+                data['Session'],
+                data['Uid'],
+                data['FileName'])
+        if file_path is None or not os.path.exists(file_path):
+            return None
+        return file_path, os.path.basename(data['FileName'])
+
+    def get_all_objects(self, session):
+        objects = self.load_objects(session)
+        return objects if objects is not None else []
+
+    # Same as get_all_objects(), but return None when failed
+    def load_objects(self, session):
+        try:
+            rows = self._db().execute(f'SELECT {_OBJECT_COLUMNS} FROM object '
+                                      f'WHERE Session = ? AND Gen >= {_SESSION_GEN} ORDER BY rowid',
+                                      (session, session)).fetchall()
+        except:
+            logging.exception('SQLite error')
+            return None
+        return [self._object_dict(row) for row in rows]
+
+    # Return an iterator over the objects of the session ordered by Uid,
+    # starting after the given one
+    #
+    # The objects are read in pages as the iterator advances, each page with
+    # the connection of the thread reading it.
+    def iter_objects(self, session, fields=None, after=None, limit=None):
+        def iterate(after, remaining):
+            while remaining is None or remaining > 0:
+                size = self.PAGE_SIZE if remaining is None else min(self.PAGE_SIZE, remaining)
+                try:
+                    rows = self._db().execute(f'SELECT Uid, {_OBJECT_COLUMNS} FROM object '
+                                              f'WHERE Session = ? AND Gen >= {_SESSION_GEN} '
+                                              'AND Uid > ? ORDER BY Uid LIMIT ?',
+                                              (session, session, after, size)).fetchall()
+                except:
+                    logging.exception('SQLite error')
+                    return
+                for row in rows:
+                    yield self._object_dict(row[1:], fields)
+                if len(rows) < size:
+                    return
+                after = rows[-1][0]
+                if remaining is not None:
+                    remaining -= len(rows)
+        return iterate(after or '', limit)
+
+    def get_all_objects_uid_list(self, session):
+        try:
+            return [row[0] for row in self._db().execute(
+                f'SELECT Uid FROM object WHERE Session = ? AND Gen >= {_SESSION_GEN} '
+                'ORDER BY rowid', (session, session))]
+        except:
+            logging.exception('SQLite error')
+            return []
+
+    # The objects are removed in the background, see reap()
+    def clear(self, session):
+        token = Trash.new_token()
+        try:
+            with self._write() as db:
+                gen = self._tombstone(db, token, session)
+                db.execute('UPDATE session SET Gen = ? WHERE Name = ?', (gen, session))
+        except:
+            logging.exception('SQLite error')
+            return False
+        return self._trash_files(token, session)
+
+    def clear_all(self):
+        token = Trash.new_token()
+        try:
+            with self._write() as db:
+                db.execute("DELETE FROM session WHERE Name != 'default'")
+                gen = self._tombstone(db, token, None)
+                db.execute('UPDATE session SET Gen = ?', (gen,))
+        except:
+            logging.exception('SQLite error')
+            return False
+        return self._trash_files(token)
+
+    # Start a new generation and record the deletion of the objects of the
+    # session, or of all sessions, from the older generations in the
+    # transaction, return the new generation
+    def _tombstone(self, db, token, name):
+        db.execute("UPDATE counter SET Value = Value + 1 WHERE Name = 'Gen'")
+        gen = db.execute(f'SELECT {_CURRENT_GEN}').fetchone()[0]
+        db.execute('INSERT INTO tombstone (Token, Name, Gen, Created) VALUES (?, ?, ?, ?)',
+                   (token, name, gen, time.time()))
+        return gen
+
+    # Move the files of the session, or of all sessions, to the trash
+    def _trash_files(self, token, session=None):
+        try:
+            if session is not None:
+                self._trash.move_session(session, token)
+            else:
+                self._trash.move_all(token)
+            return True
+        except:
+            logging.exception(f'Delete error')
+            return False
+
+    ### Tombstone API
+
+    # Return the deletions which have not been completed, oldest first
+    def get_tombstones(self):
+        try:
+            return [{'Token': row[0], 'Name': row[1], 'Created': row[2]} for row in
+                        self._db().execute('SELECT Token, Name, Created FROM tombstone '
+                                           'ORDER BY Created')]
+        except:
+            logging.exception('SQLite error')
+            return None
+
+    # Remove at most limit objects or files of the deletion, the files are
+    # removed after the objects. Return the number of removed items and
+    # whether the deletion is complete, or None when failed.
+    def reap(self, token, limit):
+        try:
+            with self._write() as db:
+                tombstone = db.execute('SELECT Name, Gen FROM tombstone WHERE Token = ?',
+                                       (token,)).fetchone()
+                if tombstone is None:
+                    return 0, True
+                name, gen = tombstone
+                # Objects of the session or of all sessions, only the objects
+                # which are not visible are removed
+                condition = 'Session = ? AND' if name is not None else ''
+                params = (name,) if name is not None else ()
+                rows = db.execute(f'SELECT rowid, Digest FROM object WHERE {condition} '
+                                  f'Gen < ? AND NOT {_VISIBLE} LIMIT ?',
+                                  (*params, gen, limit)).fetchall()
+                db.executemany('DELETE FROM object WHERE rowid = ?', [(row[0],) for row in rows])
+                blobs = {}
+                for rowid, digest in rows:
+                    if digest is not None:
+                        blobs[digest] = blobs.get(digest, 0) + 1
+                unused = self._release_blobs(db, blobs)
+        except:
+            logging.exception('SQLite error')
+            return None
+        self._remove_blobs(unused)
+        if rows:
+            return len(rows), False
+        try:
+            removed, done = self._trash.remove_files(token, limit)
+        except:
+            logging.exception(f'Delete error')
+            return None
+        if done:
+            try:
+                with self._write() as db:
+                    db.execute('DELETE FROM tombstone WHERE Token = ?', (token,))
+            except:
+                logging.exception('SQLite error')
+                return None
+        return removed, done
+
+    def _move_params(self, uid, position=None, scale=None, rotation=None):
+        return tuple(json.dumps(value) if value is not None else None
+                     for value in (position, scale, rotation)) + (uid,)
+
+    def move_object(self, uid, position=None, scale=None, rotation=None):
+        try:
+            with self._write() as db:
+                moved = db.execute(_MOVE_OBJECT,
+                                   self._move_params(uid, position, scale, rotation)).rowcount
+        except:
+            logging.exception('SQLite error')
+            return False
+        if not moved:
+            self._pending_move[uid] = (position, scale, rotation)
+            return False
+        return True
+
+    # Move multiple objects in a single transaction, moves is a dictionary of
+    # uid -> (position, scale, rotation)
+    def move_objects(self, moves):
+        if not moves:
+            return True
+        try:
+            with self._write() as db:
+                moved = db.executemany(_MOVE_OBJECT, [self._move_params(uid, *move)
+                                                      for (uid, move) in moves.items()]).rowcount
+                if moved < len(moves):
+                    # Some of the objects do not exist (yet), remember their
+                    # moves in case they are added later
+                    found = {row[0] for row in self._select_objects(db, 'Uid', list(moves))}
+                    for uid, move in moves.items():
+                        if uid not in found:
+                            self._pending_move[uid] = move
+            return True
+        except:
+            logging.exception('SQLite error')
+            return False
+
+    # SQLite limits the number of parameters of a statement, so long lists of
+    # uids are queried in parts
+    _MAX_PARAMS = 500
+
+    def _select_objects(self, db, columns, uids):
+        rows = []
+        for i in range(0, len(uids), self._MAX_PARAMS):
+            part = uids[i:i + self._MAX_PARAMS]
+            rows.extend(db.execute(f'SELECT {columns} FROM object WHERE Uid IN '
+                                   f'({", ".join("?" * len(part))}) AND {_VISIBLE}', part))
+        return rows
+
+    def _move_update(self, position=None, scale=None, rotation=None):
+        update = {}
+        if position is not None:
+            update['Position'] = position
+        if scale is not None:
+            update['Scale'] = scale
+        if rotation is not None:
+            update['Rotation'] = rotation
+        return update
+
+    def remove_object(self, uid):
+        removed = self.remove_objects([uid])
+        return bool(removed)
+
+    # Remove multiple objects in a single transaction, return a dictionary of
+    # uid -> session name of the removed objects
+    def remove_objects(self, uids):
+        try:
+            with self._write() as db:
+                items = [json.loads(row[0]) for row in
+                             self._select_objects(db, 'Data', uids)]
+                db.executemany('DELETE FROM object WHERE Uid = ?',
+                               [(item['Uid'],) for item in items])
+                blobs = {}
+                for item in items:
+                    if 'Digest' in item:
+                        blobs[item['Digest']] = blobs.get(item['Digest'], 0) + 1
+                unused = self._release_blobs(db, blobs)
+        except:
+            logging.exception('SQLite error')
+            return {}
+        self._remove_blobs(unused)
+        for item in items:
+            self._remove_object_file(item)
+        return {item['Uid']: item['Session'] for item in items}
+
+    def _remove_object_file(self, data):
+        if 'Digest' in data or 'FileName' not in data:
+            return
+        file_path = pathlib.PurePath(self._files_dir,
+            data['Session'],
+            data['Uid'],
+            data['FileName'])
+        try:
+            logging.debug(f'Deleting {file_path}')
+            os.unlink(file_path)
+            os.removedirs(file_path.parent)
+        except:
+            logging.exception('Remove error')
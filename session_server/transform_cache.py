@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+
+class TransformCache:
+    # How often the dirty transforms are checked, in seconds
+    FLUSH_INTERVAL = 1.0
+    # The longest time a transform of an object which is being continuously
+    # moved may stay unwritten, in seconds
+    MAX_STALENESS = 5.0
+
+    def __init__(self, flush_func, flush_interval=None, max_staleness=None, loop=None):
+        # Coroutine function which writes a dictionary of uid -> (position,
+        # scale, rotation) to the storage engine
+        self._flush_func = flush_func
+        self._flush_interval = flush_interval or self.FLUSH_INTERVAL
+        self._max_staleness = max_staleness or self.MAX_STALENESS
+        self._loop = loop or asyncio.get_event_loop()
+        self._task = None
+        # uid -> [position, scale, rotation, first dirty time, last update time]
+        self._entries = {}
+        # uid -> entry being written, which is still read until the write
+        # completes so that reads do not return the old transform
+        self._flushing = {}
+
+    def start(self):
+        if self._task is None:
+            self._task = self._loop.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        # Final flush of everything that is still dirty
+        await self.flush(force=True)
+
+    def __len__(self):
+        return len(self._entries) + sum(1 for uid in self._flushing if uid not in self._entries)
+
+    def move(self, uid, position=None, scale=None, rotation=None):
+        now = time.monotonic()
+        entry = self._entries.get(uid)
+        if entry is None:
+            self._entries[uid] = [position, scale, rotation, now, now]
+            return
+        if position is not None:
+            entry[0] = position
+        if scale is not None:
+            entry[1] = scale
+        if rotation is not None:
+            entry[2] = rotation
+        entry[4] = now
+
+    def get(self, uid):
+        entry = self._entry(uid)
+        if entry is None:
+            return None
+        return tuple(entry[:3])
+
+    def pop(self, uid):
+        entry = self._entry(uid)
+        self._entries.pop(uid, None)
+        self._flushing.pop(uid, None)
+        if entry is None:
+            return None
+        return tuple(entry[:3])
+
+    # Return the unwritten transform, the fields moved since the write
+    # started take precedence over the ones being written
+    def _entry(self, uid):
+        entry = self._entries.get(uid)
+        flushing = self._flushing.get(uid)
+        if flushing is None:
+            return entry
+        if entry is None:
+            return flushing
+        return self._merge(entry, flushing)
+
+    @staticmethod
+    def _merge(entry, older):
+        if older is None:
+            return entry
+        return [value if value is not None else old for (value, old) in
+                    zip(entry[:3], older[:3])] + entry[3:]
+
+    # Update the object data with the unwritten transform
+    def apply(self, data):
+        entry = self._entry(data['Uid'])
+        if entry is not None:
+            for field, value in zip(('Position', 'Scale', 'Rotation'), entry):
+                if value is not None:
+                    data[field] = value
+        return data
+
+    async def flush(self, force=False):
+        if not self._entries:
+            return True
+        now = time.monotonic()
+        moves, entries = {}, {}
+        for uid, entry in list(self._entries.items()):
+            # Write the transform when the object has not been moved for
+            # a while or when the write has been postponed for too long
+            if (force or now - entry[4] >= self._flush_interval or
+                    now - entry[3] >= self._max_staleness):
+                del self._entries[uid]
+                # The fields of an earlier write still in progress are
+                # written again
+                entry = self._merge(entry, self._flushing.get(uid))
+                moves[uid] = tuple(entry[:3])
+                entries[uid] = self._flushing[uid] = entry
+        if not moves:
+            return True
+        logging.debug(f'Flushing {len(moves)} transforms')
+        try:
+            result = await self._flush_func(moves)
+        except asyncio.CancelledError:
+            self._complete(entries, False)
+            raise
+        except:
+            logging.exception('Transform flush failed')
+            result = False
+        self._complete(entries, result)
+        return result
+
+    # Stop reading the written entries and put back the ones which failed to
+    # be written, unless the object has been removed or a later write of it
+    # has started in the meantime
+    def _complete(self, entries, written):
+        for uid, entry in entries.items():
+            if self._flushing.get(uid) is not entry:
+                continue
+            del self._flushing[uid]
+            if written:
+                continue
+            current = self._entries.get(uid)
+            if current is None:
+                self._entries[uid] = entry
+            else:
+                for i in range(3):
+                    if current[i] is None:
+                        current[i] = entry[i]
+                current[3] = entry[3]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
@@ -0,0 +1,75 @@
+import logging
+import os
+from contextlib import suppress
+
+from .blob_store import BlobStore
+from .uploads import STAGING_DIR
+
+# Deleted sessions are moved to the trash at once and removed in the
+# background. Each deletion has a random token: the files are moved to the
+# trash directory of the token, so that the session names can be used again
+# immediately. The deleted objects are hidden by the storage engines until
+# they are removed.
+class Trash:
+    # Directory of the trash inside the files directory
+    DIR = '.trash'
+    # Prefix of the uids of the deleted objects
+    PREFIX = '.trash/'
+    # Entries of the files directory which are not removed with all sessions
+    KEEP = (DIR, BlobStore.DIR, STAGING_DIR)
+
+    def __init__(self, files_dir):
+        self._files_dir = files_dir
+        self._dir = os.path.join(files_dir, self.DIR)
+
+    @staticmethod
+    def new_token():
+        return os.urandom(8).hex()
+
+    # Prefix of the uids of the deleted objects
+    @classmethod
+    def uid_prefix(cls, token):
+        return cls.PREFIX + token + '/'
+
+    def path(self, token):
+        return os.path.join(self._dir, token)
+
+    # Move the files of the session to the trash
+    def move_session(self, session, token):
+        session = os.path.basename(session)
+        if session in ('', '.', '..') or session in self.KEEP:
+            return
+        path = os.path.join(self._files_dir, session)
+        if not os.path.exists(path):
+            return
+        os.makedirs(self._dir, exist_ok=True)
+        os.rename(path, self.path(token))
+
+    # Move the files of all sessions to the trash
+    def move_all(self, token):
+        try:
+            entries = [entry for entry in os.listdir(self._files_dir) if entry not in self.KEEP]
+        except FileNotFoundError:
+            return
+        if not entries:
+            return
+        target = self.path(token)
+        os.makedirs(target, exist_ok=True)
+        for entry in entries:
+            os.rename(os.path.join(self._files_dir, entry), os.path.join(target, entry))
+
+    # Remove at most limit files of the token from the trash, return the
+    # number of removed files and whether all of them are removed
+    def remove_files(self, token, limit):
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.path(token), topdown=False):
+            for name in filenames:
+                with suppress(FileNotFoundError):
+                    os.unlink(os.path.join(dirpath, name))
+                removed += 1
+                if removed >= limit:
+                    return removed, False
+            logging.debug(f'Deleting {dirpath}')
+            with suppress(FileNotFoundError):
+                os.rmdir(dirpath)
+        return removed, True
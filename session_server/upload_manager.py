@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import suppress
+
+from . import uploads
+
+class UploadError(Exception):
+    pass
+
+# Resumable uploads of large files, which are sent in numbered chunks and
+# committed when all chunks have been received
+#
+# Each upload is a directory holding its metadata and a file for every
+# received chunk. The state is only kept on the disk, so chunks may be sent
+# in parallel, repeated, and handled by any of the worker processes.
+class UploadManager:
+    # Directory of the uploads inside the staging directory
+    DIR = 'uploads'
+    # Default and allowed sizes of the chunks in bytes, all chunks except
+    # the last one have the same size
+    CHUNK_SIZE = 8 * 1024 * 1024
+    MIN_CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 64 * 1024 * 1024
+    # Maximum size of an uploaded file in bytes
+    MAX_SIZE = 16 * 1024 * 1024 * 1024
+    # Uploads without any activity for this long are removed, in seconds
+    EXPIRY = 3600.0
+    # How often the expired uploads are removed, in seconds
+    GC_INTERVAL = 300.0
+
+    _ID = re.compile('[0-9a-f]{32}')
+    _META = 'meta.json'
+    # Suffix of the uploads being committed
+    _COMMIT = '.commit'
+
+    def __init__(self, staging_dir, loop=None):
+        self._staging_dir = staging_dir
+        self._dir = os.path.join(staging_dir, self.DIR)
+        self._loop = loop or asyncio.get_event_loop()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = self._loop.create_task(self._gc_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _run(self, func, *args):
+        return self._loop.run_in_executor(None, func, *args)
+
+    def _path(self, upload_id):
+        if not isinstance(upload_id, str) or self._ID.fullmatch(upload_id) is None:
+            return None
+        return os.path.join(self._dir, upload_id)
+
+    # Create an upload of a file of the given size, return its description
+    async def create(self, size, chunk_size=None):
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise UploadError('Invalid size')
+        if size > self.MAX_SIZE:
+            raise UploadError(f'Size exceeds the maximum of {self.MAX_SIZE} bytes')
+        if (not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or
+                not self.MIN_CHUNK_SIZE <= chunk_size <= self.MAX_CHUNK_SIZE):
+            raise UploadError('Invalid chunk size')
+        upload_id = os.urandom(16).hex()
+        meta = {'Size': size, 'ChunkSize': chunk_size}
+        def create():
+            path = self._path(upload_id)
+            os.makedirs(path)
+            with open(os.path.join(path, self._META), 'w') as fp:
+                json.dump(meta, fp)
+        await self._run(create)
+        logging.debug(f'Created upload {upload_id} of {size} bytes')
+        return self._describe(upload_id, meta, [])
+
+    def _describe(self, upload_id, meta, received):
+        size, chunk_size = meta['Size'], meta['ChunkSize']
+        return {'Id': upload_id,
+                'Size': size,
+                'ChunkSize': chunk_size,
+                'Chunks': self._chunk_count(size, chunk_size),
+                'Received': received}
+
+    @staticmethod
+    def _chunk_count(size, chunk_size):
+        return max((size + chunk_size - 1) // chunk_size, 1)
+
+    def _load(self, upload_id):
+        path = self._path(upload_id)
+        if path is None:
+            return None, None
+        try:
+            with open(os.path.join(path, self._META)) as fp:
+                return path, json.load(fp)
+        except FileNotFoundError:
+            return None, None
+
+    @staticmethod
+    def _received(path):
+        return sorted(int(name[:-5]) for name in os.listdir(path) if name.endswith('.part'))
+
+    # Return the description of the upload with the indexes of the received
+    # chunks, or None if the upload does not exist
+    async def status(self, upload_id):
+        def status():
+            path, meta = self._load(upload_id)
+            if path is None:
+                return None
+            return self._describe(upload_id, meta, self._received(path))
+        return await self._run(status)
+
+    # Write the chunk with the given index, which is read by the read_chunk
+    # coroutine function, return False if the upload does not exist
+    async def write_chunk(self, upload_id, index, read_chunk):
+        path, meta = await self._run(self._load, upload_id)
+        if path is None:
+            return False
+        size, chunk_size = meta['Size'], meta['ChunkSize']
+        if not 0 <= index < self._chunk_count(size, chunk_size):
+            raise UploadError('Invalid chunk index')
+        length = min(chunk_size, size - index * chunk_size)
+        received = 0
+        async def read_limited(max_size):
+            nonlocal received
+            data = await read_chunk(max_size)
+            received += len(data)
+            if received > length:
+                raise UploadError('Chunk too large')
+            return data
+        temp_path, digest = await uploads.stage_upload(read_limited, path, loop=self._loop)
+        if received != length:
+            await uploads.discard_upload(temp_path, self._loop)
+            raise UploadError('Incomplete chunk')
+        def complete():
+            # Repeated chunks replace the previous ones
+            os.replace(temp_path, os.path.join(path, f'{index}.part'))
+            os.utime(path)
+        try:
+            await self._run(complete)
+        except FileNotFoundError:
+            # The upload has been committed or removed meanwhile
+            await uploads.discard_upload(temp_path, self._loop)
+            return False
+        return {'Index': index, 'Size': length, 'Digest': digest}
+
+    # Assemble the file of a complete upload in the staging directory and
+    # return its path and SHA-256 digest, or None if the upload does not
+    # exist. The upload must be finished with finish() afterwards.
+    async def commit(self, upload_id):
+        def commit():
+            path, meta = self._load(upload_id)
+            if path is None:
+                return None
+            committing = path + self._COMMIT
+            try:
+                # Only one request may commit the upload
+                os.rename(path, committing)
+            except FileNotFoundError:
+                return None
+            count = self._chunk_count(meta['Size'], meta['ChunkSize'])
+            received = set(self._received(committing))
+            if len(received) < count:
+                os.rename(committing, path)
+                # Only the first missing chunks are listed
+                missing = itertools.islice((index for index in range(count) if
+                                                index not in received), 10)
+                raise UploadError(f'{count - len(received)} missing chunks, '
+                                  f'first: {list(missing)}')
+            fd, temp_path = tempfile.mkstemp(dir=self._staging_dir)
+            digest = hashlib.sha256()
+            try:
+                with os.fdopen(fd, mode='wb') as output:
+                    for index in range(count):
+                        with open(os.path.join(committing, f'{index}.part'), 'rb') as fp:
+                            while True:
+                                data = fp.read(uploads.CHUNK_SIZE)
+                                if not data:
+                                    break
+                                digest.update(data)
+                                output.write(data)
+            except:
+                os.unlink(temp_path)
+                os.rename(committing, path)
+                raise
+            return temp_path, digest.hexdigest()
+        return await self._run(commit)
+
+    # Remove the committed upload if the file was used, otherwise make it
+    # available again
+    async def finish(self, upload_id, used):
+        path = self._path(upload_id)
+        def finish():
+            if used:
+                shutil.rmtree(path + self._COMMIT, ignore_errors=True)
+            else:
+                with suppress(OSError):
+                    os.rename(path + self._COMMIT, path)
+        await self._run(finish)
+
+    async def abort(self, upload_id):
+        path = self._path(upload_id)
+        if path is None:
+            return False
+        def abort():
+            if not os.path.exists(path):
+                return False
+            shutil.rmtree(path, ignore_errors=True)
+            return True
+        return await self._run(abort)
+
+    # Remove the uploads which have expired, including uploads left behind by
+    # a previous run of the server, and the staged files which were left
+    # behind by failed commits and uploads
+    def collect(self):
+        limit = time.time() - self.EXPIRY
+        entries = []
+        with suppress(FileNotFoundError):
+            entries.extend(os.scandir(self._dir))
+        with suppress(FileNotFoundError):
+            entries.extend(entry for entry in os.scandir(self._staging_dir) if
+                               entry.is_file(follow_symlinks=False))
+        removed = 0
+        for entry in entries:
+            with suppress(OSError):
+                if entry.stat().st_mtime < limit:
+                    logging.debug(f'Removing expired upload {entry.name}')
+                    if entry.is_dir():
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.unlink(entry.path)
+                    removed += 1
+        return removed
+
+    async def _gc_loop(self):
+        while True:
+            try:
+                await self._run(self.collect)
+            except asyncio.CancelledError:
+                raise
+            except:
+                logging.exception('Failed to remove expired uploads')
+            await asyncio.sleep(self.GC_INTERVAL)
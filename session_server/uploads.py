@@ -0,0 +1,61 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import suppress
+
+# Uploaded files are written to this directory inside the files directory,
+# so that they can be moved to their final place by renaming
+STAGING_DIR = '.staging'
+# Size of the chunks read from the request and written to the disk
+CHUNK_SIZE = 1024 * 1024
+
+def staging_dir(files_dir):
+    return os.path.join(files_dir, STAGING_DIR)
+
+# Write the content returned by the read_chunk coroutine function to a new
+# file in the staging directory, return its path and SHA-256 digest
+#
+# The file is written and hashed in the executor, while the next chunk is
+# being read.
+async def stage_upload(read_chunk, directory, chunk_size=None, loop=None, executor=None):
+    loop = loop or asyncio.get_event_loop()
+    chunk_size = chunk_size or CHUNK_SIZE
+    def create():
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory)
+        return os.fdopen(fd, mode='wb'), path
+    fp, path = await loop.run_in_executor(executor, create)
+    digest = hashlib.sha256()
+    def write(chunk):
+        digest.update(chunk)
+        fp.write(chunk)
+    pending = None
+    try:
+        while True:
+            chunk = await read_chunk(chunk_size)
+            if pending is not None:
+                await pending
+                pending = None
+            if not chunk:
+                break
+            pending = loop.run_in_executor(executor, write, chunk)
+        await loop.run_in_executor(executor, fp.close)
+    except:
+        if pending is not None:
+            with suppress(Exception):
+                await pending
+        fp.close()
+        with suppress(OSError):
+            os.unlink(path)
+        raise
+    logging.debug(f'Staged upload {path}')
+    return path, digest.hexdigest()
+
+# Remove staged files which were not used, in the executor
+async def discard_upload(path, loop=None, executor=None):
+    loop = loop or asyncio.get_event_loop()
+    with suppress(OSError):
+        await loop.run_in_executor(executor, functools.partial(os.unlink, path))
@@ -1,12 +1,18 @@
 import asyncio
 import json
 import logging
-import os
+import mimetypes
 import pathlib
-import tempfile
+import time
+import urllib.parse
 
+import aiohttp
 from aiohttp import web
 
+from . import metrics, uploads
+from .response_cache import ResponseCache
+from .upload_manager import UploadError
+
 class WebServer:
     HOST = '0.0.0.0'
 
@@ -14,25 +20,45 @@ class WebServer:
         {'url': '/item/all/{session}', 'handler': 'handle_item_all'},
         {'url': '/item/download/{uid}', 'handler': 'handle_item_download'},
         {'url': '/item/{uid}', 'handler': 'handle_item'},
+        {'url': '/blob/{digest}', 'handler': 'handle_blob'},
+        {'url': '/metrics', 'handler': 'handle_metrics'},
         {'url': '/session/all', 'handler': 'handle_session_all'},
-        {'url': '/session/{name}', 'handler': 'handle_session'})
+        {'url': '/session/{name}', 'handler': 'handle_session'},
+        {'url': '/upload/{id}', 'handler': 'handle_upload'})
     _ROUTES_POST = (
         {'url': '/item/add', 'handler': 'handle_item_add'},
-        {'url': '/session/add', 'handler': 'handle_session_add'})
+        {'url': '/item/add/batch', 'handler': 'handle_item_add_batch'},
+        {'url': '/item/move/batch', 'handler': 'handle_item_move_batch'},
+        {'url': '/item/remove/batch', 'handler': 'handle_item_remove_batch'},
+        {'url': '/session/add', 'handler': 'handle_session_add'},
+        {'url': '/upload', 'handler': 'handle_upload_create'},
+        {'url': '/upload/{id}/commit', 'handler': 'handle_upload_commit'})
+    _ROUTES_PUT = (
+        {'url': '/upload/{id}/{index}', 'handler': 'handle_upload_chunk'},)
     _ROUTES_DELETE = (
         {'url': '/item/all', 'handler': 'handle_item_all'},
         {'url': '/item/all/{session}', 'handler': 'handle_item_all_session'},
         {'url': '/item/{uid}', 'handler': 'handle_item'},
-        {'url': '/session/{name}', 'handler': 'handle_session'})
+        {'url': '/session/{name}', 'handler': 'handle_session'},
+        {'url': '/upload/{id}', 'handler': 'handle_upload'})
 
-    def __init__(self, server, port, loop=None):
+    def __init__(self, server, port, reuse_port=False, loop=None):
         self._server = server
         self._port = port
+        self._reuse_port = reuse_port
         self._loop = loop or asyncio.get_event_loop()
-        self._web_app = web.Application()
+        self._shards = server.shards
+        self._client_session = None
+        self._setup_metrics(server.metrics)
+        middlewares = [self._make_metrics_middleware()]
+        if self._shards is not None:
+            middlewares.append(self._make_forward_middleware())
+        self._web_app = web.Application(middlewares=middlewares)
         self._web_server = None
+        self._shard_server = None
         self._get_handler = WebServerGETHandler(server)
         self._post_handler = WebServerPOSTHandler(server)
+        self._put_handler = WebServerPUTHandler(server)
         self._delete_handler = WebServerDELETEHandler(server)
         self._setup_routes()
 
@@ -43,15 +69,133 @@ class WebServer:
     def start(self):
         logging.info('Starting HTTP server on %s:%d', self.HOST, self._port)
         handler = self._web_app.make_handler()
-        self._web_server = self._loop.create_server(handler, self.HOST, self._port)
+        self._web_server = self._loop.create_server(handler, self.HOST, self._port,
+                                                    reuse_port=self._reuse_port)
         self._loop.create_task(self._web_server)
+        if self._shards is not None:
+            # Requests forwarded from the other workers
+            host, port = self._shards.HOST, self._shards.web_port()
+            logging.info('Starting HTTP shard server on %s:%d', host, port)
+            self._shard_server = self._loop.create_server(handler, host, port)
+            self._loop.create_task(self._shard_server)
 
     def stop(self):
+        if self._client_session is not None:
+            self._loop.create_task(self._client_session.close())
+            self._client_session = None
+        if self._shard_server is not None:
+            self._shard_server.close()
+            self._shard_server = None
         if self._web_server is not None:
             self._web_server.close()
             self._web_server = None
             logging.info('HTTP server stopped')
 
+    def _setup_metrics(self, registry):
+        self._request_times = registry.histogram(
+            'session_http_request_seconds',
+            'Time of handling an HTTP request',
+            ('method', 'handler'))
+        self._received_bytes = registry.counter(
+            'session_http_received_bytes_total',
+            'Size of the HTTP request bodies').labels()
+        self._sent_bytes = registry.counter(
+            'session_http_sent_bytes_total',
+            'Size of the HTTP response bodies').labels()
+
+    def _make_metrics_middleware(self):
+        @web.middleware
+        async def measure(req, handler):
+            return await self._measure(req, handler)
+        return measure
+
+    # Methods of the routes, requests with other methods are labeled OTHER so
+    # that clients cannot add labels
+    _MEASURED_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE')
+
+    # Requests are timed by the handler, so that requests of different
+    # objects and sessions share the histograms
+    #
+    # Streamed responses have already been sent by the handler, the others
+    # are sent afterwards by aiohttp, so only the size of their body is known
+    # here. File responses are not counted.
+    async def _measure(self, req, handler):
+        start = time.perf_counter()
+        try:
+            resp = await handler(req)
+            if resp.prepared:
+                self._sent_bytes.inc(resp.body_length)
+            else:
+                self._sent_bytes.inc(resp.content_length or 0)
+            return resp
+        finally:
+            name = getattr(req.match_info.handler, '__name__', 'unknown')
+            method = req.method if req.method in self._MEASURED_METHODS else 'OTHER'
+            self._request_times[method, name].observe(time.perf_counter() - start)
+            self._received_bytes.inc(req.content_length or 0)
+
+    # Route parameters containing the session name
+    _SESSION_PARAMS = ('session', 'name')
+    # Handlers of requests with the session in the JSON body
+    _JSON_SESSION_HANDLERS = ('handle_upload_commit',)
+    # Response headers copied from forwarded requests
+    _FORWARDED_HEADERS = ('Content-Type', 'Content-Disposition', 'ETag', 'Cache-Control')
+
+    def _make_forward_middleware(self):
+        @web.middleware
+        async def forward(req, handler):
+            return await self._forward(req, handler)
+        return forward
+
+    # Forward requests of sessions owned by other workers to them
+    async def _forward(self, req, handler):
+        if self._shards.FORWARDED_HEADER in req.headers:
+            return await handler(req)
+        session = await self._request_session(req)
+        if session is None:
+            return await handler(req)
+        shard = self._shards.owner(session)
+        if shard == self._shards.index:
+            return await handler(req)
+        url = f'http://{self._shards.HOST}:{self._shards.web_port(shard)}{req.rel_url}'
+        headers = {key: val for (key, val) in req.headers.items() if
+                       key.lower() not in ('host', 'content-length', 'transfer-encoding')}
+        headers[self._shards.FORWARDED_HEADER] = str(self._shards.index)
+        if self._client_session is None:
+            self._client_session = aiohttp.ClientSession(loop=self._loop)
+        try:
+            async with self._client_session.request(req.method, url,
+                                                    headers=headers,
+                                                    data=await req.read()) as resp:
+                body = await resp.read()
+                headers = {key: resp.headers[key] for key in
+                               self._FORWARDED_HEADERS if key in resp.headers}
+                return web.Response(status=resp.status, body=body, headers=headers)
+        except aiohttp.ClientError:
+            logging.exception(f'Failed to forward request to {url}')
+            return web.HTTPBadGateway()
+
+    # Return the session of the request, None if it does not belong to a
+    # single session
+    #
+    # Requests of an object are served by the owner of its session. Adds and
+    # batch requests are served by any worker, the owners receive their
+    # events through the event bus.
+    async def _request_session(self, req):
+        for param in self._SESSION_PARAMS:
+            if param in req.match_info:
+                return req.match_info[param]
+        if 'uid' in req.match_info:
+            return await self._server.storage.get_object_session(req.match_info['uid'])
+        if getattr(req.match_info.handler, '__name__', None) in self._JSON_SESSION_HANDLERS:
+            try:
+                data = await req.json()
+            except ValueError:
+                return None
+            session = data.get('Session') if isinstance(data, dict) else None
+            return session if isinstance(session, str) else None
+        return None
+
     def _setup_routes(self):
         router = self._web_app.router
         for route in self._ROUTES_GET:
@@ -60,54 +204,221 @@ class WebServer:
         for route in self._ROUTES_POST:
             router.add_post(route['url'],
                             getattr(self._post_handler, route['handler']))
+        for route in self._ROUTES_PUT:
+            router.add_put(route['url'],
+                           getattr(self._put_handler, route['handler']))
         for route in self._ROUTES_DELETE:
             router.add_delete(route['url'],
                               getattr(self._delete_handler, route['handler']))
 
 class WebServerGETHandler:
+    # Listed objects are read and sent in chunks of this size
+    STREAM_CHUNK_SIZE = 500
+    NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
     def __init__(self, server):
         self._server = server
         self._storage = server.storage
+        # Full reads of unchanged data are served from here
+        self._cache = ResponseCache()
+
+    # The responses carry an ETag derived from the storage version of the
+    # data, which has to be taken before reading the data
+    @staticmethod
+    def _etag(version):
+        return f'W/"{version}"'
+
+    @staticmethod
+    def _not_modified(req, etag):
+        header = req.headers.get('If-None-Match')
+        if header is None:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        return '*' in tags or etag in tags or etag[2:] in tags
+
+    def _cached_response(self, req, etag, content_type='application/json'):
+        if self._not_modified(req, etag):
+            return web.HTTPNotModified(headers={'ETag': etag})
+        body = self._cache.get((req.path_qs, content_type, etag))
+        if body is not None:
+            return web.Response(body=body, content_type=content_type,
+                                headers=self._cache_headers(etag))
+        return None
+
+    @staticmethod
+    def _cache_headers(etag):
+        # Clients may keep the responses, but must always revalidate them
+        return {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+    def _json_response(self, req, etag, data):
+        body = json.dumps({'data': data}).encode()
+        self._cache.put((req.path_qs, 'application/json', etag), body)
+        return web.Response(body=body, content_type='application/json',
+                            headers=self._cache_headers(etag))
 
     async def handle_item(self, req):
-        data = self._storage.get_object(req.match_info['uid'])
+        uid = req.match_info['uid']
+        session = await self._storage.get_object_session(uid)
+        if session is None:
+            return web.HTTPNotFound(text='Object not found')
+        etag = self._etag(self._storage.session_version(session))
+        if self._not_modified(req, etag):
+            return web.HTTPNotModified(headers={'ETag': etag})
+        data = await self._storage.get_object(uid)
         if data is not None:
-            return web.json_response({'data': data})
+            return web.json_response({'data': data}, headers=self._cache_headers(etag))
         else:
             return web.HTTPNotFound(text='Object not found')
 
     async def handle_item_download(self, req):
-        file_path = self._storage.get_object_file(req.match_info['uid'])
-        if file_path is not None:
-            return web.FileResponse(pathlib.Path(file_path))
+        result = await self._storage.get_object_file(req.match_info['uid'])
+        if result is not None:
+            file_path, file_name = result
+            # Files are stored under their digest, so the type and name
+            # come from the file name of the object
+            headers = {'Content-Disposition':
+                           "inline; filename*=UTF-8''" + urllib.parse.quote(file_name)}
+            content_type, encoding = mimetypes.guess_type(file_name)
+            headers['Content-Type'] = content_type or 'application/octet-stream'
+            return web.FileResponse(pathlib.Path(file_path), headers=headers)
         else:
             return web.HTTPNotFound(text='Object not found')
 
+    # Clients may check if the server has a file before uploading it, in
+    # which case they may add the object with its Digest only
+    async def handle_blob(self, req):
+        data = await self._storage.get_blob(req.match_info['digest'])
+        if data is not None:
+            return web.json_response({'data': data})
+        else:
+            return web.HTTPNotFound(text='Blob not found')
+
+    async def handle_metrics(self, req):
+        return web.Response(body=self._server.metrics.render().encode(),
+                            headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    # The objects are streamed as they are read, either in the usual JSON
+    # object or as newline delimited JSON with one object per line
+    #
+    # Query parameters:
+    #   limit:  maximum number of objects
+    #   after:  Uid of the last object of the previous page
+    #   fields: comma separated list of the fields to include
+    #   format: ndjson for newline delimited JSON
     async def handle_item_all(self, req):
         session = req.match_info['session']
-        data = self._storage.get_all_objects(session)
-        return web.json_response({'data': data})
+        limit = req.query.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit <= 0:
+                return web.HTTPBadRequest(text='Invalid limit')
+        after = req.query.get('after')
+        fields = req.query.get('fields')
+        if fields is not None:
+            fields = [field for field in fields.split(',') if field]
+            for field in fields:
+                if field not in self._storage.OBJECT_FIELDS:
+                    return web.HTTPBadRequest(text=f'Invalid field {field}')
+        ndjson = (req.query.get('format') == 'ndjson' or
+                  self.NDJSON_CONTENT_TYPE in req.headers.get('Accept', ''))
+        content_type = self.NDJSON_CONTENT_TYPE if ndjson else 'application/json'
+        etag = self._etag(self._storage.session_version(session))
+        cached = self._cached_response(req, etag, content_type)
+        if cached is not None:
+            return cached
+
+        # The first chunk is read before the response starts, so that a
+        # failure ends in an error response rather than a truncated one
+        chunks = self._storage.iter_objects(session, self.STREAM_CHUNK_SIZE,
+                                            fields, after, limit)
+        try:
+            first = [await chunks.__anext__()]
+        except StopAsyncIteration:
+            first = []
+        resp = web.StreamResponse(headers=self._cache_headers(etag))
+        resp.content_type = content_type
+        resp.enable_chunked_encoding()
+        await resp.prepare(req)
+        # The streamed parts are kept to cache the response, unless it is
+        # too large
+        parts, size = [], 0
+        async def write(data):
+            nonlocal parts, size
+            await resp.write(data)
+            if parts is not None:
+                parts.append(data)
+                size += len(data)
+                if size > self._cache.MAX_ENTRY_BYTES:
+                    parts = None
+        if not ndjson:
+            await write(b'{"data": [')
+        separator = ''
+        async for items in self._chain(first, chunks):
+            if ndjson:
+                data = ''.join(json.dumps(item) + '\n' for item in items)
+            else:
+                data = separator + ', '.join(json.dumps(item) for item in items)
+                separator = ', '
+            await write(data.encode())
+        if not ndjson:
+            await write(b']}')
+        await resp.write_eof()
+        if parts is not None:
+            self._cache.put((req.path_qs, content_type, etag), b''.join(parts))
+        return resp
+
+    @staticmethod
+    async def _chain(items, chunks):
+        for item in items:
+            yield item
+        async for item in chunks:
+            yield item
 
     async def handle_session(self, req):
-        data = self._storage.get_session(req.match_info['name'])
+        etag = self._etag(self._storage.sessions_version())
+        if self._not_modified(req, etag):
+            return web.HTTPNotModified(headers={'ETag': etag})
+        data = await self._storage.get_session(req.match_info['name'])
         if data is not None:
-            return web.json_response({'data': data})
+            return web.json_response({'data': data}, headers=self._cache_headers(etag))
         else:
             return web.HTTPNotFound(text='Object not found')
 
     async def handle_session_all(self, req):
-        data = self._storage.get_all_sessions()
-        return web.json_response({'data': data})
+        etag = self._etag(self._storage.sessions_version())
+        cached = self._cached_response(req, etag)
+        if cached is not None:
+            return cached
+        data = await self._storage.get_all_sessions()
+        if not data:
+            # The default session always exists, so reading the sessions
+            # failed and the response must not be cached
+            return web.json_response({'data': data})
+        return self._json_response(req, etag, data)
+
+    async def handle_upload(self, req):
+        data = await self._server.uploads.status(req.match_info['id'])
+        if data is not None:
+            return web.json_response({'data': data})
+        else:
+            return web.HTTPNotFound(text='Upload not found')
 
 class WebServerPOSTHandler:
-    TEXT_FIELDS = ('Uid', 'Session', 'ObjectType', 'FileName', 'Url', 'Text')
+    TEXT_FIELDS = ('Uid', 'Session', 'ObjectType', 'FileName', 'Digest', 'Url', 'Text')
     JSON_FIELDS = ('Position', 'Scale', 'Rotation')
-    FILE_TYPES  = ('File')
+    FILE_TYPES  = ('File',)
+    # Size of the chunks of uploaded files written at once
+    UPLOAD_CHUNK_SIZE = uploads.CHUNK_SIZE
 
     def __init__(self, server):
         self._server = server
         self._storage = server.storage
         self._ws_server = server.ws_server
+        self._staging_dir = uploads.staging_dir(server.files_dir)
+        self._uploads = server.uploads
 
     async def handle_item_add(self, req):
         if req.has_body and req.content_type == 'multipart/form-data':
@@ -125,13 +436,13 @@ class WebServerPOSTHandler:
                         data[name] = json.loads(await field.text())
                     except json.JSONDecodeError:
                         if temp_path is not None:
-                            os.unlink(temp_path)
+                            await uploads.discard_upload(temp_path)
                         return web.HTTPBadRequest(text='Invalid field: ' + name)
                 elif name in self.TEXT_FIELDS:
                     data[name] = await field.text()
                     if name == 'FileName':
                         file_name = data[name]
-                elif data['ObjectType'] in self.FILE_TYPES and name == 'FileContent':
+                elif data.get('ObjectType') in self.FILE_TYPES and name == 'FileContent':
                     # Read the file content, if file name is not yet known,
                     # we take it from the request
                     if file_name is None:
@@ -139,40 +450,173 @@ class WebServerPOSTHandler:
                     if file_name is None:
                         return web.HTTPBadRequest(text='File name unknown')
                     # https://docs.aiohttp.org/en/stable/web_quickstart.html#file-uploads
+                    # The file is staged next to the files directory and
+                    # written without blocking the event loop
                     try:
-                        temp_fd, temp_path = tempfile.mkstemp()
-                        temp_fp = os.fdopen(temp_fd, mode='wb')
-                        while True:
-                            chunk = await field.read_chunk()  # 8192 bytes by default.
-                            if not chunk:
-                                break
-                            temp_fp.write(chunk)
-                        temp_fp.close()
+                        temp_path, digest = await uploads.stage_upload(field.read_chunk,
+                                                                       self._staging_dir,
+                                                                       self.UPLOAD_CHUNK_SIZE)
                     except:
-                        if temp_path is None:
-                            logging.exception('Failed to create a temporary file')
-                        else:
-                            os.unlink(temp_path)
-                            logging.exception(f'Failed to write file content to {temp_path}')
+                        logging.exception(f'Failed to write file content to {self._staging_dir}')
                         return web.HTTPServerError()
                 else:
                     if temp_path is not None:
-                        os.unlink(temp_path)
+                        await uploads.discard_upload(temp_path)
                     return web.HTTPBadRequest(text='Invalid field: ' + name)
 
-            data = self._storage.add_object(data, temp_path)
+            if temp_path is not None:
+                # The digest sent by the client is optional, but it must
+                # match the content
+                if data.setdefault('Digest', digest) != digest:
+                    await uploads.discard_upload(temp_path)
+                    return web.HTTPBadRequest(text='Digest does not match the file content')
+            elif data.get('ObjectType') in self.FILE_TYPES and 'Digest' in data:
+                # The content was not uploaded, it must be known already
+                if await self._storage.get_blob(data['Digest']) is None:
+                    return web.HTTPNotFound(text='Blob not found')
+            data = await self._storage.add_object(data, temp_path)
             if data is not None:
-                print(data)
                 await self._ws_server.broadcast_item_added(data)
                 return web.HTTPNoContent()
             else:
                 if temp_path is not None:
-                    os.unlink(temp_path)
+                    await uploads.discard_upload(temp_path)
                 return web.HTTPBadRequest(text='Invalid object data')
         else:
             return web.HTTPBadRequest(text='Form data required')
 
-    SESSION_TEXT_FIELDS = ('Name')
+    # Return the JSON object in the body, or None if the body is invalid
+    async def _read_json(self, req):
+        if not req.has_body or req.content_type != 'application/json':
+            return None
+        try:
+            body = await req.json()
+        except json.JSONDecodeError:
+            return None
+        return body if isinstance(body, dict) else None
+
+    # Batch requests have a JSON body with the list of items in the given
+    # field, return None if the body is invalid
+    async def _read_batch(self, req, field):
+        body = await self._read_json(req)
+        if body is None or not isinstance(body.get(field), list):
+            return None
+        return body[field]
+
+    @staticmethod
+    def _batch_result(uid, error=None):
+        if error is None:
+            return {'Uid': uid, 'Result': True}
+        return {'Uid': uid, 'Result': False, 'Error': error}
+
+    async def handle_item_add_batch(self, req):
+        items = await self._read_batch(req, 'Items')
+        if items is None:
+            return web.HTTPBadRequest(text='JSON object with Items required')
+        results = await self._storage.add_objects(items)
+        added = [data for (data, error) in results if data is not None]
+        if added:
+            await self._ws_server.broadcast_items_added(added)
+        return web.json_response({'data': [
+            self._batch_result(item.get('Uid') if isinstance(item, dict) else None, error)
+            for item, (data, error) in zip(items, results)]})
+
+    async def handle_item_move_batch(self, req):
+        items = await self._read_batch(req, 'Items')
+        if items is None:
+            return web.HTTPBadRequest(text='JSON object with Items required')
+        results = []
+        sessions = {}
+        object_sessions = await self._storage.get_object_sessions(
+            [item['Uid'] for item in items if isinstance(item, dict) and
+                 isinstance(item.get('Uid'), str)])
+        for item in items:
+            uid = item.get('Uid') if isinstance(item, dict) else None
+            if not isinstance(uid, str):
+                results.append(self._batch_result(uid, 'invalid move'))
+                continue
+            session = object_sessions.get(uid)
+            if session is None:
+                results.append(self._batch_result(uid, 'object not found'))
+                continue
+            if self._storage.is_object_selected(uid):
+                results.append(self._batch_result(uid, 'object is selected'))
+                continue
+            move = {key: item[key] for key in ('Position', 'Scale', 'Rotation') if key in item}
+            if not await self._storage.move_object(uid, None, **{
+                    key.lower(): val for (key, val) in move.items()}):
+                results.append(self._batch_result(uid, 'invalid move'))
+                continue
+            sessions.setdefault(session, []).append({'Uid': uid, **move})
+            results.append(self._batch_result(uid))
+        for session, moved in sessions.items():
+            await self._ws_server.broadcast_items_moved(moved, session=session)
+        return web.json_response({'data': results})
+
+    async def handle_item_remove_batch(self, req):
+        uids = await self._read_batch(req, 'Uids')
+        if uids is None:
+            return web.HTTPBadRequest(text='JSON object with Uids required')
+        uids = [uid for uid in uids if isinstance(uid, str)]
+        removed = await self._storage.remove_objects(uids)
+        sessions = {}
+        for uid in uids:
+            if uid in removed:
+                sessions.setdefault(removed[uid], []).append(uid)
+        for session, group in sessions.items():
+            await self._ws_server.broadcast_items_removed(group, session=session)
+        return web.json_response({'data': [
+            self._batch_result(uid, None if uid in removed else 'object not found')
+            for uid in uids]})
+
+    # Start a resumable upload, the body contains the Size of the file and
+    # optionally the ChunkSize
+    async def handle_upload_create(self, req):
+        body = await self._read_json(req)
+        if body is None:
+            return web.HTTPBadRequest(text='JSON object with Size required')
+        try:
+            data = await self._uploads.create(body.get('Size'), body.get('ChunkSize'))
+        except UploadError as e:
+            return web.HTTPBadRequest(text=str(e))
+        except:
+            logging.exception('Failed to create upload')
+            return web.HTTPServerError()
+        return web.json_response({'data': data}, status=201)
+
+    # Add a File object with the content of a complete upload, the body
+    # contains the fields of the object
+    async def handle_upload_commit(self, req):
+        upload_id = req.match_info['id']
+        data = await self._read_json(req)
+        if data is None or data.get('ObjectType') != 'File':
+            return web.HTTPBadRequest(text='JSON object of a File required')
+        try:
+            result = await self._uploads.commit(upload_id)
+        except UploadError as e:
+            return web.HTTPConflict(text=str(e))
+        except:
+            logging.exception(f'Failed to commit upload {upload_id}')
+            return web.HTTPServerError()
+        if result is None:
+            return web.HTTPNotFound(text='Upload not found')
+        temp_path, digest = result
+        if data.setdefault('Digest', digest) != digest:
+            await uploads.discard_upload(temp_path)
+            await self._uploads.finish(upload_id, False)
+            return web.HTTPBadRequest(text='Digest does not match the file content')
+        data = await self._storage.add_object(data, temp_path)
+        # The chunks are kept when the object is rejected, so the commit can
+        # be repeated with corrected fields
+        await self._uploads.finish(upload_id, data is not None)
+        if data is not None:
+            await self._ws_server.broadcast_item_added(data)
+            return web.HTTPNoContent()
+        else:
+            await uploads.discard_upload(temp_path)
+            return web.HTTPBadRequest(text='Invalid object data')
+
+    SESSION_TEXT_FIELDS = ('Name',)
     SESSION_JSON_FIELDS = ()
 
     async def handle_session_add(self, req):
@@ -195,7 +639,7 @@ class WebServerPOSTHandler:
                 else:
                     return web.HTTPBadRequest(text='Invalid field: ' + name)
 
-            data = self._storage.add_session(data)
+            data = await self._storage.add_session(data.get('Name'))
             if data is not None:
                 await self._ws_server.broadcast_session_added(data)
                 return web.HTTPNoContent()
@@ -204,6 +648,31 @@ class WebServerPOSTHandler:
         else:
             return web.HTTPBadRequest(text='Form data required')
 
+class WebServerPUTHandler:
+    def __init__(self, server):
+        self._server = server
+        self._uploads = server.uploads
+
+    # Chunks may be sent in any order and in parallel, a repeated chunk
+    # replaces the previous one
+    async def handle_upload_chunk(self, req):
+        upload_id = req.match_info['id']
+        try:
+            index = int(req.match_info['index'])
+        except ValueError:
+            return web.HTTPBadRequest(text='Invalid chunk index')
+        try:
+            data = await self._uploads.write_chunk(upload_id, index, req.content.read)
+        except UploadError as e:
+            return web.HTTPBadRequest(text=str(e))
+        except:
+            logging.exception(f'Failed to write chunk {index} of upload {upload_id}')
+            return web.HTTPServerError()
+        if data:
+            return web.json_response({'data': data})
+        else:
+            return web.HTTPNotFound(text='Upload not found')
+
 class WebServerDELETEHandler:
     def __init__(self, server):
         self._server = server
@@ -212,31 +681,38 @@ class WebServerDELETEHandler:
 
     async def handle_item(self, req):
         uid = req.match_info['uid']
-        if self._storage.remove_object(uid):
-            await self._ws_server.broadcast_item_removed(uid)
+        session = await self._storage.get_object_session(uid)
+        if await self._storage.remove_object(uid):
+            await self._ws_server.broadcast_item_removed(uid, session=session)
             return web.HTTPNoContent()
         else:
             return web.HTTPNotFound(text='Object not found')
 
     async def handle_item_all(self, req):
-        self._storage.clear_all()
+        await self._storage.clear_all()
         return web.HTTPNoContent()
 
     async def handle_item_all_session(self, req):
         session = req.match_info['session']
-        uids = self._storage.get_all_objects_uid_list(session)
-        if self._storage.clear(session):
-            for uid in uids:
-                await self._ws_server.broadcast_item_removed(uid)
+        uids = await self._storage.get_all_objects_uid_list(session)
+        if await self._storage.clear(session) and uids:
+            await self._ws_server.broadcast_items_removed(uids, session=session)
         return web.HTTPNoContent()
 
     async def handle_session(self, req):
         name = req.match_info['name']
         if self._storage.can_remove_session(name):
-            if self._storage.remove_session(name):
+            if await self._storage.remove_session(name):
+                self._ws_server.unsubscribe_session(name)
                 await self._ws_server.broadcast_session_removed(name)
                 return web.HTTPNoContent()
             else:
                 return web.HTTPNotFound(text='Object not found')
         else:
             return web.HTTPForbidden(text='Session cannot be deleted')
+
+    async def handle_upload(self, req):
+        if await self._server.uploads.abort(req.match_info['id']):
+            return web.HTTPNoContent()
+        else:
+            return web.HTTPNotFound(text='Upload not found')
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+
+from .eventbus import EventBusHub, RedisEventBus, SocketEventBus
+from .sharding import ShardMap
+
+LOG_FORMAT = '%(asctime)s: %(processName)s: %(message)s'
+
+# Run the server in multiple worker processes sharing the ports using
+# SO_REUSEPORT, the workers are connected by an event bus
+#
+# If sharded, every session is owned by one of the workers, which handles all
+# requests and WebSockets connections of the session. The other workers
+# forward them to the owner.
+class WorkerPool:
+    # How often the worker processes are checked, in seconds
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, files_dir, workers, event_bus='socket', redis_url=None,
+                 sharded=False, engine='mongodb'):
+        self._files_dir = files_dir
+        self._workers = workers
+        self._sharded = sharded
+        self._engine = engine
+        self._event_bus = event_bus
+        self._redis_url = redis_url
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = [None] * workers
+        self._bus_path = os.path.join(tempfile.gettempdir(),
+                                      f'session-server-{os.getpid()}.sock')
+        self._hub = None
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        for signame in ('SIGINT', 'SIGTERM'):
+            loop.add_signal_handler(getattr(signal, signame), loop.stop)
+        try:
+            if self._event_bus == 'socket':
+                self._hub = EventBusHub(self._bus_path, loop)
+                loop.run_until_complete(self._hub.start())
+            for index in range(self._workers):
+                self._start_worker(index)
+            task = loop.create_task(self._monitor())
+            loop.run_forever()
+            task.cancel()
+            self._stop_workers()
+            if self._hub is not None:
+                loop.run_until_complete(self._hub.close())
+        finally:
+            loop.close()
+
+    def _start_worker(self, index):
+        process = self._context.Process(target=_run_worker,
+                                        name=f'worker-{index}',
+                                        args=(self._files_dir,
+                                              index,
+                                              self._event_bus,
+                                              self._bus_path,
+                                              self._redis_url,
+                                              self._workers if self._sharded else None,
+                                              self._engine))
+        process.start()
+        logging.info(f'Started worker {index} with PID {process.pid}')
+        self._processes[index] = process
+
+    def _stop_workers(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join()
+
+    # Restart workers which exited unexpectedly
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logging.warning(f'Worker {index} exited with code {process.exitcode}, restarting')
+                    self._start_worker(index)
+
+def _run_worker(files_dir, index, event_bus, bus_path, redis_url, shard_count, engine):
+    from .server import Server
+
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+    # The worker ID must be unique even when the worker is restarted
+    worker_id = f'{index}-{os.getpid()}'
+    if event_bus == 'redis':
+        bus = RedisEventBus(redis_url, worker_id)
+    else:
+        bus = SocketEventBus(bus_path, worker_id)
+    shards = ShardMap(shard_count, index) if shard_count else None
+    server = Server(files_dir, worker_id, bus, reuse_port=True, shards=shards,
+                    engine=engine)
+    server.start()
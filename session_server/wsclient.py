@@ -0,0 +1,264 @@
+import asyncio
+import collections
+import logging
+import time
+from contextlib import suppress
+
+from . import protocol
+
+# Key of the queued ITEM_MOVED_BATCH entry
+_BATCH = object()
+
+class WSClient:
+    # Number of queued messages above which the client is considered slow
+    HIGH_WATER = 256
+    # Time in seconds after which a client which stays above the high-water
+    # mark is disconnected
+    HIGH_WATER_TIMEOUT = 5.0
+    # Clients are disconnected immediately when the queue reaches this size
+    MAX_QUEUE = 4096
+
+    def __init__(self, websocket, client_id, loop=None):
+        self._websocket = websocket
+        self._id = client_id
+        self._loop = loop or asyncio.get_event_loop()
+        self._writer = None
+        # Queue of [encoded message, key, message] entries, where the key is
+        # the uid of a moved object or _BATCH for batched moves, the messages
+        # are encoded without the sequence number which is added when sending
+        self._queue = collections.deque()
+        # uid -> queued ITEM_MOVED entry, moves are only merged into entries
+        # queued after the last reliable message
+        self._moves = {}
+        # uid -> (message, encoded item) of moves waiting for the next batch
+        self._batch = {}
+        # Queued ITEM_MOVED_BATCH entry which may still be extended
+        self._batch_entry = None
+        # Snapshot messages are sent before the queued messages, which are
+        # held until the snapshot is complete
+        self._snapshot_queue = collections.deque()
+        # Set whenever a snapshot message has been taken from the queue
+        self._snapshot_sent = asyncio.Event()
+        self._holding = False
+        self._wakeup = asyncio.Event()
+        self._over_since = None
+        self._closed = False
+        self.msg_seq = 1
+        self.sessions = set()
+        self.dropped_moves = 0
+        self.sent_bytes = 0
+        self.move_batching = False
+        # Move delay last sent to the client
+        self.move_delay = None
+        # Moves are sent to the client in binary messages
+        self.binary = getattr(websocket, 'subprotocol', None) == protocol.BINARY_SUBPROTOCOL
+
+    def start(self):
+        self._writer = self._loop.create_task(self._write_loop())
+
+    async def close(self):
+        self._discard()
+        if self._writer is not None:
+            self._writer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._writer
+            self._writer = None
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def websocket(self):
+        return self._websocket
+
+    @property
+    def remote_address(self):
+        return self._websocket.remote_address
+
+    @property
+    def queue_size(self):
+        return len(self._queue)
+
+    async def recv(self):
+        return await self._websocket.recv()
+
+    # Queue an encoded message, which is always delivered in order
+    def send(self, body):
+        if self._batch:
+            # Moves which happened before the message must be sent first
+            self.flush_moves()
+        # Later moves must not be merged into messages queued before this one
+        self._moves.clear()
+        self._batch_entry = None
+        self._enqueue([body, None, None])
+
+    # Queue an ITEM_MOVED message, a move which is still waiting in the queue
+    # for the same object is replaced by the new one
+    #
+    # The item is the encoded move without the Event field, it is used when
+    # the client receives moves in batches. For binary clients the body and
+    # item are in the binary form, unless the move cannot be represented in it.
+    def send_move(self, uid, message, body, item=None):
+        if self.move_batching:
+            self._merge_move(self._batch, uid, message, item)
+            return
+        entry = self._moves.get(uid)
+        if entry is None:
+            entry = [body, uid, message]
+            self._moves[uid] = entry
+            self._enqueue(entry)
+            return
+        self.dropped_moves += 1
+        if all(key in message for key in entry[2]):
+            entry[0], entry[2] = body, message
+        else:
+            # The new move does not contain all transform fields of the
+            # queued one
+            entry[2] = {**entry[2], **message}
+            entry[0] = self._encode_move(entry[2])
+
+    def set_move_batching(self, enabled):
+        if not enabled:
+            self.flush_moves()
+        self.move_batching = enabled
+
+    # Queue the moves collected since the last call as a single
+    # ITEM_MOVED_BATCH message
+    def flush_moves(self):
+        if not self._batch:
+            return
+        if self._batch_entry is not None:
+            # The previous batch has not been sent yet, extend it
+            items = self._batch_entry[2]
+            for uid, (message, item) in self._batch.items():
+                self._merge_move(items, uid, message, item)
+            self._batch_entry[0] = self._encode_batch(items)
+        else:
+            entry = [self._encode_batch(self._batch), _BATCH, self._batch]
+            self._batch_entry = entry
+            self._enqueue(entry)
+        self._batch = {}
+
+    def _merge_move(self, items, uid, message, item):
+        current = items.get(uid)
+        if current is not None:
+            self.dropped_moves += 1
+            if not all(key in message for key in current[0]):
+                message, item = {**current[0], **message}, None
+        items[uid] = (message, item)
+
+    def _encode_move(self, message):
+        if self.binary:
+            body = protocol.encode_move(message)
+            if body is not None:
+                return body
+        return protocol.encode(message)
+
+    def _encode_batch(self, items):
+        if self.binary:
+            parts = []
+            for message, item in items.values():
+                if not isinstance(item, bytes):
+                    item = protocol.pack_move(message)
+                    if item is None:
+                        # Fall back to JSON for the whole batch
+                        break
+                parts.append(item)
+            else:
+                return protocol.encode_move_batch(parts)
+        parts = []
+        for message, item in items.values():
+            if not isinstance(item, str):
+                item = protocol.encode({key: val for (key, val) in
+                                            message.items() if key != 'Event'})
+            parts.append(item)
+        return '{"Event": "ITEM_MOVED_BATCH", "Items": [' + ', '.join(parts) + ']}'
+
+    def _enqueue(self, entry):
+        if self._closed:
+            return
+        self._queue.append(entry)
+        self._wakeup.set()
+        size = len(self._queue)
+        if size <= self.HIGH_WATER:
+            self._over_since = None
+            return
+        now = time.monotonic()
+        if self._over_since is None or self._holding:
+            # Messages held during a snapshot are not the client's fault
+            self._over_since = now
+        if size >= self.MAX_QUEUE or now - self._over_since >= self.HIGH_WATER_TIMEOUT:
+            host, port = self.remote_address[:2]
+            logging.info(f'Disconnecting slow WS client {host}:{port} with {size} queued messages')
+            self._discard()
+            self._loop.create_task(self._websocket.close(1008, 'Client too slow'))
+
+    def _discard(self):
+        self._closed = True
+        self._queue.clear()
+        self._moves.clear()
+        self._batch.clear()
+        self._batch_entry = None
+        self._snapshot_queue.clear()
+        self._snapshot_sent.set()
+
+    # Hold the queued messages until end_snapshot() is called, only
+    # messages queued by send_snapshot() are sent in the meantime
+    def begin_snapshot(self):
+        self._holding = True
+
+    def send_snapshot(self, body):
+        if self._closed:
+            return
+        self._snapshot_queue.append(body)
+        self._wakeup.set()
+
+    # Wait until at most the given number of snapshot messages is queued,
+    # return False if the client has been disconnected
+    async def wait_snapshot(self, limit=0):
+        while not self._closed and len(self._snapshot_queue) > limit:
+            self._snapshot_sent.clear()
+            await self._snapshot_sent.wait()
+        return not self._closed
+
+    def end_snapshot(self):
+        self._holding = False
+        self._wakeup.set()
+
+    async def _write_loop(self):
+        while True:
+            if self._snapshot_queue:
+                body = self._snapshot_queue.popleft()
+                self._snapshot_sent.set()
+                if not await self._send(body):
+                    return
+                continue
+            if not self._queue or self._holding:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            entry = self._queue.popleft()
+            if entry[1] is _BATCH:
+                if self._batch_entry is entry:
+                    self._batch_entry = None
+            elif entry[1] is not None:
+                if self._moves.get(entry[1]) is entry:
+                    del self._moves[entry[1]]
+            if not await self._send(entry[0]):
+                return
+
+    async def _send(self, body):
+        message = protocol.add_seq(body, self.msg_seq)
+        self.msg_seq += 1
+        try:
+            await self._websocket.send(message)
+            self.sent_bytes += len(message)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except:
+            # The connection is closed, the receiving side handles it
+            logging.debug('WebSocket send() failed')
+            self._discard()
+            return False
@@ -1,27 +1,110 @@
 import asyncio
-import json
+import itertools
 import logging
+import time
+from contextlib import suppress
+
 import websockets
 
+from . import protocol
+from .event_log import SessionEventLog
+from .load_monitor import MoveDelayController
+from .metrics import FANOUT_BUCKETS
+from .sharding import session_from_path, session_path
+from .wsclient import WSClient
+
 class WSServer:
     HOST = '0.0.0.0'
     MOVE_DELAY = 100
+    # Adapt the move delay of each session to the server load
+    ADAPTIVE_MOVE_DELAY = True
+    # How often the move delays are recomputed, in seconds
+    ADAPT_INTERVAL = 2.0
+    # Number of objects per SNAPSHOT_ITEMS message
+    SNAPSHOT_CHUNK_SIZE = 200
+    # Number of snapshot messages which may wait to be sent to the client
+    # before reading more objects
+    SNAPSHOT_WINDOW = 4
+    # How often event logs of sessions without clients are checked for
+    # expiration, in seconds
+    EVENT_LOG_PRUNE_INTERVAL = 30.0
 
-    def __init__(self, server, port, loop=None):
+    # Events processed from clients, others are counted as unknown
+    _EVENTS = frozenset(('ITEM_ADDED', 'ITEM_MOVED', 'ITEM_REMOVED', 'ITEM_SELECTION_CHANGED',
+                         'SESSION_ADDED', 'SESSION_REMOVED', 'SESSION_SUBSCRIBE',
+                         'SESSION_UNSUBSCRIBE', 'MOVE_BATCH_SET'))
+
+    def __init__(self, server, port, reuse_port=False, loop=None):
         self._server = server
         self._storage = server.storage
         self._port = port
+        self._reuse_port = reuse_port
         self._loop = loop or asyncio.get_event_loop()
         self._ws_server = None
-        self._clients = []
+        self._shard_server = None
+        self._shards = server.shards
+        self._client_ids = itertools.count(1)
+        self._clients = set()
+        # Clients which have not subscribed to any session receive events
+        # of all sessions
+        self._unscoped_clients = set()
+        # Session name -> set of subscribed clients
+        self._session_clients = {}
+        # Moves dropped by clients which have already disconnected
+        self._dropped_moves = 0
+        # Clients which receive moves in ITEM_MOVED_BATCH messages
+        self._batch_clients = set()
+        self._batch_task = None
+        # Clients which receive moves in binary messages
+        self._binary_clients = set()
+        self._move_delays = MoveDelayController(self.MOVE_DELAY)
+        self._adapt_task = None
+        # Session name -> log of recent events, used to resume sessions
+        self._event_logs = {}
+        self._prune_task = None
+        # Events are shared with the other worker processes through the
+        # event bus, worker ID -> idents of its clients which selected
+        # an object
+        self._event_bus = server.event_bus
+        self._event_bus.subscribe(self._process_bus_message)
+        self._remote_idents = {}
+        # Bytes sent to clients which have already disconnected
+        self._sent_bytes = 0
+        self._setup_metrics(server.metrics)
 
     def start(self):
         logging.info('Starting WebSockets server on %s:%d', self.HOST, self._port)
-        serve = websockets.serve(self._handler, self.HOST, self._port, loop=self._loop)
+        serve = websockets.serve(self._handler, self.HOST, self._port, loop=self._loop,
+                                 subprotocols=[protocol.BINARY_SUBPROTOCOL],
+                                 reuse_port=self._reuse_port)
         # Wait for server to start
         self._ws_server = self._loop.run_until_complete(serve)
+        if self._shards is not None:
+            # Connections forwarded from the other workers
+            host, port = self._shards.HOST, self._shards.ws_port()
+            logging.info('Starting WebSockets shard server on %s:%d', host, port)
+            serve = websockets.serve(self._handler, host, port, loop=self._loop,
+                                     subprotocols=[protocol.BINARY_SUBPROTOCOL])
+            self._shard_server = self._loop.run_until_complete(serve)
+        self._prune_task = self._loop.create_task(self._prune_loop())
+        if self.MOVE_DELAY > 0:
+            self._batch_task = self._loop.create_task(self._batch_loop())
+            if self.ADAPTIVE_MOVE_DELAY:
+                self._adapt_task = self._loop.create_task(self._adapt_loop())
 
     def stop(self):
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            self._prune_task = None
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            self._batch_task = None
+        if self._adapt_task is not None:
+            self._adapt_task.cancel()
+            self._adapt_task = None
+        if self._shard_server is not None:
+            self._shard_server.close()
+            self._shard_server = None
         if self._ws_server is not None:
             self._ws_server.close()
             self._ws_server = None
@@ -32,13 +115,28 @@ class WSServer:
         return self._port
 
     async def broadcast_item_added(self, data, exclude=None):
-        await self.broadcast_event('ITEM_ADDED', data, exclude)
+        await self.broadcast_event('ITEM_ADDED', data, exclude, data.get('Session'))
 
     async def broadcast_item_moved(self, data, exclude=None):
-        await self.broadcast_event('ITEM_MOVED', data, exclude)
+        session = await self._storage.get_object_session(data['Uid'])
+        await self.broadcast_event('ITEM_MOVED', data, exclude, session)
+
+    async def broadcast_item_removed(self, uid, exclude=None, session=None):
+        await self.broadcast_event('ITEM_REMOVED', {'Uid': uid}, exclude, session)
+
+    # Batched events are sent as one message per session
+    async def broadcast_items_added(self, items, exclude=None):
+        sessions = {}
+        for item in items:
+            sessions.setdefault(item.get('Session'), []).append(item)
+        for session, group in sessions.items():
+            await self.broadcast_event('ITEM_ADDED_BATCH', {'Items': group}, exclude, session)
+
+    async def broadcast_items_moved(self, items, exclude=None, session=None):
+        await self.broadcast_event('ITEM_MOVED_BATCH', {'Items': items}, exclude, session)
 
-    async def broadcast_item_removed(self, uid, exclude=None):
-        await self.broadcast_event('ITEM_REMOVED', {'Uid': uid}, exclude)
+    async def broadcast_items_removed(self, uids, exclude=None, session=None):
+        await self.broadcast_event('ITEM_REMOVED_BATCH', {'Uids': uids}, exclude, session)
 
     async def broadcast_session_added(self, data, exclude=None):
         await self.broadcast_event('SESSION_ADDED', data, exclude)
@@ -46,61 +144,372 @@ class WSServer:
     async def broadcast_session_removed(self, name, exclude=None):
         await self.broadcast_event('SESSION_REMOVED', {'Name': name}, exclude)
 
-    async def broadcast_event(self, event, data, exclude=None):
-        if not self._clients or len(self._clients) == 1 and self._clients[0] == exclude:
+    def _setup_metrics(self, metrics):
+        # The processed messages are counted by the histogram
+        self._process_times = metrics.histogram(
+            'session_ws_process_seconds',
+            'Time of processing a message of a WebSocket client', ('event',))
+        self._invalid_messages = metrics.counter(
+            'session_ws_invalid_messages_total',
+            'Messages of WebSocket clients which could not be decoded').labels()
+        self._broadcast_times = metrics.histogram(
+            'session_broadcast_seconds',
+            'Time of queueing an event to the local clients and publishing it', ('event',))
+        self._fanout = metrics.histogram(
+            'session_broadcast_recipients',
+            'Number of local clients an event is queued for',
+            buckets=FANOUT_BUCKETS).labels()
+        # Text messages are counted in characters
+        self._received_bytes = metrics.counter(
+            'session_ws_received_bytes_total',
+            'Size of the messages received from WebSocket clients').labels()
+        metrics.counter_callback(
+            'session_ws_sent_bytes_total',
+            'Size of the messages sent to WebSocket clients',
+            lambda: self._sent_bytes + sum(client.sent_bytes for client in self._clients))
+        metrics.gauge(
+            'session_ws_session_clients',
+            'Number of WebSocket clients subscribed to the session',
+            lambda: {(session,): len(clients) for (session, clients) in
+                         self._session_clients.items()},
+            ('session',))
+
+    # Broadcast an event to all clients subscribed to the given session, or to
+    # all clients if the session is None
+    async def broadcast_event(self, event, data, exclude=None, session=None):
+        self._broadcast({'Event': event, **data}, exclude, session)
+
+    async def broadcast_message(self, message, exclude=None, session=None):
+        message.pop('Seq', None)
+        self._broadcast(message, exclude, session)
+
+    def _broadcast(self, message, exclude=None, session=None):
+        start = time.perf_counter()
+        self._deliver(message, exclude, session)
+        # A single worker has nobody to publish to
+        if self._event_bus.has_peers:
+            self._event_bus.publish({'Type': 'BROADCAST',
+                                     'Session': session,
+                                     'Message': message})
+        self._broadcast_times[message['Event']].observe(time.perf_counter() - start)
+
+    # Messages are only queued here, each client has its own writer task so
+    # that a slow client does not hold up the others
+    def _deliver(self, message, exclude=None, session=None):
+        if session is not None:
+            # Session events are logged, which also adds their position
+            body = self._event_log(session).append(message)
+        else:
+            body = protocol.encode(message)
+        if message['Event'] == 'ITEM_MOVED':
+            uid = message['Uid']
+            item, packed = None, None
+            if self._batch_clients:
+                item = protocol.encode({key: val for (key, val) in
+                                            message.items() if key != 'Event'})
+            if self._binary_clients:
+                packed = protocol.pack_move(message)
+                if packed is not None:
+                    binary_body = bytes((protocol.BINARY_MOVE,)) + packed
+            recipients = 0
+            for client in self._recipients(session):
+                if client != exclude:
+                    recipients += 1
+                    if client.binary and packed is not None:
+                        client.send_move(uid, message, binary_body, packed)
+                    else:
+                        client.send_move(uid, message, body, item)
+        else:
+            recipients = 0
+            for client in self._recipients(session):
+                if client != exclude:
+                    recipients += 1
+                    client.send(body)
+        self._fanout.observe(recipients)
+
+    # Remote clients are identified by the worker ID and their ID within the
+    # worker
+    def _remote_ident(self, client):
+        return f'{self._event_bus.worker_id}/{client.id}'
+
+    async def _process_bus_message(self, message):
+        message_type = message.get('Type')
+        if message_type == 'BROADCAST':
+            data = message['Message']
+            if data.get('Event') == 'SESSION_REMOVED':
+                self.unsubscribe_session(data['Name'])
+            self._storage.apply_remote_event(data, message.get('Session'))
+            self._deliver(data, None, message.get('Session'))
+        elif message_type == 'SELECTION_CHANGED':
+            # Mirror the selection, so that moves are postponed while the
+            # object is selected by a client of another worker
+            ident = message['Ident']
+            if message['IsSelected']:
+                idents = self._remote_idents.setdefault(message['Origin'], set())
+                idents.add(ident)
+                self._storage.select_object(message['Uid'], ident)
+            else:
+                await self._storage.deselect_object(message['Uid'], ident)
+        elif message_type == 'CLIENT_LEFT':
+            ident = message['Ident']
+            self._remote_idents.get(message['Origin'], set()).discard(ident)
+            await self._storage.deselect_all_ident_objects(ident)
+        elif message_type == 'WORKER_LEFT':
+            for ident in self._remote_idents.pop(message['Worker'], ()):
+                await self._storage.deselect_all_ident_objects(ident)
+
+    def _event_log(self, session):
+        log = self._event_logs.get(session)
+        if log is None:
+            log = SessionEventLog()
+            self._event_logs[session] = log
+        return log
+
+    # Expired selections are released at the same time
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.EVENT_LOG_PRUNE_INTERVAL)
+            for session, log in list(self._event_logs.items()):
+                if session not in self._session_clients and log.expired():
+                    del self._event_logs[session]
+            await self._broadcast_completed_moves(await self._storage.expire_selections())
+
+    # Send the moves collected for batching clients once per move delay
+    async def _batch_loop(self):
+        while True:
+            await asyncio.sleep(self.MOVE_DELAY / 1000)
+            for client in self._batch_clients:
+                client.flush_moves()
+
+    # Raise the move delays when the server or the clients cannot keep up and
+    # lower them when the server is idle
+    async def _adapt_loop(self):
+        lag_monitor = self._server.lag_monitor
+        while True:
+            await asyncio.sleep(self.ADAPT_INTERVAL)
+            sessions = {None: self._queue_stats(self._unscoped_clients)}
+            for session, clients in self._session_clients.items():
+                sessions[session] = self._queue_stats(clients)
+            if self._move_delays.update(lag_monitor.lag, sessions):
+                for client in self._clients:
+                    self._send_move_delay(client)
+
+    @staticmethod
+    def _queue_stats(clients):
+        if not clients:
+            return 0, 0
+        return len(clients), sum(client.queue_size for client in clients) / len(clients)
+
+    def _send_move_delay(self, client):
+        if self.MOVE_DELAY <= 0:
             return
-        futures = []
-        for client in self._clients:
-            if client != exclude:
-                message = json.dumps({'Event': event, 'Seq': client.msg_seq, **data})
-                futures.append(client.send(message))
-                client.msg_seq += 1
-        if futures:
-            await asyncio.wait(futures)
-
-    async def broadcast_message(self, message, exclude=None):
-        if not self._clients or len(self._clients) == 1 and self._clients[0] == exclude:
+        if client.sessions:
+            # Clients of multiple sessions use the longest delay
+            delay = max(self._move_delays.delay(session) for session in client.sessions)
+        else:
+            delay = self._move_delays.delay()
+        if delay != client.move_delay:
+            client.move_delay = delay
+            client.send(protocol.encode({'Event': 'MOVE_DELAY_SET', 'IntValue': delay}))
+
+    def stats(self):
+        sizes = [client.queue_size for client in self._clients]
+        return {
+            'clients': len(sizes),
+            'queued_messages': sum(sizes),
+            'max_queued_messages': max(sizes, default=0),
+            'dropped_moves': self._dropped_moves + sum(
+                client.dropped_moves for client in self._clients)
+        }
+
+    def _recipients(self, session):
+        if session is None:
+            return self._clients
+        if session not in self._session_clients:
+            return self._unscoped_clients
+        return itertools.chain(self._session_clients[session], self._unscoped_clients)
+
+    def _subscribe(self, client, session):
+        if session not in self._session_clients:
+            self._session_clients[session] = set()
+        self._session_clients[session].add(client)
+        client.sessions.add(session)
+        self._unscoped_clients.discard(client)
+
+    def _unsubscribe(self, client, session):
+        clients = self._session_clients.get(session)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del self._session_clients[session]
+        client.sessions.discard(session)
+
+    # Subscribe the client to the session and send it all objects of the
+    # session, events which happen meanwhile are held and sent after
+    # SNAPSHOT_END, so the snapshot is followed by live events without a gap
+    async def _subscribe_snapshot(self, client, session):
+        client.begin_snapshot()
+        try:
+            self._subscribe(client, session)
+            # Events with a higher position follow the snapshot
+            log = self._event_log(session)
+            position = {'Name': session, 'Epoch': log.epoch, 'Pos': log.pos}
+            client.send_snapshot(protocol.encode({'Event': 'SNAPSHOT_BEGIN', **position}))
+            count = 0
+            async for items in self._storage.iter_objects(session, self.SNAPSHOT_CHUNK_SIZE):
+                client.send_snapshot(protocol.encode({'Event': 'SNAPSHOT_ITEMS',
+                                                      'Name': session,
+                                                      'Items': items}))
+                count += len(items)
+                if not await client.wait_snapshot(self.SNAPSHOT_WINDOW):
+                    return
+            client.send_snapshot(protocol.encode({'Event': 'SNAPSHOT_END',
+                                                  'Count': count,
+                                                  **position}))
+        finally:
+            client.end_snapshot()
+
+    # Subscribe the client to the session and send it the events following
+    # the given position, return False if they are not available
+    def _subscribe_resume(self, client, session, epoch, pos):
+        log = self._event_logs.get(session)
+        if log is None or log.epoch != epoch or not isinstance(pos, int):
+            return False
+        bodies = log.since(pos)
+        if bodies is None:
+            return False
+        logging.debug(f'Resuming session {session} from {pos} with {len(bodies)} events')
+        self._subscribe(client, session)
+        client.send(protocol.encode({'Event': 'SESSION_RESUMED',
+                                     'Name': session,
+                                     'Epoch': epoch,
+                                     'Pos': pos,
+                                     'Count': len(bodies)}))
+        for body in bodies:
+            client.send(body)
+        return True
+
+    # Unsubscribe all clients from the session, used when it gets removed
+    def unsubscribe_session(self, session):
+        for client in list(self._session_clients.get(session, ())):
+            self._unsubscribe(client, session)
+        self._event_logs.pop(session, None)
+
+    async def _remove_client(self, client):
+        self._clients.discard(client)
+        self._unscoped_clients.discard(client)
+        self._batch_clients.discard(client)
+        self._binary_clients.discard(client)
+        for session in list(client.sessions):
+            self._unsubscribe(client, session)
+        self._dropped_moves += client.dropped_moves
+        self._sent_bytes += client.sent_bytes
+        await client.close()
+
+    # Fields of the client messages which are used as keys
+    _STRING_FIELDS = ('Session', 'Uid')
+
+    # Return False if a key field of the client message is not a string
+    def _valid_fields(self, data):
+        return all(isinstance(data[field], str) for field in self._STRING_FIELDS
+                       if field in data)
+
+    # Return the session affected by the client message, None if it affects
+    # clients of all sessions
+    async def _message_session(self, data):
+        event = data.get('Event')
+        if event == 'ITEM_ADDED':
+            return data.get('Session')
+        if event in ('ITEM_MOVED', 'ITEM_REMOVED', 'ITEM_SELECTION_CHANGED'):
+            if 'Uid' in data:
+                return await self._storage.get_object_session(data['Uid'])
+        return None
+
+    # Forward the connection to the worker owning the session
+    async def _forward(self, websocket, path, shard):
+        subprotocols = None
+        if websocket.subprotocol is not None:
+            subprotocols = [websocket.subprotocol]
+        url = f'ws://{self._shards.HOST}:{self._shards.ws_port(shard)}{path}'
+        try:
+            upstream = await websockets.connect(url, subprotocols=subprotocols, loop=self._loop)
+        except:
+            logging.exception(f'Failed to forward WS connection to {url}')
             return
-        futures = []
-        for client in self._clients:
-            if client != exclude:
-                message['Seq'] = client.msg_seq
-                futures.append(client.send(json.dumps(message)))
-                client.msg_seq += 1
-        if futures:
-            await asyncio.wait(futures)
+        async def pump(source, target):
+            try:
+                while True:
+                    await target.send(await source.recv())
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        tasks = [self._loop.create_task(pump(websocket, upstream)),
+                 self._loop.create_task(pump(upstream, websocket))]
+        # Stop when either side disconnects
+        finished, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await upstream.close()
 
     async def _handler(self, websocket, path):
         host, port = websocket.remote_address
         logging.debug(f'WS connection from {host}:{port}')
-        websocket.msg_seq = 1
-        self._clients.append(websocket)
-        if self.MOVE_DELAY > 0:
-            message = json.dumps({'Event': 'MOVE_DELAY_SET',
-                                  'Seq': websocket.msg_seq,
-                                  'IntValue': self.MOVE_DELAY})
-            websocket.msg_seq += 1
-            await websocket.send(message)
-        while True:
-            try:
-                # Try to receive a message from the client, this throws when
-                # the client has disconnected
-                message = await websocket.recv()
-            except:
-                logging.exception('WebSocket recv()')
-                break
-            try:
-                message = json.loads(message)
-            except:
-                logging.debug(f'Failed to decode: {message}')
-                message = None
-            if message is not None:
-                if self._process_message(message, websocket):
-                    # Broadcast to other clients
-                    await self.broadcast_message(message, websocket)
-        logging.debug(f'WS client {host}:{port} disconnected')
-        self._clients.remove(websocket)
-        moves = self._storage.deselect_all_ident_objects(websocket)
+        session = session_from_path(path)
+        if session is not None and self._shards is not None:
+            shard = self._shards.owner(session)
+            if shard != self._shards.index:
+                logging.debug(f'Forwarding WS connection of session {session} to shard {shard}')
+                await self._forward(websocket, path, shard)
+                return
+        client = WSClient(websocket, next(self._client_ids), self._loop)
+        client.start()
+        self._clients.add(client)
+        self._unscoped_clients.add(client)
+        if client.binary:
+            self._binary_clients.add(client)
+        if session is not None:
+            self._subscribe(client, session)
+        self._send_move_delay(client)
+        # The client is removed even when processing a message fails
+        try:
+            while True:
+                try:
+                    # Try to receive a message from the client, this throws when
+                    # the client has disconnected
+                    message = await client.recv()
+                except:
+                    logging.exception('WebSocket recv()')
+                    break
+                self._received_bytes.inc(len(message))
+                try:
+                    message = protocol.decode(message)
+                except:
+                    logging.debug(f'Failed to decode: {message}')
+                    message = None
+                if isinstance(message, dict) and self._valid_fields(message):
+                    event = message.get('Event')
+                    if not isinstance(event, str) or event not in self._EVENTS:
+                        event = 'UNKNOWN'
+                    # The session must be known before processing as the object
+                    # may be removed
+                    session = await self._message_session(message)
+                    if event == 'ITEM_MOVED':
+                        self._move_delays.record_move(session)
+                    start = time.perf_counter()
+                    processed = await self._process_message(message, client)
+                    self._process_times[event].observe(time.perf_counter() - start)
+                    if processed:
+                        # Broadcast to other clients
+                        await self.broadcast_message(message, client, session)
+                else:
+                    self._invalid_messages.inc()
+        finally:
+            logging.debug(f'WS client {host}:{port} disconnected')
+            await self._remove_client(client)
+            self._event_bus.publish({'Type': 'CLIENT_LEFT', 'Ident': self._remote_ident(client)})
+            moves = await self._storage.deselect_all_ident_objects(client)
+            await self._broadcast_completed_moves(moves)
+
+    async def _broadcast_completed_moves(self, moves):
         for uid, move in moves.items():
             await self.broadcast_item_moved({
                 'Uid': uid,
@@ -109,7 +518,7 @@ class WSServer:
                 'Rotation': move[2]
             })
 
-    def _process_message(self, data, websocket):
+    async def _process_message(self, data, client):
         if 'Event' not in data:
             return False
 
@@ -117,7 +526,7 @@ class WSServer:
         if event == 'ITEM_ADDED':
             # Adding objects through WebSockets only works for non-file
             # objects, in any case clients can add using HTTP requests
-            return self._storage.add_object(data) is not None
+            return await self._storage.add_object(data) is not None
         elif event == 'ITEM_MOVED':
             if 'Uid' not in data:
                 return False
@@ -128,28 +537,76 @@ class WSServer:
                 scale = data['Scale']
             if 'Rotation' in data:
                 rotation = data['Rotation']
-            return self._storage.move_object(data['Uid'], websocket, position, scale, rotation)
+            return await self._storage.move_object(data['Uid'], client, position, scale, rotation)
         elif event == 'ITEM_REMOVED':
             if 'Uid' not in data:
                 return False
-            return self._storage.remove_object(data['Uid'])
+            return await self._storage.remove_object(data['Uid'])
         elif event == 'ITEM_SELECTION_CHANGED':
             if 'Uid' not in data:
                 return False
             if 'IsSelected' not in data:
                 return False
             if data['IsSelected']:
-                return self._storage.select_object(data['Uid'], websocket)
+                result = self._storage.select_object(data['Uid'], client)
             else:
-                return self._storage.deselect_object(data['Uid'], websocket)
+                result, move = await self._storage.deselect_object(data['Uid'], client)
+            if result:
+                self._event_bus.publish({'Type': 'SELECTION_CHANGED',
+                                         'Uid': data['Uid'],
+                                         'Ident': self._remote_ident(client),
+                                         'IsSelected': bool(data['IsSelected'])})
+            return result
         elif event == 'SESSION_ADDED':
             if 'Name' not in data:
                 return False
-            return self._storage.add_session(data['Name']) is not None
+            return await self._storage.add_session(data['Name']) is not None
         elif event == 'SESSION_REMOVED':
             if 'Name' not in data:
                 return False
-            return self._storage.remove_session(data['Name'])
+            if not await self._storage.remove_session(data['Name']):
+                return False
+            self.unsubscribe_session(data['Name'])
+            return True
+        elif event == 'SESSION_SUBSCRIBE':
+            # Subscription only affects the client itself, so it is never
+            # broadcast
+            if 'Name' in data:
+                if not isinstance(data['Name'], str):
+                    return False
+                if self._shards is not None and not self._shards.is_local(data['Name']):
+                    # Sessions of other workers are only served on connections
+                    # to their path, which are relayed to the owner
+                    client.send(protocol.encode({'Event': 'SESSION_REDIRECT',
+                                                 'Name': data['Name'],
+                                                 'Path': session_path(data['Name'])}))
+                    return False
+                if 'Pos' in data:
+                    # Resuming clients get a snapshot when the missed events
+                    # are no longer available
+                    if not self._subscribe_resume(client, data['Name'],
+                                                  data.get('Epoch'), data['Pos']):
+                        await self._subscribe_snapshot(client, data['Name'])
+                elif data.get('Snapshot'):
+                    await self._subscribe_snapshot(client, data['Name'])
+                else:
+                    self._subscribe(client, data['Name'])
+                self._send_move_delay(client)
+            return False
+        elif event == 'SESSION_UNSUBSCRIBE':
+            if 'Name' in data:
+                self._unsubscribe(client, data['Name'])
+                self._send_move_delay(client)
+            return False
+        elif event == 'MOVE_BATCH_SET':
+            # Batching is only possible when the moves are delayed
+            enabled = bool(data.get('BoolValue')) and self.MOVE_DELAY > 0
+            client.set_move_batching(enabled)
+            if enabled:
+                self._batch_clients.add(client)
+            else:
+                self._batch_clients.discard(client)
+            return False
         else:
             # Unknown message
             return False
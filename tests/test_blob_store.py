@@ -0,0 +1,56 @@
+import hashlib
+import os
+
+from session_server import blob_store
+
+def _stage(tmp_path, content):
+    path = tmp_path / f'staged-{len(list(tmp_path.iterdir()))}'
+    path.write_bytes(content)
+    return str(path), hashlib.sha256(content).hexdigest()
+
+def test_is_digest():
+    assert blob_store.BlobStore.is_digest('0' * 64)
+    assert not blob_store.BlobStore.is_digest('0' * 63)
+    assert not blob_store.BlobStore.is_digest('A' * 64)
+    assert not blob_store.BlobStore.is_digest('../' + '0' * 61)
+    assert not blob_store.BlobStore.is_digest(None)
+
+def test_path(tmp_path):
+    blobs = blob_store.BlobStore(str(tmp_path))
+    digest = 'ab' + '0' * 62
+    assert blobs.path(digest) == os.path.join(str(tmp_path), '.blobs', 'ab', digest)
+    assert blobs.path('../../etc/passwd') is None
+    assert not blobs.exists('../../etc/passwd')
+
+def test_put_and_remove(tmp_path):
+    blobs = blob_store.BlobStore(str(tmp_path))
+    temp_file, digest = _stage(tmp_path, b'content')
+    blobs.put(temp_file, digest)
+    assert blobs.exists(digest)
+    assert not os.path.exists(temp_file)
+    with open(blobs.path(digest), 'rb') as fp:
+        assert fp.read() == b'content'
+    blobs.remove(digest)
+    assert not blobs.exists(digest)
+    assert not os.path.exists(os.path.dirname(blobs.path(digest)))
+    # Removing a missing blob is not an error
+    blobs.remove(digest)
+
+def test_put_existing(tmp_path):
+    blobs = blob_store.BlobStore(str(tmp_path))
+    temp_file, digest = _stage(tmp_path, b'content')
+    blobs.put(temp_file, digest)
+    temp_file, digest = _stage(tmp_path, b'content')
+    blobs.put(temp_file, digest)
+    assert not os.path.exists(temp_file)
+    assert blobs.exists(digest)
+
+def test_remove_keeps_shared_directory(tmp_path):
+    blobs = blob_store.BlobStore(str(tmp_path))
+    first, second = 'ab' + '1' * 62, 'ab' + '2' * 62
+    for digest in (first, second):
+        temp_file = tmp_path / digest
+        temp_file.write_bytes(b'')
+        blobs.put(str(temp_file), digest)
+    blobs.remove(first)
+    assert blobs.exists(second)
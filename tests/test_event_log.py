@@ -0,0 +1,83 @@
+import json
+
+from session_server import event_log
+
+def _events(log, pos=0):
+    return [json.loads(body) for body in log.since(pos)]
+
+def test_append_and_since():
+    log = event_log.SessionEventLog()
+    body = log.append({'Event': 'ITEM_ADDED', 'Uid': 'a'})
+    assert json.loads(body) == {'Event': 'ITEM_ADDED', 'Uid': 'a', 'Pos': 1}
+    log.append({'Event': 'ITEM_ADDED', 'Uid': 'b'})
+    assert log.pos == 2
+    assert [event['Uid'] for event in _events(log)] == ['a', 'b']
+    assert [event['Uid'] for event in _events(log, 1)] == ['b']
+    assert log.since(2) == []
+    assert log.since(3) is None
+
+def test_only_latest_move_is_kept():
+    log = event_log.SessionEventLog()
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [1, 0, 0]})
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'b', 'Position': [2, 0, 0]})
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [3, 0, 0]})
+    assert len(log) == 2
+    assert [(event['Uid'], event['Pos']) for event in _events(log)] == [('b', 2), ('a', 3)]
+    assert log.size == sum(len(body) for body in log.since(0))
+
+def test_partial_moves_are_merged():
+    log = event_log.SessionEventLog()
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [1, 0, 0]})
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Rotation': [0, 0, 0, 1]})
+    body = log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Scale': [2, 2, 2]})
+    # The live event is sent as it is
+    assert json.loads(body) == {'Event': 'ITEM_MOVED', 'Uid': 'a',
+                                'Scale': [2, 2, 2], 'Pos': 3}
+    assert _events(log) == [{'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [1, 0, 0],
+                             'Rotation': [0, 0, 0, 1], 'Scale': [2, 2, 2], 'Pos': 3}]
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [5, 0, 0]})
+    assert _events(log)[0]['Position'] == [5, 0, 0]
+    assert _events(log)[0]['Scale'] == [2, 2, 2]
+
+def test_removal_drops_moves():
+    log = event_log.SessionEventLog()
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [1, 0, 0]})
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'b', 'Position': [1, 0, 0]})
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'c', 'Position': [1, 0, 0]})
+    log.append({'Event': 'ITEM_REMOVED', 'Uid': 'a'})
+    log.append({'Event': 'ITEM_REMOVED_BATCH', 'Uids': ['b', 'x']})
+    assert [event['Event'] for event in _events(log)] == \
+        ['ITEM_MOVED', 'ITEM_REMOVED', 'ITEM_REMOVED_BATCH']
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [2, 0, 0]})
+    assert _events(log, 5) == [{'Event': 'ITEM_MOVED', 'Uid': 'a',
+                                'Position': [2, 0, 0], 'Pos': 6}]
+
+def test_size_limit():
+    log = event_log.SessionEventLog()
+    log.MAX_BYTES = 200
+    for i in range(20):
+        log.append({'Event': 'ITEM_ADDED', 'Uid': str(i)})
+    assert log.size <= 200
+    assert log.since(0) is None
+    # Clients which have seen the last evicted event may still catch up
+    first = log.pos - len(log)
+    assert log.since(first - 1) is None
+    assert len(log.since(first)) == len(log)
+
+def test_evicted_move_is_forgotten():
+    log = event_log.SessionEventLog()
+    log.MAX_BYTES = 150
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [1, 0, 0]})
+    for i in range(5):
+        log.append({'Event': 'ITEM_ADDED', 'Uid': str(i)})
+    log.append({'Event': 'ITEM_MOVED', 'Uid': 'a', 'Scale': [2, 2, 2]})
+    assert 'Position' not in _events(log, log.pos - 1)[0]
+
+def test_age_limit():
+    log = event_log.SessionEventLog()
+    log.append({'Event': 'ITEM_ADDED', 'Uid': 'a'})
+    assert not log.expired()
+    log.MAX_AGE = -1
+    assert log.expired()
+    assert log.since(0) is None
+    assert log.since(1) == []
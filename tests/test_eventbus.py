@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from session_server import eventbus
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+def _receiver(received):
+    async def handle(message):
+        received.append(message)
+    return handle
+
+def test_single_bus_has_no_peers(loop):
+    bus = eventbus.LocalEventBus(0, loop=loop)
+    assert not bus.has_peers
+    # Nothing is encoded, which would fail for this message
+    bus.publish({'Type': 'BROADCAST', 'Message': object()})
+    loop.run_until_complete(asyncio.sleep(0))
+
+def test_group(loop):
+    group = []
+    first = eventbus.LocalEventBus(0, group, loop=loop)
+    second = eventbus.LocalEventBus(1, group, loop=loop)
+    third = eventbus.LocalEventBus(2, group, loop=loop)
+    assert first.has_peers
+    received = {bus.worker_id: [] for bus in group}
+    for bus in group:
+        bus.subscribe(_receiver(received[bus.worker_id]))
+    message = {'Type': 'BROADCAST', 'Message': {'Event': 'ITEM_MOVED'}}
+    first.publish(message)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert received[0] == []
+    assert received[1] == [{**message, 'Origin': 0}]
+    assert received[2] == received[1]
+    # The receivers get a copy of the message
+    assert 'Origin' not in message
+    assert received[1][0]['Message'] is not message['Message']
+    loop.run_until_complete(second.close())
+    loop.run_until_complete(third.close())
+    assert not first.has_peers
+
+def test_handler_errors_are_logged(loop):
+    group = []
+    first = eventbus.LocalEventBus(0, group, loop=loop)
+    second = eventbus.LocalEventBus(1, group, loop=loop)
+    async def fail(message):
+        raise ValueError
+    second.subscribe(fail)
+    first.publish({'Type': 'BROADCAST'})
+    loop.run_until_complete(asyncio.sleep(0))
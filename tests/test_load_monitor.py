@@ -0,0 +1,36 @@
+from session_server.load_monitor import MoveDelayController
+
+def test_delay_is_raised_under_load():
+    controller = MoveDelayController(100)
+    assert controller.update(0.1, {'a': (1, 0), 'b': (1, 0.5)})
+    assert controller.delay('a') == 150
+    assert controller.delay('b') == 150
+    assert controller.delay('c') == 100
+    assert controller.update(0.0, {'a': (1, 100)})
+    assert controller.delay('a') == 225
+    # Sessions without clients fall back to the default delay
+    assert controller.delay('b') == 100
+
+def test_delay_is_lowered_when_idle():
+    controller = MoveDelayController(100)
+    assert controller.update(0.0, {'a': (1, 0)})
+    assert controller.delay('a') == 80
+    for i in range(10):
+        controller.update(0.0, {'a': (1, 0)})
+    assert controller.delay('a') == MoveDelayController.MIN_DELAY
+    assert not controller.update(0.0, {'a': (1, 0)})
+
+def test_delay_is_kept_between_the_limits():
+    controller = MoveDelayController(100)
+    assert not controller.update(0.02, {'a': (1, 5)})
+    assert controller.delay('a') == 100
+    for i in range(20):
+        controller.update(1.0, {'a': (1, 0)})
+    assert controller.delay('a') == MoveDelayController.MAX_DELAY
+
+def test_fanout_raises_delay():
+    controller = MoveDelayController(100)
+    for i in range(100):
+        controller.record_move('a')
+    controller.update(0.0, {'a': (1000, 0)})
+    assert controller.delay('a') == 150
@@ -0,0 +1,58 @@
+from session_server.metrics import Histogram, Metrics
+
+def test_counter():
+    metrics = Metrics()
+    counter = metrics.counter('requests_total', 'Requests', ('method',))
+    counter['GET'].inc()
+    counter.labels('GET').inc(2)
+    counter['POST'].inc()
+    assert metrics.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{method="GET"} 3',
+        'requests_total{method="POST"} 1']
+
+def test_histogram_buckets():
+    histogram = Histogram((1, 2, 5))
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+    assert list(histogram.buckets()) == [(1, 2), (2, 3), (5, 4), (float('inf'), 5)]
+    assert histogram.count == 5
+    assert histogram.sum == 16
+
+def test_render_histogram():
+    metrics = Metrics()
+    histogram = metrics.histogram('latency_seconds', 'Latency', ('method', 'handler'),
+                                  buckets=(0.1, 1.0))
+    histogram['GET', 'item'].observe(0.5)
+    assert metrics.render().splitlines() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{method="GET",handler="item",le="0.1"} 0',
+        'latency_seconds_bucket{method="GET",handler="item",le="1.0"} 1',
+        'latency_seconds_bucket{method="GET",handler="item",le="+Inf"} 1',
+        'latency_seconds_sum{method="GET",handler="item"} 0.5',
+        'latency_seconds_count{method="GET",handler="item"} 1']
+
+def test_collected_metrics():
+    metrics = Metrics()
+    metrics.gauge('clients', 'Clients', lambda: 4)
+    metrics.counter_callback('messages_total', 'Messages', lambda: {('a',): 2}, ('session',))
+    assert metrics.render().splitlines()[2::3] == ['clients 4', 'messages_total{session="a"} 2']
+
+def test_stats_skip_non_numeric_values():
+    metrics = Metrics()
+    metrics.stats('storage', 'Storage', lambda: {'objects': 3, 'ratio': 0.5, 'engine': 'sqlite',
+                                                 'closed': False})
+    assert metrics.render().splitlines() == [
+        '# HELP storage_objects Storage: objects',
+        '# TYPE storage_objects untyped',
+        'storage_objects 3',
+        '# HELP storage_ratio Storage: ratio',
+        '# TYPE storage_ratio untyped',
+        'storage_ratio 0.5']
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.counter('total', 'Total', ('name',))['a"b\\c\nd'].inc()
+    assert metrics.render().splitlines()[2] == 'total{name="a\\"b\\\\c\\nd"} 1'
@@ -0,0 +1,54 @@
+import json
+import uuid
+
+from session_server import protocol
+
+UID = '6f1c8a2e-3b4d-4e5f-9a0b-1c2d3e4f5a6b'
+
+def test_add_seq():
+    assert json.loads(protocol.add_seq(protocol.encode({'Event': 'PING'}), 7)) == \
+        {'Seq': 7, 'Event': 'PING'}
+    assert json.loads(protocol.add_seq(protocol.encode({}), 3)) == {'Seq': 3}
+
+def test_add_seq_keeps_body():
+    message = {'Event': 'ITEM_ADDED', 'Uid': 'a', 'Text': '{"Seq": 1}'}
+    body = protocol.encode(message)
+    assert protocol.decode(protocol.add_seq(body, 1)) == {'Seq': 1, **message}
+    assert protocol.decode(protocol.add_seq(body, 2)) == {'Seq': 2, **message}
+
+def test_add_seq_binary():
+    body = protocol.encode_move({'Uid': UID, 'Position': [1, 2, 3]})
+    data = protocol.add_seq(body, 5)
+    assert data[:1] == body[:1]
+    assert int.from_bytes(data[1:5], 'little') == 5
+    assert protocol.decode(data) == {'Event': 'ITEM_MOVED', 'Uid': UID,
+                                     'Position': [1.0, 2.0, 3.0]}
+
+def test_move_round_trip():
+    move = {'Uid': UID, 'Scale': [1.0, 1.0, 2.0], 'Rotation': [0.0, 0.0, 0.5, 1.0]}
+    data = protocol.add_seq(protocol.encode_move(move), 0)
+    assert protocol.decode_binary(data) == {'Event': 'ITEM_MOVED', **move}
+
+def test_move_batch_round_trip():
+    moves = [{'Uid': str(uuid.UUID(int=i)), 'Position': [float(i), 0.0, 0.0]}
+             for i in range(3)]
+    body = protocol.encode_move_batch([protocol.pack_move(move) for move in moves])
+    assert protocol.decode_binary(protocol.add_seq(body, 1)) == \
+        {'Event': 'ITEM_MOVED_BATCH', 'Items': moves}
+
+def test_pack_move_invalid():
+    assert protocol.pack_move({'Uid': 'object-1', 'Position': [0, 0, 0]}) is None
+    assert protocol.pack_move({'Uid': UID.upper(), 'Position': [0, 0, 0]}) is None
+    assert protocol.pack_move({'Uid': None}) is None
+    assert protocol.pack_move({'Uid': UID, 'Position': [0, 0]}) is None
+    assert protocol.pack_move({'Uid': UID, 'Position': ['a', 0, 0]}) is None
+    assert protocol.encode_move({'Uid': UID, 'Rotation': (0, 0, 0, 1)}) is None
+
+def test_decode_binary_invalid():
+    assert protocol.decode_binary(b'') is None
+    assert protocol.decode_binary(b'\x09\0\0\0\0') is None
+    data = protocol.add_seq(protocol.encode_move({'Uid': UID, 'Position': [0, 0, 0]}), 0)
+    assert protocol.decode_binary(data[:-1]) is None
+    batch = protocol.add_seq(protocol.encode_move_batch([]), 0)
+    assert protocol.decode_binary(batch[:-1]) is None
+    assert protocol.decode_binary(batch[:5] + (2).to_bytes(4, 'little')) is None
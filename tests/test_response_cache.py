@@ -0,0 +1,32 @@
+from session_server.response_cache import ResponseCache
+
+def test_get_and_put():
+    cache = ResponseCache()
+    assert cache.get('a') is None
+    cache.put('a', b'body')
+    assert cache.get('a') == b'body'
+    cache.put('a', b'longer body')
+    assert cache.get('a') == b'longer body'
+    assert (len(cache), cache.size) == (1, 11)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', b'a')
+    cache.put('b', b'b')
+    cache.get('a')
+    cache.put('c', b'c')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'a'
+    assert cache.get('c') == b'c'
+
+def test_size_is_limited():
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'123456')
+    assert cache.get('a') is None
+    assert cache.size == 6
+    cache.MAX_ENTRY_BYTES = 8
+    cache.put('c', b'123456789')
+    assert cache.get('c') is None
+    assert cache.get('b') == b'123456'
@@ -0,0 +1,83 @@
+from session_server import selection
+
+def test_select_and_deselect():
+    selections = selection.SelectionManager()
+    assert selections.select('a', 1)
+    assert selections.select('a', 2)
+    assert selections.select('a', 1)
+    assert len(selections) == 2
+    assert selections.is_selected('a')
+    assert selections.is_selected('a', 2)
+    assert not selections.is_selected('a', 3)
+    assert selections.deselect('a', 1) == (True, None)
+    assert selections.deselect('a', 1) == (False, None)
+    assert selections.is_selected('a')
+    selections.deselect('a', 2)
+    assert not selections.is_selected('a')
+
+def test_limits():
+    selections = selection.SelectionManager(max_per_ident=2, max_selections=3)
+    assert selections.select('a', 1)
+    assert selections.select('b', 1)
+    assert not selections.select('c', 1)
+    # Renewing does not count against the limit
+    assert selections.select('a', 1)
+    assert selections.select('a', 2)
+    assert not selections.select('b', 2)
+    assert selections.stats()['rejected_total'] == 2
+
+def test_postponed_moves():
+    selections = selection.SelectionManager()
+    assert not selections.add_move('a', 1, position=[1, 0, 0])
+    selections.select('a', 1)
+    selections.select('a', 2)
+    assert selections.add_move('a', 1, position=[1, 0, 0])
+    assert selections.add_move('a', 1, scale=[2, 2, 2])
+    assert selections.add_move('a', 2, rotation=[0, 0, 0, 1])
+    # The move is completed by the last client which moved the object
+    assert selections.deselect('a', 1) == (True, None)
+    assert selections.deselect('a', 2) == (True, [None, None, [0, 0, 0, 1]])
+    assert selections.stats()['postponed_moves'] == 0
+
+def test_deselect_all():
+    selections = selection.SelectionManager()
+    selections.select('a', 1)
+    selections.select('b', 1)
+    selections.select('b', 2)
+    selections.add_move('a', 1, position=[1, 0, 0])
+    selections.add_move('b', 2, position=[2, 0, 0])
+    selections.add_move('b', 1, position=[3, 0, 0])
+    # The move of b is completed by the other client which moved it too
+    assert selections.deselect_all(1) == {'a': [[1, 0, 0], None, None]}
+    assert selections.is_selected('b', 2)
+    assert selections.deselect_all(1) == {}
+    assert selections.deselect('b', 2) == (True, [[2, 0, 0], None, None])
+
+def test_expire():
+    selections = selection.SelectionManager(lease=-1)
+    selections.select('a', 1)
+    selections.add_move('a', 1, position=[1, 0, 0])
+    assert selections.expire() == {'a': [[1, 0, 0], None, None]}
+    assert not selections.is_selected('a')
+    assert selections.stats()['expired_total'] == 1
+    assert selections.expire() == {}
+
+def test_renewed_lease_does_not_expire():
+    selections = selection.SelectionManager(lease=60)
+    selections.select('a', 1)
+    selections.select('b', 1)
+    selections._leases[('a', 1)] = 0
+    selections._leases[('b', 1)] = 0
+    selections.select('a', 1)
+    assert selections.expire() == {}
+    assert selections.is_selected('a')
+    assert not selections.is_selected('b')
+
+def test_forget():
+    selections = selection.SelectionManager()
+    selections.select('a', 1)
+    selections.add_move('a', 1, position=[1, 0, 0])
+    selections.forget('a')
+    assert len(selections) == 0
+    assert selections.deselect_all(1) == {}
+    assert selections.stats()['selecting_clients'] == 0
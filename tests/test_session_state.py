@@ -0,0 +1,57 @@
+from session_server import session_state
+
+EXTRA = ('Url', 'Name')
+
+def test_transform_array():
+    assert session_state.transform_array([1, 2, 3], 3).tolist() == [1.0, 2.0, 3.0]
+    assert session_state.transform_array([1, 2], 3) is None
+    assert session_state.transform_array((1, 2, 3), 3) is None
+    assert session_state.transform_array(None, 3) is None
+    assert session_state.transform_array(['a', 2, 3], 3) is None
+    assert session_state.transform_array([None, 2, 3], 3) is None
+    assert session_state.transform_array([10 ** 400, 2, 3], 3) is None
+
+def test_object_round_trip():
+    data = {'Uid': 'a', 'Session': 's', 'ObjectType': 'Cube',
+            'Position': [1.5, 2, 3], 'Scale': [1, 1, 1], 'Rotation': [0, 0, 0, 1],
+            'Url': 'http://example.com'}
+    obj = session_state.ObjectState(data, EXTRA)
+    assert obj.to_dict('s', EXTRA) == data
+
+def test_object_with_invalid_transform():
+    data = {'Uid': 'a', 'Position': ['x', 0, 0], 'Scale': None, 'Rotation': [1, 2]}
+    obj = session_state.ObjectState(data, EXTRA)
+    assert obj.to_dict('s', EXTRA) == {'Uid': 'a', 'Session': 's', 'ObjectType': None,
+                                       'Position': [0.0] * 3, 'Scale': [0.0] * 3,
+                                       'Rotation': [0.0] * 4}
+
+def test_move():
+    obj = session_state.ObjectState({'Uid': 'a', 'Position': [1, 2, 3]}, ())
+    obj.move(scale=[2, 2, 2])
+    obj.move(position=[1, 'x', 3], rotation=[0, 0, 1, 0])
+    data = obj.to_dict('s', ())
+    assert data['Position'] == [1, 2, 3]
+    assert data['Scale'] == [2, 2, 2]
+    assert data['Rotation'] == [0, 0, 1, 0]
+
+def test_cache_evicts_least_recently_used():
+    cache = session_state.SessionStateCache(max_sessions=2)
+    assert cache.add(session_state.SessionState('a')) == []
+    cache.add(session_state.SessionState('b'))
+    assert cache.get('a').name == 'a'
+    evicted = cache.add(session_state.SessionState('c'))
+    assert [state.name for state in evicted] == ['b']
+    assert 'a' in cache and 'c' in cache and len(cache) == 2
+    assert cache.get('b') is None
+
+def test_cache_evicts_idle_sessions():
+    cache = session_state.SessionStateCache()
+    state = session_state.SessionState('a')
+    state.objects['x'] = session_state.ObjectState({'Uid': 'x'}, ())
+    cache.add(state)
+    stats = cache.stats()
+    assert stats['resident_sessions'] == 1 and stats['resident_objects'] == 1
+    assert stats['resident_bytes'] > 0
+    state.accessed -= session_state.SessionStateCache.IDLE_TIMEOUT + 1
+    assert cache.evict() == [state]
+    assert cache.stats()['bytes_per_object'] == 0
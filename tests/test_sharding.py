@@ -0,0 +1,42 @@
+import collections
+
+from session_server import sharding
+
+def test_owner_is_stable():
+    first = sharding.ShardMap(4, 0)
+    second = sharding.ShardMap(4, 2)
+    names = [f'session-{i}' for i in range(200)]
+    assert [first.owner(name) for name in names] == [second.owner(name) for name in names]
+    assert all(0 <= first.owner(name) < 4 for name in names)
+    assert first.is_local(names[0]) == (first.owner(names[0]) == 0)
+
+def test_sessions_are_spread():
+    shards = sharding.ShardMap(4, 0)
+    counts = collections.Counter(shards.owner(f'session-{i}') for i in range(4000))
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 500
+
+def test_adding_node_moves_few_keys():
+    before = sharding.HashRing(range(4))
+    after = sharding.HashRing(range(5))
+    keys = [f'session-{i}' for i in range(4000)]
+    moved = [key for key in keys if before.node(key) != after.node(key)]
+    assert all(after.node(key) == 4 for key in moved)
+    assert len(moved) < len(keys) / 3
+
+def test_ports():
+    shards = sharding.ShardMap(3, 1)
+    assert shards.web_port() == sharding.ShardMap.WEB_PORT_BASE + 1
+    assert shards.ws_port(2) == sharding.ShardMap.WS_PORT_BASE + 2
+
+def test_session_path_round_trip():
+    for name in ('default', 'a b', 'a/b?c#d', 'ünïcode', '%41'):
+        path = sharding.session_path(name)
+        assert sharding.session_from_path(path) == name
+        assert sharding.session_from_path(f'ws://localhost{path}?x=1') == name
+
+def test_session_from_path_invalid():
+    assert sharding.session_from_path(None) is None
+    assert sharding.session_from_path('/') is None
+    assert sharding.session_from_path('/session/') is None
+    assert sharding.session_from_path('/other/name') is None
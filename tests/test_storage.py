@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from session_server.storage import Storage
+from session_server.storage_sqlite import StorageSQLite
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture
+def storage(tmp_path, loop):
+    files_dir = tmp_path / 'files'
+    files_dir.mkdir()
+    storage = Storage(StorageSQLite(str(files_dir)), loop=loop)
+    yield storage
+    loop.run_until_complete(storage.close())
+
+def _object(uid, session='default', **fields):
+    return {'Uid': uid, 'Session': session, 'ObjectType': 'Text',
+            'Position': [0, 0, 0], 'Scale': [1, 1, 1], 'Rotation': [0, 0, 0, 1],
+            'Text': uid, **fields}
+
+def test_add_objects(loop, storage):
+    results = loop.run_until_complete(storage.add_objects(
+        [_object('a'), _object('b'), _object('a'), _object('c', 'missing'), 'x']))
+    assert [data['Uid'] if data else None for (data, error) in results] == \
+        ['a', 'b', None, None, None]
+    assert [error for (data, error) in results] == \
+        [None, None, 'already exists or failed to store', 'invalid session missing',
+         'invalid object']
+    objects = loop.run_until_complete(storage.get_all_objects('default'))
+    assert sorted(data['Uid'] for data in objects) == ['a', 'b']
+
+def test_add_objects_with_invalid_types(loop, storage):
+    items = [_object(['a']), _object('b', ['default']), _object('c', {'x': 1}),
+             _object('d', ObjectType=['Text']), _object('e', Position=[0, 'x', 0]),
+             _object(1), _object('f')]
+    results = loop.run_until_complete(storage.add_objects(items))
+    assert [error for (data, error) in results] == \
+        ['invalid basic field Uid', 'invalid basic field Session',
+         'invalid basic field Session', 'invalid basic field ObjectType',
+         'object e with invalid field Position', 'invalid basic field Uid', None]
+    assert storage.get_cached_object_session('f') == 'default'
+    assert loop.run_until_complete(storage.get_all_objects_uid_list('default')) == ['f']
+
+def test_move_and_remove_objects(loop, storage):
+    loop.run_until_complete(storage.add_objects([_object('a'), _object('b')]))
+    assert loop.run_until_complete(storage.get_object_sessions(['a', 'b', 'x'])) == \
+        {'a': 'default', 'b': 'default'}
+    assert loop.run_until_complete(storage.move_object('a', 1, position=[1, 2, 3]))
+    assert not loop.run_until_complete(storage.move_object('x', 1, position=[1, 2, 3]))
+    assert not loop.run_until_complete(storage.move_object('a', 1, position=[1, 2]))
+    assert loop.run_until_complete(storage.get_object('a'))['Position'] == [1, 2, 3]
+    assert loop.run_until_complete(storage.remove_objects(['a', 'x'])) == {'a': 'default'}
+    assert loop.run_until_complete(storage.get_object('a')) is None
+    assert loop.run_until_complete(storage.get_all_objects_uid_list('default')) == ['b']
+
+class _SlowEngine:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    def get_session(self, name):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        self.running -= 1
+        return {'Name': name}
+
+def test_engine_calls_are_bounded(loop):
+    engine = _SlowEngine()
+    storage = Storage(engine, workers=2, loop=loop)
+    async def get_sessions():
+        return await asyncio.gather(*(storage.get_session(str(i)) for i in range(6)))
+    sessions = loop.run_until_complete(get_sessions())
+    assert sessions == [{'Name': str(i)} for i in range(6)]
+    assert engine.max_running == 2
+    assert loop.run_until_complete(storage.session_exists('5'))
+    loop.run_until_complete(storage.close())
+
+def test_remove_session_and_reuse_name(loop, storage):
+    loop.run_until_complete(storage.add_session('a'))
+    loop.run_until_complete(storage.add_objects([_object('x', 'a'), _object('y', 'a')]))
+    assert loop.run_until_complete(storage.remove_session('a'))
+    assert not loop.run_until_complete(storage.session_exists('a'))
+    assert loop.run_until_complete(storage.add_session('a'))
+    assert loop.run_until_complete(storage.get_all_objects('a')) == []
+    data, error = loop.run_until_complete(storage.add_objects([_object('x', 'a')]))[0]
+    assert error is None
+    assert loop.run_until_complete(storage.get_all_objects_uid_list('a')) == ['x']
@@ -0,0 +1,163 @@
+import hashlib
+import os
+
+import pytest
+
+from session_server.storage_sqlite import StorageSQLite
+
+@pytest.fixture
+def files_dir(tmp_path):
+    files_dir = tmp_path / 'files'
+    files_dir.mkdir()
+    return files_dir
+
+@pytest.fixture
+def engine(files_dir):
+    return StorageSQLite(str(files_dir))
+
+def _object(uid, session='default', **fields):
+    return {'Uid': uid, 'Session': session, 'ObjectType': 'Text',
+            'Position': [0, 0, 0], 'Scale': [1, 1, 1], 'Rotation': [0, 0, 0, 1],
+            'Text': uid, **fields}
+
+def _stage(tmp_path, content):
+    path = tmp_path / f'staged-{hashlib.sha256(content).hexdigest()[:8]}'
+    path.write_bytes(content)
+    return str(path), hashlib.sha256(content).hexdigest()
+
+def test_database_next_to_files_dir(tmp_path, engine):
+    assert (tmp_path / StorageSQLite.DATABASE).exists()
+
+def test_sessions(engine):
+    assert engine.get_all_sessions_name_list() == ['default']
+    assert engine.add_session({'Name': 'a'})
+    assert not engine.add_session({'Name': 'a'})
+    assert engine.get_session('a') == {'Name': 'a'}
+    assert engine.get_session('b') is None
+    assert engine.get_all_sessions() == [{'Name': 'default'}, {'Name': 'a'}]
+
+def test_objects(engine):
+    data = _object('a', Text='text')
+    assert engine.add_object(dict(data))
+    assert not engine.add_object(_object('a'))
+    assert engine.get_object('a') == data
+    assert engine.get_object('x') is None
+    assert engine.add_objects([_object('b'), _object('a'), _object('c')]) == [True, False, True]
+    assert engine.get_all_objects_uid_list('default') == ['a', 'b', 'c']
+    assert engine.get_object_sessions(['a', 'c', 'x']) == {'a': 'default', 'c': 'default'}
+    assert engine.load_objects('missing') == []
+
+def test_moves(engine):
+    engine.add_object(_object('a'))
+    assert engine.move_object('a', position=[1, 2, 3])
+    assert engine.move_objects({'a': (None, [2, 2, 2], None), 'b': ([5, 5, 5], None, None)})
+    assert engine.get_object('a')['Position'] == [1, 2, 3]
+    assert engine.get_object('a')['Scale'] == [2, 2, 2]
+    # The move of an object which is not added yet applies when it is added
+    assert not engine.move_object('c', rotation=[1, 0, 0, 0])
+    engine.add_objects([_object('b'), _object('c')])
+    assert engine.get_object('b')['Position'] == [5, 5, 5]
+    assert engine.get_object('c')['Rotation'] == [1, 0, 0, 0]
+
+def test_iter_objects(engine):
+    engine.PAGE_SIZE = 2
+    engine.add_objects([_object(uid) for uid in 'ecabd'])
+    assert [data['Uid'] for data in engine.iter_objects('default')] == list('abcde')
+    assert list(engine.iter_objects('default', ('Uid', 'Text'), 'b', 2)) == \
+        [{'Uid': 'c', 'Text': 'c'}, {'Uid': 'd', 'Text': 'd'}]
+    assert list(engine.iter_objects('missing')) == []
+
+def test_file_object(tmp_path, files_dir, engine):
+    temp_file, digest = _stage(tmp_path, b'content')
+    data = _object('a', ObjectType='File', FileName='a.txt')
+    del data['Text']
+    assert engine.add_object(data, temp_file)
+    path, name = engine.get_object_file('a')
+    assert name == 'a.txt'
+    assert str(path) == str(files_dir / 'default' / 'a' / 'a.txt')
+    assert engine.remove_objects(['a']) == {'a': 'default'}
+    assert not (files_dir / 'default').exists()
+
+def test_blobs_are_shared(tmp_path, engine):
+    temp_file, digest = _stage(tmp_path, b'content')
+    data = _object('a', ObjectType='File', FileName='a.txt', Digest=digest)
+    assert engine.add_object(dict(data), temp_file)
+    assert engine.get_blob(digest) == {'Digest': digest, 'Size': 7}
+    assert engine.add_objects([{**data, 'Uid': 'b'}, {**data, 'Uid': 'c', 'Digest': '0' * 64}]) == \
+        [True, False]
+    # Unknown blobs are not added
+    assert not engine.add_object({**data, 'Uid': 'd', 'Digest': '1' * 64})
+    assert engine.remove_object('a')
+    assert engine.get_blob(digest) is not None
+    path, name = engine.get_object_file('b')
+    assert os.path.exists(path)
+    assert engine.remove_objects(['b', 'x']) == {'b': 'default'}
+    assert engine.get_blob(digest) is None
+
+def test_failed_file_move_removes_object(tmp_path, engine):
+    data = _object('a', ObjectType='File', FileName='a.txt')
+    assert not engine.add_object(data, str(tmp_path / 'missing'))
+    assert engine.get_object('a') is None
+
+def test_remove_objects_error(engine):
+    engine.add_object(_object('a'))
+    # Fail the transaction
+    engine._db().close()
+    assert engine.remove_objects(['a']) == {}
+
+def _reap_all(engine, limit):
+    batches = []
+    for tombstone in engine.get_tombstones():
+        while True:
+            removed, done = engine.reap(tombstone['Token'], limit)
+            batches.append(removed)
+            if done:
+                break
+    return batches
+
+def _object_count(engine):
+    return engine._db().execute('SELECT COUNT(*) FROM object').fetchone()[0]
+
+def test_clear_hides_objects_until_reaped(engine):
+    engine.add_objects([_object(uid) for uid in 'abcde'])
+    assert engine.clear('default')
+    assert engine.get_all_objects('default') == []
+    assert engine.get_object('a') is None
+    assert engine.remove_objects(['a']) == {}
+    # The uids can be used again before the deleted objects are removed
+    assert engine.add_objects([_object('a'), _object('f')]) == [True, True]
+    assert engine.get_all_objects_uid_list('default') == ['a', 'f']
+    assert [tombstone['Name'] for tombstone in engine.get_tombstones()] == ['default']
+    assert _reap_all(engine, 2) == [2, 2, 1, 0]
+    assert engine.get_tombstones() == []
+    assert _object_count(engine) == 2
+    assert engine.get_object('a') == _object('a')
+
+def test_remove_session_and_reuse_name(engine):
+    engine.add_session({'Name': 'a'})
+    engine.add_objects([_object('x', 'a'), _object('y', 'a')])
+    assert engine.remove_session('a')
+    assert not engine.remove_session('a')
+    assert engine.get_session('a') is None
+    assert not engine.add_object(_object('z', 'a'))
+    assert engine.add_session({'Name': 'a'})
+    assert engine.get_all_objects('a') == []
+    assert engine.add_object(_object('x', 'a'))
+    _reap_all(engine, 10)
+    assert engine.get_all_objects_uid_list('a') == ['x']
+    assert _object_count(engine) == 1
+
+def test_clear_all(tmp_path, files_dir, engine):
+    temp_file, digest = _stage(tmp_path, b'content')
+    engine.add_session({'Name': 'a'})
+    data = _object('f', ObjectType='File', FileName='f.txt', Digest=digest)
+    engine.add_object(dict(data), temp_file)
+    engine.add_objects([_object('x', 'a'), _object('y')])
+    assert engine.clear_all()
+    assert engine.get_all_sessions_name_list() == ['default']
+    assert engine.get_object_sessions(['f', 'x', 'y']) == {}
+    assert engine.get_blob(digest) is not None
+    _reap_all(engine, 10)
+    assert _object_count(engine) == 0
+    assert engine.get_blob(digest) is None
+    assert os.listdir(str(files_dir)) == ['.blobs']
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from session_server.transform_cache import TransformCache
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+class _Engine:
+    def __init__(self, loop):
+        self.written = []
+        self.result = True
+        self.blocked = None
+        self._loop = loop
+
+    async def write(self, moves):
+        if self.blocked is not None:
+            await self.blocked
+        self.written.append(moves)
+        return self.result
+
+def test_move_and_get(loop):
+    cache = TransformCache(_Engine(loop).write, loop=loop)
+    assert cache.get('a') is None
+    cache.move('a', position=[1, 0, 0])
+    cache.move('a', rotation=[0, 0, 0, 1])
+    assert cache.get('a') == ([1, 0, 0], None, [0, 0, 0, 1])
+    assert cache.apply({'Uid': 'a', 'Position': [0, 0, 0], 'Scale': [1, 1, 1]}) == \
+        {'Uid': 'a', 'Position': [1, 0, 0], 'Scale': [1, 1, 1], 'Rotation': [0, 0, 0, 1]}
+    assert cache.pop('a') == ([1, 0, 0], None, [0, 0, 0, 1])
+    assert len(cache) == 0
+
+def test_flush_waits_for_idle_objects(loop):
+    engine = _Engine(loop)
+    cache = TransformCache(engine.write, flush_interval=60, max_staleness=120, loop=loop)
+    cache.move('a', position=[1, 0, 0])
+    assert loop.run_until_complete(cache.flush())
+    assert engine.written == []
+    assert loop.run_until_complete(cache.flush(force=True))
+    assert engine.written == [{'a': ([1, 0, 0], None, None)}]
+    assert len(cache) == 0
+
+def test_failed_flush_is_retried(loop):
+    engine = _Engine(loop)
+    engine.result = False
+    cache = TransformCache(engine.write, loop=loop)
+    cache.move('a', position=[1, 0, 0], scale=[2, 2, 2])
+    assert not loop.run_until_complete(cache.flush(force=True))
+    assert cache.get('a') == ([1, 0, 0], [2, 2, 2], None)
+    engine.result = True
+    loop.run_until_complete(cache.flush(force=True))
+    assert engine.written[-1] == {'a': ([1, 0, 0], [2, 2, 2], None)}
+    assert cache.get('a') is None
+
+def test_entries_are_read_while_written(loop):
+    engine = _Engine(loop)
+    engine.blocked = loop.create_future()
+    cache = TransformCache(engine.write, loop=loop)
+    cache.move('a', position=[1, 0, 0], scale=[2, 2, 2])
+    cache.move('b', position=[1, 0, 0])
+    flush = loop.create_task(cache.flush(force=True))
+    loop.run_until_complete(asyncio.sleep(0))
+    assert cache.get('a') == ([1, 0, 0], [2, 2, 2], None)
+    assert len(cache) == 2
+    # Moves done meanwhile take precedence
+    cache.move('a', position=[3, 0, 0])
+    assert cache.get('a') == ([3, 0, 0], [2, 2, 2], None)
+    cache.pop('b')
+    engine.blocked.set_result(None)
+    loop.run_until_complete(flush)
+    assert cache.get('a') == ([3, 0, 0], None, None)
+    assert cache.get('b') is None
+    assert len(cache) == 1
+
+def test_failed_write_is_restored_under_later_moves(loop):
+    engine = _Engine(loop)
+    engine.blocked = loop.create_future()
+    engine.result = False
+    cache = TransformCache(engine.write, loop=loop)
+    cache.move('a', position=[1, 0, 0], scale=[2, 2, 2])
+    cache.move('b', position=[1, 0, 0])
+    flush = loop.create_task(cache.flush(force=True))
+    loop.run_until_complete(asyncio.sleep(0))
+    cache.move('a', position=[3, 0, 0])
+    cache.pop('b')
+    engine.blocked.set_result(None)
+    assert not loop.run_until_complete(flush)
+    assert cache.get('a') == ([3, 0, 0], [2, 2, 2], None)
+    # Removed objects are not put back
+    assert cache.get('b') is None
+
+def test_overlapping_flushes(loop):
+    engine = _Engine(loop)
+    engine.blocked = loop.create_future()
+    cache = TransformCache(engine.write, loop=loop)
+    cache.move('a', position=[1, 0, 0])
+    first = loop.create_task(cache.flush(force=True))
+    loop.run_until_complete(asyncio.sleep(0))
+    cache.move('a', scale=[2, 2, 2])
+    second = loop.create_task(cache.flush(force=True))
+    loop.run_until_complete(asyncio.sleep(0))
+    engine.blocked.set_result(None)
+    loop.run_until_complete(asyncio.gather(first, second))
+    assert engine.written[-1] == {'a': ([1, 0, 0], [2, 2, 2], None)}
+    assert cache.get('a') is None
+
+def test_close_flushes(loop):
+    engine = _Engine(loop)
+    cache = TransformCache(engine.write, flush_interval=60, loop=loop)
+    cache.start()
+    cache.move('a', position=[1, 0, 0])
+    loop.run_until_complete(cache.close())
+    assert engine.written == [{'a': ([1, 0, 0], None, None)}]
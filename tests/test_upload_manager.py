@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import pytest
+
+from session_server import upload_manager
+
+CHUNK = upload_manager.UploadManager.MIN_CHUNK_SIZE
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture
+def uploads(tmp_path, loop):
+    return upload_manager.UploadManager(str(tmp_path), loop)
+
+def _reader(data):
+    data = [data]
+    async def read_chunk(max_size):
+        chunk, data[0] = data[0][:max_size], data[0][max_size:]
+        return chunk
+    return read_chunk
+
+def _write(loop, uploads, upload_id, index, data):
+    return loop.run_until_complete(uploads.write_chunk(upload_id, index, _reader(data)))
+
+def test_create_invalid(loop, uploads):
+    for size, chunk_size in ((-1, None), (True, None), ('1', None),
+                             (uploads.MAX_SIZE + 1, None), (1, CHUNK - 1),
+                             (1, uploads.MAX_CHUNK_SIZE + 1), (1, True)):
+        with pytest.raises(upload_manager.UploadError):
+            loop.run_until_complete(uploads.create(size, chunk_size))
+    upload = loop.run_until_complete(uploads.create(uploads.MAX_SIZE))
+    assert upload['Chunks'] == uploads.MAX_SIZE // uploads.CHUNK_SIZE
+
+def test_upload(loop, uploads):
+    data = os.urandom(2 * CHUNK + 10)
+    upload = loop.run_until_complete(uploads.create(len(data), CHUNK))
+    assert upload['Chunks'] == 3 and upload['Received'] == []
+    # Chunks may be sent in any order and repeated
+    for index in (2, 0, 1, 0):
+        chunk = _write(loop, uploads, upload['Id'], index,
+                       data[index * CHUNK:(index + 1) * CHUNK])
+        assert chunk['Index'] == index
+    status = loop.run_until_complete(uploads.status(upload['Id']))
+    assert status['Received'] == [0, 1, 2]
+    temp_path, digest = loop.run_until_complete(uploads.commit(upload['Id']))
+    assert digest == hashlib.sha256(data).hexdigest()
+    with open(temp_path, 'rb') as fp:
+        assert fp.read() == data
+    loop.run_until_complete(uploads.finish(upload['Id'], True))
+    assert loop.run_until_complete(uploads.status(upload['Id'])) is None
+
+def test_empty_upload(loop, uploads):
+    upload = loop.run_until_complete(uploads.create(0))
+    assert upload['Chunks'] == 1
+    _write(loop, uploads, upload['Id'], 0, b'')
+    temp_path, digest = loop.run_until_complete(uploads.commit(upload['Id']))
+    assert digest == hashlib.sha256(b'').hexdigest()
+
+def test_invalid_chunks(loop, uploads):
+    upload = loop.run_until_complete(uploads.create(CHUNK + 1, CHUNK))
+    for index, data in ((2, b'x'), (-1, b'x'), (1, b'xx'), (1, b''), (0, b'x' * (CHUNK + 1))):
+        with pytest.raises(upload_manager.UploadError):
+            _write(loop, uploads, upload['Id'], index, data)
+    assert _write(loop, uploads, 'f' * 32, 0, b'x') is False
+    assert _write(loop, uploads, '../x', 0, b'x') is False
+    status = loop.run_until_complete(uploads.status(upload['Id']))
+    assert status['Received'] == []
+
+def test_commit_missing_chunks(loop, uploads):
+    upload = loop.run_until_complete(uploads.create(20 * CHUNK, CHUNK))
+    _write(loop, uploads, upload['Id'], 3, b'x' * CHUNK)
+    with pytest.raises(upload_manager.UploadError) as error:
+        loop.run_until_complete(uploads.commit(upload['Id']))
+    assert str(error.value) == '19 missing chunks, first: [0, 1, 2, 4, 5, 6, 7, 8, 9, 10]'
+    # The upload can be completed afterwards
+    assert loop.run_until_complete(uploads.status(upload['Id']))['Received'] == [3]
+
+def test_commit_unused(loop, uploads):
+    upload = loop.run_until_complete(uploads.create(1, CHUNK))
+    _write(loop, uploads, upload['Id'], 0, b'x')
+    loop.run_until_complete(uploads.commit(upload['Id']))
+    assert loop.run_until_complete(uploads.commit(upload['Id'])) is None
+    loop.run_until_complete(uploads.finish(upload['Id'], False))
+    assert loop.run_until_complete(uploads.commit(upload['Id'])) is not None
+
+def test_abort(loop, uploads):
+    upload = loop.run_until_complete(uploads.create(1, CHUNK))
+    assert loop.run_until_complete(uploads.abort(upload['Id']))
+    assert not loop.run_until_complete(uploads.abort(upload['Id']))
+    assert not loop.run_until_complete(uploads.abort('../x'))
+
+def test_collect(tmp_path, loop, uploads):
+    old = loop.run_until_complete(uploads.create(1, CHUNK))
+    new = loop.run_until_complete(uploads.create(1, CHUNK))
+    staged = tmp_path / 'tmpabc'
+    staged.write_bytes(b'x')
+    recent = tmp_path / 'tmpdef'
+    recent.write_bytes(b'x')
+    expired = time.time() - uploads.EXPIRY - 1
+    os.utime(str(tmp_path / uploads.DIR / old['Id']), (expired, expired))
+    os.utime(str(staged), (expired, expired))
+    assert uploads.collect() == 2
+    assert loop.run_until_complete(uploads.status(old['Id'])) is None
+    assert loop.run_until_complete(uploads.status(new['Id'])) is not None
+    assert not staged.exists()
+    assert recent.exists()
+    assert (tmp_path / uploads.DIR).is_dir()
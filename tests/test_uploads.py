@@ -0,0 +1,41 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from session_server.uploads import discard_upload, stage_upload, staging_dir
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+def _reader(chunks):
+    chunks = list(chunks)
+    async def read_chunk(size):
+        chunk = chunks.pop(0)
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+    return read_chunk
+
+def test_stage_upload(tmp_path, loop):
+    directory = staging_dir(str(tmp_path))
+    path, digest = loop.run_until_complete(
+        stage_upload(_reader([b'abc', b'def', b'']), directory, loop=loop))
+    assert os.path.dirname(path) == directory
+    assert open(path, 'rb').read() == b'abcdef'
+    assert digest == hashlib.sha256(b'abcdef').hexdigest()
+    loop.run_until_complete(discard_upload(path, loop=loop))
+    assert os.listdir(directory) == []
+    # Missing files are ignored
+    loop.run_until_complete(discard_upload(path, loop=loop))
+
+def test_failed_upload_is_removed(tmp_path, loop):
+    directory = staging_dir(str(tmp_path))
+    with pytest.raises(ConnectionError):
+        loop.run_until_complete(
+            stage_upload(_reader([b'abc', ConnectionError()]), directory, loop=loop))
+    assert os.listdir(directory) == []
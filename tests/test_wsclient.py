@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+from session_server.wsclient import WSClient
+
+class _WebSocket:
+    remote_address = ('127.0.0.1', 1234)
+    subprotocol = None
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        # Sending blocks until the test allows it
+        self.ready = asyncio.Event()
+
+    async def send(self, message):
+        await self.ready.wait()
+        self.sent.append(json.loads(message))
+
+    async def close(self, code, reason):
+        self.closed = code
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+@pytest.fixture
+def websocket(loop):
+    return _WebSocket()
+
+@pytest.fixture
+def client(loop, websocket):
+    client = WSClient(websocket, 1, loop)
+    client.start()
+    yield client
+    loop.run_until_complete(client.close())
+
+def _move(uid, **fields):
+    message = {'Event': 'ITEM_MOVED', 'Uid': uid, **fields}
+    return message, json.dumps(message)
+
+def _drain(loop, websocket):
+    websocket.ready.set()
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+def test_queued_moves_are_coalesced(loop, websocket, client):
+    client.send_move('a', *_move('a', Position=[1, 1, 1]))
+    client.send_move('b', *_move('b', Position=[2, 2, 2]))
+    client.send_move('a', *_move('a', Scale=[3, 3, 3]))
+    client.send_move('a', *_move('a', Position=[4, 4, 4]))
+    assert client.queue_size == 2
+    assert client.dropped_moves == 2
+    _drain(loop, websocket)
+    assert websocket.sent == [
+        {'Seq': 1, 'Event': 'ITEM_MOVED', 'Uid': 'a', 'Position': [4, 4, 4], 'Scale': [3, 3, 3]},
+        {'Seq': 2, 'Event': 'ITEM_MOVED', 'Uid': 'b', 'Position': [2, 2, 2]}]
+
+def test_moves_are_not_merged_across_messages(loop, websocket, client):
+    client.send_move('a', *_move('a', Position=[1, 1, 1]))
+    client.send(json.dumps({'Event': 'ITEM_REMOVED', 'Uid': 'b'}))
+    client.send_move('a', *_move('a', Position=[2, 2, 2]))
+    assert client.queue_size == 3
+    _drain(loop, websocket)
+    assert [(message['Seq'], message['Event']) for message in websocket.sent] == \
+        [(1, 'ITEM_MOVED'), (2, 'ITEM_REMOVED'), (3, 'ITEM_MOVED')]
+
+def test_client_over_max_queue_is_disconnected(loop, websocket, client):
+    client.HIGH_WATER = 2
+    client.MAX_QUEUE = 4
+    for i in range(5):
+        client.send(json.dumps({'Event': 'TEST', 'Index': i}))
+    _drain(loop, websocket)
+    assert websocket.closed == 1008
+    assert client.queue_size == 0
+    # At most the message which was being sent is delivered
+    assert len(websocket.sent) <= 1
+
+def test_client_over_high_water_is_disconnected_after_timeout(loop, websocket, client):
+    client.HIGH_WATER = 2
+    client.HIGH_WATER_TIMEOUT = 0.05
+    for i in range(4):
+        client.send(json.dumps({'Event': 'TEST', 'Index': i}))
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert websocket.closed is None
+    client.send(json.dumps({'Event': 'TEST', 'Index': 4}))
+    loop.run_until_complete(asyncio.sleep(0))
+    assert websocket.closed == 1008
+
+def test_client_below_high_water_is_kept(loop, websocket, client):
+    client.HIGH_WATER = 2
+    client.HIGH_WATER_TIMEOUT = 0.05
+    for i in range(4):
+        client.send(json.dumps({'Event': 'TEST', 'Index': i}))
+    loop.run_until_complete(asyncio.sleep(0.1))
+    _drain(loop, websocket)
+    client.send(json.dumps({'Event': 'TEST', 'Index': 4}))
+    _drain(loop, websocket)
+    assert websocket.closed is None
+    assert [message['Index'] for message in websocket.sent] == [0, 1, 2, 3, 4]
+
+def test_batched_moves_are_sent_in_one_message(loop, websocket, client):
+    client.set_move_batching(True)
+    client.send_move('a', *_move('a', Position=[1, 1, 1]))
+    client.send_move('b', *_move('b', Position=[2, 2, 2]))
+    client.send_move('a', *_move('a', Rotation=[0, 0, 0, 1]))
+    assert client.queue_size == 0
+    client.flush_moves()
+    # Moves of the next interval extend the batch which has not been sent
+    client.send_move('b', *_move('b', Position=[3, 3, 3]))
+    client.flush_moves()
+    assert client.queue_size == 1
+    assert client.dropped_moves == 2
+    _drain(loop, websocket)
+    assert websocket.sent == [{'Seq': 1, 'Event': 'ITEM_MOVED_BATCH', 'Items': [
+        {'Uid': 'a', 'Position': [1, 1, 1], 'Rotation': [0, 0, 0, 1]},
+        {'Uid': 'b', 'Position': [3, 3, 3]}]}]
+
+def test_batched_moves_are_sent_before_messages(loop, websocket, client):
+    client.set_move_batching(True)
+    client.send_move('a', *_move('a', Position=[1, 1, 1]))
+    client.send(json.dumps({'Event': 'ITEM_REMOVED', 'Uid': 'a'}))
+    client.send_move('b', *_move('b', Position=[2, 2, 2]))
+    client.set_move_batching(False)
+    _drain(loop, websocket)
+    assert [(message['Event'], message.get('Uid')) for message in websocket.sent] == \
+        [('ITEM_MOVED_BATCH', None), ('ITEM_REMOVED', 'a'), ('ITEM_MOVED_BATCH', None)]
+    assert [item['Uid'] for item in websocket.sent[2]['Items']] == ['b']